@@ -1,12 +1,27 @@
+import time
+RUN_STARTED = time.perf_counter()  # 本次脚本运行的计时起点 (含首次运行时的模块导入)
+
 import streamlit as st
 import pandas as pd
-import psycopg2
-import hanlp
-import re
-import time
-from datetime import datetime
-from streamlit_agraph import agraph, Node, Edge, Config
-import plotly.express as px
+import os
+import subprocess
+import sys
+
+from db import create_pool
+from dedup import duplicate_stats
+from ingest import SUPPORTED_TYPES, ingest_file
+from nlp import DEFAULT_BATCH_SIZE
+from pipeline import (RETRY_LIMIT, STATUS_DONE, STATUS_FAILED, STATUS_PENDING, STATUS_RUNNING, STATUS_TRIAGED,
+                      active_workers, requeue_stale, status_counts)
+from graph import DEFAULT_MAX_CLUES, LOD_THRESHOLD, add_cooccurrence, build_graph, collapse_leaves, records
+from graph_index import CooccurrenceIndex, cooccurrence_version
+from instrument import (cache_stats, counted, enable, jsonl_text, observe, prometheus_text, reset, snapshot,
+                        traced)
+from layout import CLIENT_PHYSICS_MAX, apply_layout
+from migrations import MigrationPending, migrate
+from queries import PAGE_SIZE, fetch_page
+from rollups import data_version, fetch_dashboard
+from search import MIN_TRGM_LEN, short_keyword
 
 # ==========================================
 # 1. 系统配置
@@ -47,349 +62,443 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ==========================================
-# 2. 数据库配置
+# 2. 核心逻辑 (DB Pool & Init)
 # ==========================================
-DB_CONFIG = {
-    'dbname': 'Test',
-    'user': 'postgres',
-    'password': 'root',
-    'host': 'localhost',
-    'port': '5432'
-}
+@st.cache_resource
+def get_db_pool():
+    # 进程级连接池，所有会话共享；借出的连接在 with 块结束时必定归还
+    return create_pool()
 
 
-def get_db_conn():
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
-    except Exception:
-        return None
+@st.cache_resource
+def ensure_schema():
+    # 每个进程只执行一次版本化迁移；失败或有待手动执行的版本时不缓存，下次运行重试
+    with get_db_pool().connection() as conn:
+        result = migrate(conn, manual=False)
+    if result['pending']:
+        raise MigrationPending(result['pending'])
+    return result
+
+
+@st.cache_resource
+def get_process_info():
+    # 进程级计时，记录首次完整渲染 (冷启动) 耗时
+    return {'cold_start': None}
+
+
+try:
+    schema_info = ensure_schema()
+    for warning in schema_info['warnings']:
+        st.warning(warning)
+except MigrationPending as e:
+    # 之后的代码依赖新的表结构，升级完成前不渲染
+    st.error(f"⚠️ {e}")
+    st.stop()
+except Exception as e:
+    schema_info = {'applied': [], 'warnings': [], 'seconds': 0.0}
+    st.error(f"DB Init Error: {e}")
 
 
 # ==========================================
-# 3. 核心逻辑 (NLP & DB Init)
+# 3. 数据管道
 # ==========================================
-@st.cache_resource
-def load_nlp_model():
-    try:
-        with st.spinner('正在加载 NLP 神经元网络...'):
-            tok = hanlp.load(hanlp.pretrained.tok.COARSE_ELECTRA_SMALL_ZH)
-            ner = hanlp.load(hanlp.pretrained.ner.MSRA_NER_ELECTRA_SMALL_ZH)
-        return tok, ner
-    except:
-        return None, None
+def save_excel_to_db(uploaded_file):
+    # 流式逐批入库，进度按已读取行数推进，峰值内存与文件大小无关
+    bar = st.progress(0.0, text="正在读取...")
 
+    def on_progress(rows, fraction):
+        if fraction is not None:
+            bar.progress(fraction, text=f"已入库 {rows} 行")
 
-def init_db_structure():
-    conn = get_db_conn()
-    if not conn: return
     try:
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS t_clues (
-                id SERIAL PRIMARY KEY, source_email VARCHAR(150), batch_no VARCHAR(100),
-                send_time TIMESTAMP, content TEXT, subject VARCHAR(255), recorder VARCHAR(100),
-                remarks TEXT, original_file VARCHAR(255), process_status SMALLINT DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, org VARCHAR(200)
-            );
-        """)
-        cur.execute("ALTER TABLE t_clues ADD COLUMN IF NOT EXISTS org VARCHAR(200);")
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS t_entities (
-                id SERIAL PRIMARY KEY, name VARCHAR(200) NOT NULL, type VARCHAR(50) NOT NULL,
-                UNIQUE(name, type)
-            );
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS t_relations (
-                clue_id INT REFERENCES t_clues(id), entity_id INT REFERENCES t_entities(id),
-                PRIMARY KEY (clue_id, entity_id)
-            );
-        """)
-        conn.commit()
-        conn.close()
+        with get_db_pool().connection() as conn:
+            result = ingest_file(uploaded_file, filename=uploaded_file.name, conn=conn, on_progress=on_progress)
     except Exception as e:
-        st.error(f"DB Init Error: {e}")
+        return {'inserted': 0, 'rows': 0, 'duplicates': 0, 'chunks': [], 'errors': [f"数据库连接失败: {e}"]}
+    # 入库已递增所涉 (机构, 日期) 的数据版本，相关查询缓存随之失效，无需清空
+    bar.progress(1.0, text=f"已读取 {result['rows']} 行")
+    return result
+
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker.py')
+# 页面启动的 worker 输出追加到该日志，出错退出时可据此排查
+WORKER_LOG = os.getenv('DEEPTRACE_WORKER_LOG', os.path.join(os.path.dirname(WORKER_SCRIPT), 'worker.log'))
 
 
-tok, ner = load_nlp_model()
-init_db_structure()
+def launch_worker(batch_size, workers, threads, rules_only=False, rescan=False):
+    # 分析在独立进程中运行，页面刷新或关闭不会中断；已领取的批次按批提交
+    with open(WORKER_LOG, 'ab') as log:
+        subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT, '--drain', '--batch-size', str(batch_size),
+             '--workers', str(workers), '--threads', str(threads)] + (['--rules-only'] if rules_only else [])
+            + (['--rescan'] if rescan else []),
+            cwd=os.path.dirname(WORKER_SCRIPT), stdout=log, stderr=subprocess.STDOUT,
+            start_new_session=True)
 
 
 # ==========================================
-# 4. 数据管道
+# 4. 数据查询 (Cache)
 # ==========================================
-def save_excel_to_db(uploaded_file):
-    conn = get_db_conn()
-    if not conn: return 0
+# 查询缓存不设 TTL，以数据版本作为缓存键的一部分：入库 / 分析只改变所涉机构、日期的版本，
+# 其余查询继续命中缓存；版本存于 Postgres，多个应用进程判定一致。max_entries 限制内存占用。
+# 埋点 (见 instrument.py)：外层 counted 统计调用次数，内层 traced 只在缓存未命中时计时，两者之差即命中次数。
+# 缓存函数内部不捕获异常：st.cache_data 不缓存异常，否则一次超时返回的空结果会一直保留到数据版本变化；
+# 由调用方通过 load_or 回退，下一次重跑重新查询。
+def load_or(fallback, fn, *args, **kwargs):
     try:
-        df = pd.read_excel(uploaded_file)
-        col_map = {
-            '来源邮箱': 'source_email', '发件人': 'source_email', '邮箱': 'source_email',
-            '批次': 'batch_no', '收发日期': 'send_time', '时间': 'send_time',
-            '邮件内容': 'content', '正文': 'content', '邮件名': 'subject', '标题': 'subject', '主题': 'subject',
-            '记录人': 'recorder', '备注': 'remarks', '原件名': 'original_file', '机构': 'org'
-        }
-        df.rename(columns=col_map, inplace=True)
-        cur = conn.cursor()
-        count = 0
-        for _, row in df.iterrows():
-            send_time = row.get('send_time') if pd.notna(row.get('send_time')) else datetime.now()
-            cur.execute("""
-                INSERT INTO t_clues (source_email, batch_no, send_time, content, subject, recorder, remarks, original_file, process_status, org)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 0, %s)
-            """, (
-                row.get('source_email'), row.get('batch_no'), send_time,
-                row.get('content'), row.get('subject'), row.get('recorder'),
-                row.get('remarks'), row.get('original_file'), row.get('org')
-            ))
-            count += 1
-        conn.commit()
-        conn.close()
-        get_org_options.clear()
-        get_time_options_by_org.clear()
-        get_analytics_data.clear()
-        return count
+        return fn(*args, **kwargs)
     except Exception:
-        return 0
-
-
-def run_analysis_pipeline():
-    if not tok or not ner: return 0
-    conn = get_db_conn()
-    if not conn: return 0
-    cur = conn.cursor()
-    cur.execute("SELECT id, content, subject, source_email FROM t_clues WHERE process_status = 0")
-    rows = cur.fetchall()
-    if not rows:
-        conn.close()
-        return 0
-
-    processed_count = 0
-    bar = st.progress(0)
-    for i, row in enumerate(rows):
-        cid, content, subject, email = row
-        text = f"{subject or ''} {content or ''} {email or ''}"
-        entities = set()
-        try:
-            for term, label in ner(tok(text), tasks='ner*'):
-                if len(term) > 1 and label in ['PERSON', 'PER', 'ORG', 'ORGANIZATION', 'LOC', 'LOCATION']:
-                    std_label = '人名' if label in ['PERSON', 'PER'] else '机构' if label in ['ORG',
-                                                                                              'ORGANIZATION'] else '地名'
-                    entities.add((term, std_label))
-            phones = re.findall(r'(?<!\d)1[3-9]\d{9}(?!\d)', text)
-            for p in phones: entities.add((p, '手机号'))
-
-            for name, etype in entities:
-                cur.execute(
-                    "INSERT INTO t_entities (name, type) VALUES (%s, %s) ON CONFLICT (name, type) DO UPDATE SET name=EXCLUDED.name RETURNING id",
-                    (name, etype))
-                eid = cur.fetchone()[0]
-                cur.execute("INSERT INTO t_relations (clue_id, entity_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
-                            (cid, eid))
-            cur.execute("UPDATE t_clues SET process_status = 1 WHERE id = %s", (cid,))
-        except:
-            cur.execute("UPDATE t_clues SET process_status = -1 WHERE id = %s", (cid,))
-        processed_count += 1
-        bar.progress((i + 1) / len(rows))
-    conn.commit()
-    conn.close()
-    get_analytics_data.clear()
-    return processed_count
+        return fallback
 
 
-# ==========================================
-# 5. 数据查询 (Cache)
-# ==========================================
-@st.cache_data(ttl=600)
-def get_org_options():
-    conn = get_db_conn()
-    if not conn: return ["全部机构"]
-    try:
-        df = pd.read_sql("SELECT DISTINCT org FROM t_clues WHERE org IS NOT NULL AND org != '' ORDER BY org", conn)
-        conn.close()
-        return ["全部机构"] + df['org'].tolist()
-    except:
-        return ["全部机构"]
+@traced("db.get_data_version")
+def get_data_version(org="全部机构", date_from="全部时间", date_to="全部时间"):
+    with get_db_pool().connection() as conn:
+        return data_version(conn, org, date_from, date_to)
 
 
-# 恢复：根据机构筛选时间字符串列表
-@st.cache_data(ttl=600)
-def get_time_options_by_org(selected_org):
-    conn = get_db_conn()
-    if not conn: return ["全部时间"]
-    try:
-        sql = "SELECT DISTINCT TO_CHAR(send_time, 'YYYY-MM-DD') as d FROM t_clues WHERE send_time IS NOT NULL"
-        params = []
-        if selected_org != "全部机构":
-            sql += " AND org = %s"
-            params.append(selected_org)
-        sql += " ORDER BY d DESC"
+@counted("get_org_options")
+@st.cache_data(max_entries=4)
+@traced("db.get_org_options")
+def get_org_options(version):
+    with get_db_pool().connection() as conn:
+        df = pd.read_sql("SELECT DISTINCT org FROM t_clue_days WHERE org != '' AND clue_count > 0 ORDER BY org",
+                         conn)
+    return ["全部机构"] + df['org'].tolist()
+
+
+# 根据机构列出有线索的日期，读取按 (机构, 日期) 维护的 t_clue_days
+@counted("get_time_options_by_org")
+@st.cache_data(max_entries=64)
+@traced("db.get_time_options_by_org")
+def get_time_options_by_org(selected_org, version):
+    sql = "SELECT DISTINCT day FROM t_clue_days WHERE clue_count > 0"
+    params = []
+    if selected_org != "全部机构":
+        sql += " AND org = %s"
+        params.append(selected_org)
+    sql += " ORDER BY day DESC"
+    with get_db_pool().connection() as conn:
         df = pd.read_sql(sql, conn, params=params)
-        conn.close()
-        return ["全部时间"] + df['d'].tolist()
+    return ["全部时间"] + [d.isoformat() for d in df['day']]
+
+
+@counted("get_analytics_data")
+@st.cache_data(max_entries=128)
+@traced("db.get_analytics_data")
+def get_analytics_data(keyword, org, date_from, date_to, ranked=False, cursor=None, page_size=PAGE_SIZE,
+                       version=None):
+    # 键集分页：cursor 为上一页最后一行的排序键，列表只取轻量列，正文由 get_clue_content 按需加载
+    with get_db_pool().connection() as conn:
+        return fetch_page(conn, keyword, org, date_from, date_to, ranked, cursor, page_size)
+
+
+@counted("get_dashboard_stats")
+@st.cache_data(max_entries=64)
+@traced("db.get_dashboard_stats")
+def get_dashboard_stats(keyword, org, date_from, date_to, version=None):
+    # 看板 / 时序统计覆盖全部筛选结果：无关键词读汇总表，有关键词对全部命中线索聚合
+    with get_db_pool().connection() as conn:
+        return fetch_dashboard(conn, keyword, org, date_from, date_to)
+
+
+@counted("get_clue_content")
+@st.cache_data(max_entries=256)
+@traced("db.get_clue_content")
+def get_clue_content(clue_id, send_time):
+    # 最近打开的线索正文缓存在进程内 (LRU，最多 256 条)，不再随检索结果整体存放；正文入库后不变
+    # send_time 为分区键 (ISO 格式字符串)，附带后只访问该月份的分区
+    with get_db_pool().connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT content FROM t_clues WHERE id=%s AND send_time=%s::timestamp", (clue_id, send_time))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+@traced("db.get_node_detail")
+def get_node_detail(node_id):
+    if not node_id: return None
+    info = {}
+    try:
+        with get_db_pool().connection() as conn:
+            cur = conn.cursor()
+            if node_id.startswith("MAIL_"):
+                _, cid, send_time = node_id.split("_", 2)
+                cur.execute("SELECT subject, send_time, source_email, org FROM t_clues "
+                            "WHERE id=%s AND send_time=%s::timestamp", (cid, send_time))
+                row = cur.fetchone()
+                if row:
+                    info = {
+                        "type": "mail", "title": row[0],
+                        "meta": [("📅 时间", str(row[1])[:19]), ("🏢 机构", row[3]), ("📧 发件人", row[2])],
+                    }
+            elif node_id.startswith("ENT_"):
+                eid = node_id.split("_")[1]
+                cur.execute("SELECT name, type FROM t_entities WHERE id=%s", (eid,))
+                row = cur.fetchone()
+                if row:
+                    info = {"type": "entity", "title": row[0], "meta": [("🏷️ 类型", row[1])], "body": None}
     except:
-        return ["全部时间"]
+        pass
+    # 正文在归还连接之后读取：get_clue_content 未命中缓存时要从连接池再取一个连接
+    if info.get("type") == "mail":
+        info["body"] = load_or(None, get_clue_content, int(cid), send_time)
+    return info
 
 
-@st.cache_data(ttl=300)
-def get_analytics_data(keyword, org, date_val):
-    conn = get_db_conn()
-    if not conn: return None
+EXPAND_MAX_NODES = 120  # 单个实体展开时最多加入的邻域实体数
+PATH_MAX_DEPTH = 6      # 最短路径搜索的最大跳数
 
-    conditions = ["1=1"]
-    params = []
 
-    if org != "全部机构":
-        conditions.append("c.org = %s")
-        params.append(org)
+@traced("db.get_cooccurrence_version")
+def get_cooccurrence_version():
+    with get_db_pool().connection() as conn:
+        return cooccurrence_version(conn)
 
-    # 恢复：精确匹配某一天 或 全部时间
-    if date_val != "全部时间":
-        conditions.append("TO_CHAR(c.send_time, 'YYYY-MM-DD') = %s")
-        params.append(date_val)
 
-    if keyword:
-        conditions.append("(c.content LIKE %s OR c.subject LIKE %s OR e.name LIKE %s)")
-        wildcard = f'%{keyword}%'
-        params.extend([wildcard, wildcard, wildcard])
+@counted("get_cooccurrence_index")
+@st.cache_resource(max_entries=1)
+@traced("db.get_cooccurrence_index")
+def get_cooccurrence_index(version):
+    # 进程内共享的 CSR 共现索引，k 跳邻域 / 最短路径查询不再访问数据库；
+    # version 为共现版本 (见 graph_index.py)，只在共现计数变化时重新加载，入库、去重等其他写入不影响
+    with get_db_pool().connection() as conn:
+        return CooccurrenceIndex.load(conn)
 
-    where_clause = " AND ".join(conditions)
-    data = {}
 
-    try:
-        sql_clues = f"""
-            SELECT DISTINCT c.id, c.subject, c.send_time, c.org, c.source_email, c.content
-            FROM t_clues c
-            LEFT JOIN t_relations r ON c.id = r.clue_id
-            LEFT JOIN t_entities e ON r.entity_id = e.id
-            WHERE {where_clause}
-            ORDER BY c.send_time DESC LIMIT 300
-        """
-        data['clues'] = pd.read_sql(sql_clues, conn, params=params)
-
-        if not data['clues'].empty:
-            ids = tuple(data['clues']['id'].tolist())
-            if len(ids) == 1: ids = (ids[0], ids[0])
-
-            sql_ent = f"""
-                SELECT e.name, e.type, COUNT(*) as weight
-                FROM t_entities e
-                JOIN t_relations r ON e.id = r.entity_id
-                WHERE r.clue_id IN {ids}
-                GROUP BY e.name, e.type
-                ORDER BY weight DESC LIMIT 100
-            """
-            data['entities'] = pd.read_sql(sql_ent, conn)
-
-            top_ids = tuple(data['clues']['id'].head(50).tolist())
-            if len(top_ids) == 1: top_ids = (top_ids[0], top_ids[0])
-            sql_rel = f"""
-                SELECT r.clue_id, e.id as eid, e.name, e.type 
-                FROM t_relations r JOIN t_entities e ON r.entity_id = e.id 
-                WHERE r.clue_id IN {top_ids} LIMIT 500
-            """
-            data['relations'] = pd.read_sql(sql_rel, conn)
-        else:
-            data['entities'] = pd.DataFrame()
-            data['relations'] = pd.DataFrame()
+@counted("get_entity_labels")
+@st.cache_data(max_entries=256)
+@traced("db.get_entity_labels")
+def get_entity_labels(entity_ids):
+    if not entity_ids: return {}
+    with get_db_pool().connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, name, type FROM t_entities WHERE id = ANY(%s)", (list(entity_ids),))
+        return {eid: (name, etype) for eid, name, etype in cur.fetchall()}
 
-        conn.close()
-        return data
-    except Exception:
-        conn.close()
-        return None
 
+LAYOUT_MODES = {"自动": "auto", "浏览器物理引擎": "client", "服务端预计算": "server"}
 
-def get_node_detail(node_id):
-    conn = get_db_conn()
-    if not conn or not node_id: return None
-    cur = conn.cursor()
-    info = {}
+
+@counted("get_graph_data")
+@st.cache_data(max_entries=64)
+@traced("db.get_graph_data")
+def get_graph_data(query, cursor, max_clues, expanded, path, layout_mode="auto", version=None, index_version=None):
+    # 按查询条件 + 页 + 展开状态 + 数据版本缓存图谱结构及坐标，点击节点等重跑无需重建
+    # index_version 为共现版本，仅在有共现扩展时传入，普通图谱不因共现计数变化而失效
+    data = get_analytics_data(*query, cursor=cursor, version=version)
+    if not data:
+        return {**build_graph(None, None), 'layout': 'client'}
+    graph = build_graph(data['clues'], data['relations'], max_clues)
+    if expanded or path:
+        graph = add_cooccurrence(graph, get_cooccurrence_index(index_version), dict(expanded), list(path),
+                                 get_entity_labels, max_nodes=EXPAND_MAX_NODES)
+
+    # 小图交给浏览器物理引擎；大图在服务端算好坐标并做叶子实体聚合
+    if layout_mode == "client" or (layout_mode == "auto" and len(graph['nodes']) <= CLIENT_PHYSICS_MAX):
+        return {**graph, 'layout': 'client'}
+    if len(graph['nodes']) > LOD_THRESHOLD:
+        graph = collapse_leaves(graph)
+    return {**apply_layout(graph), 'layout': 'server'}
+
+
+def render_entity_links(eid, entity_names):
+    # 详情面板中的实体链路操作：k 跳展开、共现排行、到图中其他实体的最短路径
     try:
-        if node_id.startswith("MAIL_"):
-            cid = node_id.split("_")[1]
-            cur.execute("SELECT subject, send_time, source_email, org, content FROM t_clues WHERE id=%s", (cid,))
-            row = cur.fetchone()
-            if row:
-                info = {
-                    "type": "mail", "title": row[0],
-                    "meta": [("📅 时间", str(row[1])[:19]), ("🏢 机构", row[3]), ("📧 发件人", row[2])],
-                    "body": row[4]
-                }
-        elif node_id.startswith("ENT_"):
-            eid = node_id.split("_")[1]
-            cur.execute("SELECT name, type FROM t_entities WHERE id=%s", (eid,))
-            row = cur.fetchone()
-            if row:
-                info = {"type": "entity", "title": row[0], "meta": [("🏷️ 类型", row[1])], "body": None}
-    except:
-        pass
-    conn.close()
-    return info
+        index = get_cooccurrence_index(get_cooccurrence_version())
+    except Exception:
+        st.caption("共现索引不可用")
+        return
+    top = index.neighbors(eid, limit=10)
+    if top:
+        labels = load_or({}, get_entity_labels, tuple(sorted(n for n, _ in top)))
+        st.caption("共现最多的实体")
+        rows = [(*labels.get(n, ("?", "?")), w) for n, w in top]
+        st.dataframe(pd.DataFrame(rows, columns=['实体', '类型', '共现邮件']),
+                     hide_index=True, use_container_width=True)
+    hop = st.slider("扩展跳数", 1, 3, st.session_state.expanded_entities.get(eid, 1), key=f"hop_{eid}")
+    if st.button("🔗 展开共现关系", use_container_width=True):
+        st.session_state.expanded_entities[eid] = hop
+        st.rerun()
+
+    targets = [t for t in entity_names if t != eid]
+    if targets:
+        target = st.selectbox("🧭 路径追踪至", targets, format_func=lambda t: entity_names[t])
+        if st.button("查找最短路径", use_container_width=True):
+            path = index.shortest_path(eid, target, max_depth=PATH_MAX_DEPTH)
+            if path:
+                st.session_state.entity_path = path
+                st.rerun()
+            else:
+                st.warning(f"{PATH_MAX_DEPTH} 跳内无共现路径")
 
 
 # ==========================================
-# 6. 前端 UI 构建
+# 5. 前端 UI 构建
 # ==========================================
 st.title("🦅 DeepTrace | 情报线索分析系统")
+timing_slot = st.empty()
+
+
+def report_timing():
+    # 在标题下方显示本次渲染耗时与进程冷启动耗时
+    elapsed = time.perf_counter() - RUN_STARTED
+    observe("page.render", elapsed)
+    info = get_process_info()
+    if info['cold_start'] is None:
+        info['cold_start'] = elapsed
+    timing_slot.caption(f"⏱️ 本次渲染 {elapsed:.2f} 秒 · 进程冷启动 {info['cold_start']:.2f} 秒 · "
+                        f"结构迁移检查 {schema_info['seconds']:.2f} 秒")
+
+
+def data_version_or_stop(*args):
+    # 数据版本是查询缓存键的一部分，取不到时不能以 None 代替 (会与其他失败的查询共用缓存项)
+    try:
+        return get_data_version(*args)
+    except Exception:
+        st.error("⚠️ 数据库暂时不可用，请稍后刷新")
+        report_timing()
+        st.stop()
 
 # --- A. 数据管理区 ---
 with st.expander("📂 数据管理中心 (展开/收起)", expanded=True):
     col_admin1, col_admin2 = st.columns([1, 1])
     with col_admin1:
         st.markdown("#### 📥 线索入库")
-        up_file = st.file_uploader("上传 Excel 文件", type="xlsx", label_visibility="collapsed")
+        up_file = st.file_uploader("上传线索文件 (xlsx / csv / jsonl)", type=SUPPORTED_TYPES,
+                                   label_visibility="collapsed")
         if up_file and st.button("确认导入", type="primary"):
-            n = save_excel_to_db(up_file)
-            if n:
-                st.success(f"成功入库 {n} 条！")
-                time.sleep(1)
-                st.rerun()
+            result = save_excel_to_db(up_file)
+            for err in result['errors']:
+                st.error(err)
+            if result['inserted']:
+                st.success(f"成功入库 {result['inserted']} 条！其中近重复 {result['duplicates']} 条")
+                if not result['errors']:
+                    time.sleep(1)
+                    st.rerun()
 
     with col_admin2:
         st.markdown("#### 🧠 智能分析状态")
-        pending_count = 0
-        conn_check = get_db_conn()
-        if conn_check:
-            try:
-                curr = conn_check.cursor()
-                curr.execute("SELECT COUNT(*) FROM t_clues WHERE process_status = 0")
-                pending_count = curr.fetchone()[0]
-            except:
-                pass
-            finally:
-                conn_check.close()
-
-        if pending_count > 0:
-            st.warning(f"⚠️ {pending_count} 条线索待分析")
-            if st.button(f"🚀 立即运行 AI 分析 ({pending_count})", type="primary", use_container_width=True):
-                with st.spinner("正在提取实体关系..."):
-                    n = run_analysis_pipeline()
-                st.success(f"完成！新增 {n} 组关系")
+        counts, workers_online, dup_info = {}, [], None
+        try:
+            with get_db_pool().connection() as conn_check:
+                counts = status_counts(conn_check)
+                workers_online = active_workers(conn_check)
+                dup_info = duplicate_stats(conn_check)
+        except:
+            pass
+        pending_count = counts.get(STATUS_PENDING, 0)
+        running_count = counts.get(STATUS_RUNNING, 0)
+        done_count = counts.get(STATUS_DONE, 0)
+        failed_count = counts.get(STATUS_FAILED, 0)
+        triaged_count = counts.get(STATUS_TRIAGED, 0)
+
+        cpu_total = os.cpu_count() or 1
+        n1, n2, n3 = st.columns(3)
+        nlp_batch = n1.number_input("NLP 批大小 (句)", min_value=1, max_value=512,
+                                    value=DEFAULT_BATCH_SIZE, step=8)
+        nlp_workers = n2.number_input("抽取进程数", min_value=1, max_value=cpu_total, value=1)
+        nlp_threads = n3.number_input("每进程线程数", min_value=1, max_value=cpu_total, value=1)
+        rules_only = st.toggle("⚡ 仅规则抽取 (快速初筛)",
+                               help="只运行正则与关注名单匹配，不加载模型；初筛过的线索在之后的完整分析中补跑模型")
+        nlp_args = (int(nlp_batch), int(nlp_workers), int(nlp_threads), rules_only)
+        queued_count = pending_count if rules_only else pending_count + triaged_count
+        if queued_count > 0 or running_count > 0:
+            st.warning(f"⚠️ {pending_count} 条线索待分析 · {triaged_count} 条仅完成规则初筛 · {running_count} 条处理中")
+            total = pending_count + running_count + done_count + failed_count + triaged_count
+            st.progress((done_count + failed_count) / total if total else 0.0,
+                        text=f"已完成 {done_count} · 失败 {failed_count}")
+            b1, b2 = st.columns(2)
+            if b1.button(f"🚀 启动后台分析 ({queued_count})", type="primary", use_container_width=True):
+                launch_worker(*nlp_args)
+                st.toast("后台分析已启动")
                 time.sleep(1)
                 st.rerun()
+            if b2.button("🔄 刷新进度", use_container_width=True):
+                st.rerun()
         else:
             st.success("✅ 系统就绪")
-            if st.button("🔄 强制重扫"):
-                run_analysis_pipeline()
+            if failed_count:
+                st.caption(f"❗ {failed_count} 条线索分析失败，自动重试 {RETRY_LIMIT} 次后需强制重扫")
+            # 只重新分析抽取器版本不同或正文变化的线索，并重试失败线索；实体按差异更新，重扫期间图谱保持可用
+            if st.button("🔄 强制重扫", disabled=rules_only, help="关闭“仅规则抽取”后可用"):
+                try:
+                    with get_db_pool().connection() as conn_requeue:
+                        requeue_stale(conn_requeue)
+                except:
+                    pass
+                launch_worker(*nlp_args, rescan=True)
+                st.toast("后台重扫已启动")
+                time.sleep(1)
                 st.rerun()
 
+        if dup_info and dup_info['duplicates']:
+            st.caption(f"♻️ 近重复线索 {dup_info['duplicates']} 条 · {dup_info['groups']} 组，分析时复用规范线索的实体")
+
+        for w in workers_online:
+            st.caption(f"🖥️ {w['worker_id']} · 已分析 {w['processed']} 条 · "
+                       f"{w['docs_per_sec']:.1f} 篇/秒 · 失败 {w['failed']} 条")
+
+# --- 性能剖析 (进程内埋点，见 instrument.py) ---
+with st.expander("⏱️ 性能剖析", expanded=False):
+    snap = snapshot()
+    i1, i2, i3 = st.columns([1, 1, 1])
+    instrument_on = i1.toggle("启用埋点", value=snap['enabled'],
+                              help="作用于当前 Web 进程的全部会话；后台 worker 以 --metrics 参数导出")
+    slow_ms = i2.number_input("慢查询阈值 (毫秒)", min_value=0, value=int(snap['explain_slow_ms']), step=100,
+                              help="超过该耗时的只读查询重跑 EXPLAIN ANALYZE 并记录执行计划，0 为关闭")
+    if instrument_on != snap['enabled'] or slow_ms != snap['explain_slow_ms']:
+        enable(instrument_on, slow_ms)
+    if i3.button("🧹 清空统计", use_container_width=True):
+        reset()
+        st.rerun()
+
+    if not snap['spans'] and not snap['counters']:
+        st.caption("暂无数据：启用埋点后刷新页面即开始记录")
+    else:
+        spans = pd.DataFrame(snap['spans'])
+        spans[['total', 'avg', 'max']] *= 1000
+        st.dataframe(spans.rename(columns={'name': '区间', 'count': '次数', 'total': '总耗时 (ms)',
+                                           'avg': '平均 (ms)', 'max': '最大 (ms)'}),
+                     hide_index=True, use_container_width=True)
+        caches = cache_stats(snap)
+        if caches:
+            st.dataframe(pd.DataFrame(caches).rename(columns={'name': '缓存函数', 'calls': '调用', 'hits': '命中',
+                                                              'hit_rate': '命中率'}),
+                         hide_index=True, use_container_width=True)
+        others = {k: v for k, v in snap['counters'].items() if not k.startswith('calls.')}
+        if others:
+            st.caption(" · ".join(f"{k} {v}" for k, v in sorted(others.items())))
+        for q in reversed(snap['slow_queries']):
+            st.markdown(f"**{q['name']}** · {q['ms']} ms · {q['at']}")
+            st.code(q['plan'], language="text")
+        e1, e2 = st.columns(2)
+        e1.download_button("导出 Prometheus 文本", prometheus_text(snap), file_name="deeptrace_metrics.prom",
+                           use_container_width=True)
+        e2.download_button("导出 JSONL", jsonl_text(snap), file_name="deeptrace_metrics.jsonl",
+                           use_container_width=True)
+
 # --- B. 悬浮筛选条 (恢复 SelectBox) ---
+global_version = data_version_or_stop()
 st.markdown('<div class="filter-container">', unsafe_allow_html=True)
 c1, c2, c3, c4 = st.columns([1.5, 1.5, 3, 1])
 
 with c1:
-    org_list = get_org_options()
+    org_list = load_or(["全部机构"], get_org_options, global_version)
     sel_org = st.selectbox("🏢 归属机构", org_list)
 
 with c2:
-    # 恢复：下拉选择时间
-    time_list = get_time_options_by_org(sel_org)
-    sel_time = st.selectbox("📅 时间节点", time_list)
+    # 起止日期均可选 "全部时间" 表示不限；选同一天即单日查询
+    time_list = load_or(["全部时间"], get_time_options_by_org, sel_org, data_version_or_stop(sel_org))
+    t1, t2 = st.columns(2)
+    sel_from = t1.selectbox("📅 起始日期", time_list)
+    sel_to = t2.selectbox("📅 截止日期", time_list)
+    if "全部时间" not in (sel_from, sel_to) and sel_from > sel_to:
+        sel_from, sel_to = sel_to, sel_from
 
 with c3:
     search_keyword = st.text_input("🔍 全局侦查", placeholder="输入线索内容 / 人名 / 邮箱...")
+    rank_by_score = st.toggle("🎯 按相关度排序", help="标题命中 > 正文命中 > 关联实体命中")
 
 with c4:
     st.write("")
@@ -399,47 +508,80 @@ with c4:
 st.markdown('</div>', unsafe_allow_html=True)
 
 # --- C. 数据加载 ---
+# 会话中只保存查询条件与分页游标，结果本身由 get_analytics_data 的进程级缓存持有
 if 'selected_node_id' not in st.session_state:
     st.session_state.selected_node_id = None
-if 'analytics_data' not in st.session_state:
-    st.session_state.analytics_data = None
-
-if start_search or st.session_state.analytics_data is None:
-    with st.spinner("正在构建情报网络..."):
-        st.session_state.analytics_data = get_analytics_data(search_keyword, sel_org, sel_time)
-        st.session_state.selected_node_id = None
-
-data_bundle = st.session_state.analytics_data
+if 'analytics_query' not in st.session_state:
+    st.session_state.analytics_query = None
+if 'page_cursors' not in st.session_state:
+    st.session_state.page_cursors = [None]
+if 'expanded_entities' not in st.session_state:
+    st.session_state.expanded_entities = {}
+if 'entity_path' not in st.session_state:
+    st.session_state.entity_path = []
+
+if start_search or st.session_state.analytics_query is None:
+    st.session_state.analytics_query = (search_keyword, sel_org, sel_from, sel_to, rank_by_score)
+    st.session_state.page_cursors = [None]
+    st.session_state.selected_node_id = None
+    st.session_state.expanded_entities = {}
+    st.session_state.entity_path = []
+
+with st.spinner("正在构建情报网络..."):
+    # 只有查询范围内 (机构, 日期) 的数据变化时才会重新查询
+    query_version = data_version_or_stop(*st.session_state.analytics_query[1:4])
+    data_bundle = load_or(None, get_analytics_data, *st.session_state.analytics_query,
+                          cursor=st.session_state.page_cursors[-1], version=query_version)
+    stats = load_or(None, get_dashboard_stats, *st.session_state.analytics_query[:4], version=query_version)
 df_clues = data_bundle['clues'] if data_bundle else pd.DataFrame()
-df_ents = data_bundle['entities'] if data_bundle else pd.DataFrame()
+df_ents = stats['entities'] if stats else pd.DataFrame()
+df_timeline = stats['timeline'] if stats else pd.DataFrame()
+df_senders = stats['senders'] if stats else pd.DataFrame()
 df_rels = data_bundle.get('relations', pd.DataFrame()) if data_bundle else pd.DataFrame()
+next_cursor = data_bundle.get('next_cursor') if data_bundle else None
+page_no = len(st.session_state.page_cursors)
+
+if short_keyword(st.session_state.analytics_query[0]):
+    st.caption(f"ℹ️ 关键词少于 {MIN_TRGM_LEN} 个字符，只匹配同名实体；检索标题 / 正文请输入至少 {MIN_TRGM_LEN} 个字符")
 
 if df_clues.empty:
     st.info("👋 暂无数据，请检查筛选条件。")
+    report_timing()
     st.stop()
 
-# 核心指标
+# 核心指标 (全部筛选结果，列表与图谱为当前页)
 m1, m2, m3, m4 = st.columns(4)
-m1.metric("命中线索", f"{len(df_clues)}")
-m2.metric("涉及实体", f"{len(df_ents)}")
-if not df_clues.empty:
-    times = pd.to_datetime(df_clues['send_time'])
-    m3.metric("时间范围", f"{times.min():%m-%d} ~ {times.max():%m-%d}")
-    top_u = df_clues['source_email'].mode()[0] if not df_clues['source_email'].empty else "N/A"
+if stats:
+    m1.metric("命中线索", f"{stats['total']}", f"第 {page_no} 页", delta_color="off")
+    m2.metric("涉及实体", f"{stats['entity_total']}")
+    if stats['first_day'] is not None:
+        m3.metric("时间范围", f"{stats['first_day']:%m-%d} ~ {stats['last_day']:%m-%d}")
+    top_u = df_senders['email'].iloc[0] if not df_senders.empty else "N/A"
     m4.metric("核心人物", str(top_u)[:15] + ".." if len(str(top_u)) > 15 else str(top_u))
 
+p1, p2, _ = st.columns([1, 1, 6])
+if p1.button("⬅️ 上一页", disabled=page_no == 1, use_container_width=True):
+    st.session_state.page_cursors.pop()
+    st.session_state.selected_node_id = None
+    st.rerun()
+if p2.button("下一页 ➡️", disabled=next_cursor is None, use_container_width=True):
+    st.session_state.page_cursors.append(next_cursor)
+    st.session_state.selected_node_id = None
+    st.rerun()
+
 st.markdown("---")
 
 tab_dash, tab_graph, tab_time, tab_ent = st.tabs(["📊 统计看板", "🕸️ 关联侦查", "📅 时序分析", "👥 实体明细"])
 
+# plotly / streamlit_agraph 较重，推迟到渲染对应标签页时再导入，首屏 (数据管理、筛选条) 不必等待
 with tab_dash:
+    import plotly.express as px
+
     c1, c2 = st.columns(2)
     with c1:
         st.caption("发件人活跃度 TOP10")
-        if not df_clues.empty:
-            df_top = df_clues['source_email'].value_counts().reset_index().head(10)
-            df_top.columns = ['email', 'count']
-            st.plotly_chart(px.bar(df_top, x='count', y='email', orientation='h'), use_container_width=True)
+        if not df_senders.empty:
+            st.plotly_chart(px.bar(df_senders, x='count', y='email', orientation='h'), use_container_width=True)
     with c2:
         st.caption("实体关键词分布")
         if not df_ents.empty:
@@ -447,36 +589,53 @@ with tab_dash:
 
 # === 核心修改部分：增强图谱配置，确保居中显示 ===
 with tab_graph:
+    from streamlit_agraph import Config, Edge, Node, agraph
+
     cg1, cg2 = st.columns([3, 1])
     with cg1:
         st.markdown("#### 交互式图谱")
-        nodes, edges = [], []
-        exist_ids = set()
-
-        if not df_clues.empty:
-            # 优先展示前 30 条线索，保证性能
-            for _, row in df_clues.head(30).iterrows():
-                nid = f"MAIL_{row['id']}"
-                if nid not in exist_ids:
-                    label = row['subject'][:6] + ".." if row['subject'] and len(row['subject']) > 6 else "无题"
-                    nodes.append(
-                        Node(id=nid, label=label, size=25, color="#3B82F6", shape="square", title=row['subject']))
-                    exist_ids.add(nid)
-
-            if not df_rels.empty:
-                for _, r in df_rels.iterrows():
-                    mnid = f"MAIL_{r['clue_id']}"
-                    enid = f"ENT_{r['eid']}"
-                    # 仅添加与现有线索关联的实体
-                    if mnid in exist_ids:
-                        if enid not in exist_ids:
-                            color = "#F59E0B" if r['type'] == '人名' else "#10B981" if r[
-                                                                                           'type'] == '地名' else "#8B5CF6"
-                            nodes.append(Node(id=enid, label=r['name'], size=15, color=color, shape="dot"))
-                            exist_ids.add(enid)
-                        edges.append(Edge(source=mnid, target=enid, color="#E5E7EB"))
+        gc1, gc2 = st.columns([3, 1])
+        max_graph_clues = gc1.slider("图谱线索数", 10, PAGE_SIZE, DEFAULT_MAX_CLUES, step=10)
+        layout_mode = LAYOUT_MODES[gc2.selectbox("布局引擎", list(LAYOUT_MODES))]
+        graph_args = (st.session_state.analytics_query, st.session_state.page_cursors[-1], max_graph_clues)
+        expand_args = (tuple(sorted(st.session_state.expanded_entities.items())), tuple(st.session_state.entity_path))
+        try:
+            graph = get_graph_data(*graph_args, *expand_args, layout_mode, query_version,
+                                   get_cooccurrence_version() if any(expand_args) else None)
+        except Exception:
+            st.warning("共现扩展加载失败，只显示当前页图谱")
+            graph = load_or({**build_graph(None, None), 'layout': 'client'}, get_graph_data,
+                            *graph_args, (), (), layout_mode, query_version)
+        nodes = [Node(**r) for r in records(graph['nodes'])]
+        edges = [Edge(**r) for r in records(graph['edges'])]
+        entity_names = graph['entity_names']
 
         # 核心修改：使用详细的物理引擎配置来确保图谱稳定和居中
+        physics = {
+            "enabled": True,
+            "stabilization": {
+                "enabled": True,
+                "iterations": 1000, # 预计算1000次布局
+                "fit": True,        # 稳定后强制适应视图
+                "updateInterval": 50,
+                "onlyDynamicEdges": False,
+            },
+            # 调整斥力参数，让节点散开，避免重叠
+            "barnesHut": {
+                "gravitationalConstant": -3000,
+                "centralGravity": 0.3,
+                "springLength": 95,
+                "springConstant": 0.04,
+                "damping": 0.09,
+                "avoidOverlap": 0.1
+            },
+            "minVelocity": 0.75
+        }
+        # 服务端已给出固定坐标时关闭物理引擎，浏览器只负责绘制
+        if graph['layout'] == 'server':
+            physics = {"enabled": False}
+            st.caption(f"服务端布局 · {len(nodes)} 个节点 · {len(edges)} 条边")
+
         config = Config(
             width="100%",  # 宽度自适应容器
             height=700,    # 固定高度 (整数)，防止塌陷
@@ -484,28 +643,9 @@ with tab_graph:
             nodeHighlightBehavior=True,
             highlightColor="#FCA5A5",
             collapsible=False,
-            # 关键配置：启用适应视图和物理稳定化
+            # 关键配置：启用适应视图
             fit=True,
-            physics={
-                "enabled": True,
-                "stabilization": {
-                    "enabled": True,
-                    "iterations": 1000, # 预计算1000次布局
-                    "fit": True,        # 稳定后强制适应视图
-                    "updateInterval": 50,
-                    "onlyDynamicEdges": False,
-                },
-                # 调整斥力参数，让节点散开，避免重叠
-                "barnesHut": {
-                    "gravitationalConstant": -3000,
-                    "centralGravity": 0.3,
-                    "springLength": 95,
-                    "springConstant": 0.04,
-                    "damping": 0.09,
-                    "avoidOverlap": 0.1
-                },
-                "minVelocity": 0.75
-            }
+            physics=physics
         )
 
         # 修复：移除 key 参数
@@ -520,7 +660,15 @@ with tab_graph:
         st.markdown("#### 详情面板")
         with st.container(border=True):
             curr_id = st.session_state.selected_node_id
-            if curr_id:
+            if curr_id and curr_id.startswith("GRP_"):
+                # 聚合簇节点只存在于图谱中，直接展示其包含的实体
+                group = graph['nodes'][graph['nodes']['id'] == curr_id]
+                if not group.empty:
+                    st.caption("CLUSTER")
+                    st.markdown(f"**{group['label'].iloc[0]}**")
+                    st.divider()
+                    st.write(group['title'].iloc[0])
+            elif curr_id:
                 details = get_node_detail(curr_id)
                 if details:
                     st.caption(details['type'].upper())
@@ -531,19 +679,25 @@ with tab_graph:
                     if details['body']:
                         st.markdown("---")
                         st.text_area("内容摘要", details['body'], height=300)
+                    if details['type'] == 'entity':
+                        st.markdown("---")
+                        render_entity_links(int(curr_id.split("_")[1]), entity_names)
             else:
                 st.info("👈 点击左侧节点查看")
+            if st.session_state.expanded_entities or st.session_state.entity_path:
+                if st.button("🧹 清除扩展", use_container_width=True):
+                    st.session_state.expanded_entities = {}
+                    st.session_state.entity_path = []
+                    st.rerun()
 
 # === 保持：折线图 (Line Chart) ===
 with tab_time:
-    st.markdown("#### 📅 邮件流量趋势")
-    if not df_clues.empty:
-        df_chart = df_clues.copy()
-        df_chart['day'] = pd.to_datetime(df_chart['send_time']).dt.date
-        df_grouped = df_chart.groupby(['day', 'org']).size().reset_index(name='count')
+    import plotly.express as px
 
+    st.markdown("#### 📅 邮件流量趋势")
+    if not df_timeline.empty:
         fig_line = px.line(
-            df_grouped,
+            df_timeline,
             x='day',
             y='count',
             color='org',
@@ -554,9 +708,20 @@ with tab_time:
         fig_line.update_layout(hovermode="x unified")
         st.plotly_chart(fig_line, use_container_width=True)
 
-        st.markdown("#### 数据明细")
-        st.dataframe(df_clues[['send_time', 'org', 'source_email', 'subject']], use_container_width=True)
+    st.markdown("#### 数据明细 (当前页)")
+    st.dataframe(df_clues[['send_time', 'org', 'source_email', 'subject', 'dup_count']]
+                 .rename(columns={'dup_count': '重复副本'}), use_container_width=True)
+
+    # 正文按需加载
+    open_id = st.selectbox("📄 查看正文", [None] + df_clues['id'].tolist(),
+                           format_func=lambda cid: "选择线索..." if cid is None else
+                           f"#{cid} {df_clues.loc[df_clues['id'] == cid, 'subject'].iloc[0] or '无题'}")
+    if open_id is not None:
+        open_time = df_clues.loc[df_clues['id'] == open_id, 'send_time'].iloc[0].isoformat()
+        st.text_area("正文", load_or(None, get_clue_content, int(open_id), open_time) or "", height=300)
 
 with tab_ent:
 
     st.dataframe(df_ents, use_container_width=True)
+
+report_timing()
@@ -0,0 +1,421 @@
+"""
+DeepTrace 性能基准
+
+生成与 t_clues 结构一致的合成中文邮件线索 (规模、实体密度、重复率、机构 / 日期分布可调)，
+导入一个临时 PostgreSQL，依次计时：入库、分析管道 (默认使用桩 NER，结果与 CPU 无关)、
+检索分页 / 看板统计、图谱构建。结果输出为 JSON，便于在不同提交之间对比：
+
+    python bench.py --clues 20000 --out bench_HEAD.json
+    python bench.py --clues 5000 --dup-rate 0.3 --org-skew 1.5 --hanlp
+
+本机有 initdb / pg_ctl 时在临时目录启动独立实例 (unix socket，不占用端口，locale 由 DEEPTRACE_BENCH_LOCALE 指定，
+默认 C.UTF-8)；
+否则在 DEEPTRACE_DB_* 指向的服务器上建临时库 (需要 CREATEDB 权限，PostgreSQL 13+)，结束后删除。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 1. 合成数据
+# ==========================================
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾萧田董潘袁蔡蒋余于杜叶程魏苏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦傅方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤"
+GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉兰萍鹏辉玲建国红梅斌宇浩凯鑫晨欣怡佳琪子轩雨涵博文"
+PLACES = ["北京", "上海", "广州", "深圳", "杭州", "南京", "成都", "重庆", "武汉", "西安", "苏州", "天津", "长沙",
+          "郑州", "青岛", "厦门", "宁波", "合肥", "昆明", "大连", "沈阳", "济南", "福州", "南昌", "贵阳", "南宁",
+          "海口", "兰州", "银川", "西宁", "拉萨", "乌鲁木齐", "呼和浩特", "哈尔滨", "长春", "石家庄", "太原"]
+ORG_WORDS = ["华信", "中科", "海通", "远洋", "恒达", "鼎盛", "天成", "瑞丰", "金桥", "宏图", "新元", "博远",
+             "嘉和", "泰安", "永信", "隆基", "正大", "安泰", "联创", "星河"]
+ORG_SUFFIXES = ["科技有限公司", "贸易公司", "物流集团", "投资公司", "咨询公司", "研究院", "电子厂"]
+SUBJECTS = ["关于{p}项目的沟通", "{o}合作事宜", "{p}会面安排", "转：{o}报价单", "{n}的来函", "近期工作汇报",
+            "{p}资金往来说明", "回复：{n}的问题", "{o}人员名单", "紧急：{p}现场情况"]
+TEMPLATES = ["{n}已于上周抵达{p}，与{o}负责人当面商谈。", "请联系{n}，电话{t}，具体事宜面谈。",
+             "{o}的款项已转入，经办人{n}。", "下周在{p}召开协调会，{o}派员参加。",
+             "据{n}反映，{p}方面的情况有变化。", "{n}与{n2}同行前往{p}，住宿由{o}安排。",
+             "附件为{o}提供的资料，请{n}核对。", "如有疑问请致电{t}。"]
+FILLERS = ["此事需尽快落实。", "请注意保密。", "相关材料稍后补充。", "以上情况供参考。", "请各位知悉。",
+           "后续进展另行通报。", "具体时间待定。"]
+
+
+def _zipf_weights(n, skew):
+    # skew = 0 为均匀分布，越大越集中在前几个取值
+    return [1.0 / (i + 1) ** skew for i in range(n)]
+
+
+class ClueGenerator:
+    def __init__(self, seed=42, people=2000, orgs=20, org_skew=1.0, days=90, end_date="2024-06-30",
+                 date_skew=0.0, entity_density=4, dup_rate=0.1):
+        self.rng = random.Random(seed)
+        rng = self.rng
+        self.people = sorted({rng.choice(SURNAMES) + "".join(rng.choices(GIVEN, k=rng.choice((1, 2))))
+                              for _ in range(people)})
+        self.companies = sorted({a + s for a in ORG_WORDS for s in ORG_SUFFIXES})
+        # 机构数上限为地名数
+        self.orgs = [p + ("市局", "分局", "办事处", "支队")[i % 4] for i, p in enumerate(PLACES)][:orgs]
+        self.org_weights = _zipf_weights(len(self.orgs), org_skew)
+        self.end = datetime.strptime(end_date, "%Y-%m-%d")
+        self.days = days
+        # date_skew > 0 时越近的日期线索越多 (指数衰减)
+        self.day_weights = [pow(1.0 + date_skew, -d) for d in range(days)]
+        domains = ["qq.com", "163.com", "sina.com", "outlook.com"]
+        self.senders = [f"user{i:04d}@{domains[i % len(domains)]}" for i in range(max(50, people // 10))]
+        self.entity_density = entity_density
+        self.dup_rate = dup_rate
+
+    def _phone(self):
+        return "1" + self.rng.choice("3456789") + "".join(self.rng.choices("0123456789", k=9))
+
+    def _sentence(self):
+        rng = self.rng
+        return rng.choice(TEMPLATES).format(n=rng.choice(self.people), n2=rng.choice(self.people),
+                                            p=rng.choice(PLACES), o=rng.choice(self.companies), t=self._phone())
+
+    def _clue(self):
+        rng = self.rng
+        # 模板句平均约 2 个实体，句数服从均值为 实体密度 / 2 的指数分布，线索长短不一
+        count = max(1, round(rng.expovariate(2.0 / max(self.entity_density, 1))))
+        sentences = [self._sentence() for _ in range(count)]
+        sentences += rng.choices(FILLERS, k=rng.randint(0, 3))
+        rng.shuffle(sentences)
+        day = rng.choices(range(self.days), weights=self.day_weights)[0]
+        sent = self.end - timedelta(days=day, seconds=rng.randint(0, 86399))
+        return {
+            '机构': rng.choices(self.orgs, weights=self.org_weights)[0],
+            '发件人': rng.choice(self.senders),
+            '主题': rng.choice(SUBJECTS).format(n=rng.choice(self.people), p=rng.choice(PLACES),
+                                                o=rng.choice(self.companies)),
+            '邮件内容': "".join(sentences),
+            '收发日期': sent.strftime("%Y-%m-%d %H:%M:%S"),
+            '批次': f"B{day:03d}",
+            '记录人': "bench",
+            '备注': "",
+            '原件名': f"mail_{rng.randint(0, 10 ** 6)}.eml",
+        }
+
+    def _duplicate(self, row):
+        # 转发 / 重发：加转发头或改动个别字符，发送时间稍后
+        rng = self.rng
+        dup = dict(row)
+        content = row['邮件内容']
+        if rng.random() < 0.5:
+            dup['邮件内容'] = "---- 转发邮件 ----\n" + content
+            dup['主题'] = "转发：" + row['主题']
+        else:
+            i = rng.randrange(len(content))
+            dup['邮件内容'] = content[:i] + rng.choice(FILLERS)[:1] + content[i + 1:]
+        sent = datetime.strptime(row['收发日期'], "%Y-%m-%d %H:%M:%S") + timedelta(minutes=rng.randint(1, 600))
+        dup['收发日期'] = min(sent, self.end).strftime("%Y-%m-%d %H:%M:%S")
+        dup['发件人'] = rng.choice(self.senders)
+        return dup
+
+    def frame(self, n):
+        rows = []
+        for _ in range(n):
+            if rows and self.rng.random() < self.dup_rate:
+                rows.append(self._duplicate(self.rng.choice(rows)))
+            else:
+                rows.append(self._clue())
+        return pd.DataFrame(rows)
+
+
+# ==========================================
+# 2. 桩 NER (与 HanLP 接口一致，按词表匹配)
+# ==========================================
+class StubTokenizer:
+    def __call__(self, sentences, batch_size=None):
+        return [[s] for s in sentences]
+
+
+class StubNER:
+    def __init__(self, gen):
+        words = [(p, 'PERSON') for p in gen.people] + [(p, 'LOCATION') for p in PLACES] + \
+                [(o, 'ORGANIZATION') for o in gen.companies]
+        self.labels = dict(words)
+        # 长词优先，避免 "北京" 截断 "北京市局" 一类的匹配
+        self.pattern = re.compile("|".join(re.escape(w) for w, _ in sorted(words, key=lambda x: -len(x[0]))))
+
+    def __call__(self, tokens, batch_size=None):
+        return [[(m.group(), self.labels[m.group()], m.start(), m.end()) for m in self.pattern.finditer("".join(t))]
+                for t in tokens]
+
+
+# ==========================================
+# 3. 临时数据库
+# ==========================================
+def _pg_bin(name):
+    found = shutil.which(name)
+    if found:
+        return found
+    # Debian / Ubuntu 的 postgresql 包不把 initdb 放进 PATH
+    base = "/usr/lib/postgresql"
+    for version in sorted(os.listdir(base), reverse=True) if os.path.isdir(base) else []:
+        path = os.path.join(base, version, "bin", name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+BENCH_LOCALE = os.getenv('DEEPTRACE_BENCH_LOCALE', 'C.UTF-8')   # 临时实例的 locale，须为系统已安装的 UTF-8 locale
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def local_cluster():
+    # initdb 新建实例，只监听临时目录下的 unix socket；关闭 fsync 以减少磁盘抖动对计时的影响
+    initdb, pg_ctl = _pg_bin("initdb"), _pg_bin("pg_ctl")
+    workdir = tempfile.mkdtemp(prefix="deeptrace_bench_")
+    data = os.path.join(workdir, "data")
+    port = _free_port()
+    try:
+        # 需要 UTF-8 的 LC_CTYPE：C locale 下 pg_trgm 把中文视为非单词字符，不产生 trigram，检索测到的是顺序扫描
+        subprocess.run([initdb, "-D", data, "-U", "postgres", "-A", "trust", "-E", "UTF8",
+                        f"--locale={BENCH_LOCALE}"], check=True, stdout=subprocess.DEVNULL)
+        opts = f"-k {workdir} -c listen_addresses='' -p {port} -c fsync=off -c synchronous_commit=off"
+        subprocess.run([pg_ctl, "-D", data, "-o", opts, "-l", os.path.join(workdir, "pg.log"), "-w", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        try:
+            yield {'host': workdir, 'port': str(port), 'user': "postgres", 'password': "", 'dbname': "postgres"}
+        finally:
+            subprocess.run([pg_ctl, "-D", data, "-m", "immediate", "stop"], stdout=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@contextmanager
+def scratch_database():
+    # 在已配置的服务器上建临时库 (需要 CREATEDB 权限)
+    import psycopg2
+    from db import DB_CONFIG
+    name = f"deeptrace_bench_{os.getpid()}"
+    admin = psycopg2.connect(**DB_CONFIG)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f'CREATE DATABASE "{name}" ENCODING \'UTF8\' TEMPLATE template0')
+        try:
+            yield {'dbname': name}
+        finally:
+            with admin.cursor() as cur:
+                cur.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    finally:
+        admin.close()
+
+
+DB_ENV = {'dbname': 'DEEPTRACE_DB_NAME', 'user': 'DEEPTRACE_DB_USER', 'password': 'DEEPTRACE_DB_PASSWORD',
+          'host': 'DEEPTRACE_DB_HOST', 'port': 'DEEPTRACE_DB_PORT'}
+
+
+def throwaway_database():
+    # 产出 db.DB_CONFIG 的覆盖项
+    return local_cluster() if _pg_bin("initdb") and _pg_bin("pg_ctl") else scratch_database()
+
+
+# ==========================================
+# 4. 计时
+# ==========================================
+def timed(fn, repeat=1):
+    # 返回 (最后一次结果, {'min', 'median', 'runs'}) 秒数
+    runs, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - started)
+    return result, {'min': min(runs), 'median': statistics.median(runs), 'runs': len(runs)}
+
+
+def bench_ingest(conn, df, fmt, chunk_size, workdir):
+    from ingest import ingest_file
+    path = os.path.join(workdir, f"clues.{fmt}")
+    if fmt == "xlsx":
+        df.to_excel(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    with open(path, "rb") as fh:
+        result, t = timed(lambda: ingest_file(fh, filename=path, conn=conn, chunk_size=chunk_size))
+    return {**t, 'rows': result['rows'], 'inserted': result['inserted'], 'duplicates': result.get('duplicates', 0),
+            'errors': result['errors'], 'rows_per_sec': result['rows'] / t['min'] if t['min'] else 0.0}
+
+
+def bench_pipeline(conn, gen, use_hanlp, batch_size, claim_size):
+    from pipeline import run_analysis_pipeline
+    if use_hanlp:
+        from nlp import load_models
+        tok, ner = load_models()
+    else:
+        tok, ner = StubTokenizer(), StubNER(gen)
+    stats, t = timed(lambda: run_analysis_pipeline(tok, ner, batch_size=batch_size, claim_size=claim_size,
+                                                   worker_id="bench", conn=conn))
+    return {**t, **{k: stats[k] for k in ('processed', 'failed', 'reused', 'docs_per_sec')}}
+
+
+def query_cases(conn):
+    # 代表性筛选：全量、最大机构、最近 7 天、单日、关键词、关键词按相关度排序
+    with conn.cursor() as cur:
+        cur.execute("SELECT org FROM t_clue_days GROUP BY org ORDER BY SUM(clue_count) DESC LIMIT 1")
+        org = cur.fetchone()[0]
+        cur.execute("SELECT MAX(day) FROM t_clue_days")
+        last = cur.fetchone()[0]
+        cur.execute("""
+            SELECT e.name FROM t_entity_days d JOIN t_entities e ON e.id = d.entity_id
+            WHERE e.type = '人名' GROUP BY e.name ORDER BY SUM(d.clue_count) DESC LIMIT 1
+        """)
+        row = cur.fetchone()
+    conn.commit()
+    week, day = str(last - timedelta(days=6)), str(last)
+    keyword = row[0] if row else "合作"
+    return {
+        'all': ("", "全部机构", "全部时间", "全部时间", False),
+        'org': ("", org, "全部时间", "全部时间", False),
+        'last_7_days': ("", "全部机构", week, day, False),
+        'single_day': ("", "全部机构", day, day, False),
+        'keyword': (keyword, "全部机构", "全部时间", "全部时间", False),
+        'keyword_ranked': (keyword, "全部机构", "全部时间", "全部时间", True),
+        'keyword_org_week': (keyword, org, week, day, False),
+    }
+
+
+def bench_queries(conn, cases, repeat):
+    from queries import fetch_page
+    from rollups import fetch_dashboard
+    out = {}
+    for name, (keyword, org, date_from, date_to, ranked) in cases.items():
+        page, t_page = timed(lambda: fetch_page(conn, keyword, org, date_from, date_to, ranked), repeat)
+        entry = {'page': {**t_page, 'rows': len(page['clues']), 'relations': len(page['relations'])}}
+        if page['next_cursor']:
+            nxt, t_next = timed(lambda: fetch_page(conn, keyword, org, date_from, date_to, ranked,
+                                                   page['next_cursor']), repeat)
+            entry['next_page'] = {**t_next, 'rows': len(nxt['clues'])}
+        _, entry['dashboard'] = timed(lambda: fetch_dashboard(conn, keyword, org, date_from, date_to), repeat)
+        out[name] = entry
+    return out
+
+
+def bench_graph(conn, repeat):
+    from graph import collapse_leaves, build_graph
+    from graph_index import CooccurrenceIndex
+    from layout import apply_layout
+    from queries import PAGE_SIZE, fetch_page
+    data = fetch_page(conn, "", "全部机构", "全部时间", "全部时间")
+    graph, t_build = timed(lambda: build_graph(data['clues'], data['relations'], PAGE_SIZE), repeat)
+    collapsed, t_collapse = timed(lambda: collapse_leaves(graph), repeat)
+    _, t_layout = timed(lambda: apply_layout(collapsed), repeat)
+    index, t_load = timed(lambda: CooccurrenceIndex.load(conn), repeat)
+    conn.commit()
+    out = {
+        'build': {**t_build, 'nodes': len(graph['nodes']), 'edges': len(graph['edges'])},
+        'collapse': {**t_collapse, 'nodes': len(collapsed['nodes'])},
+        'layout': t_layout,
+        'cooccurrence_load': {**t_load, 'entities': len(index)},
+    }
+    if len(index):
+        # 共现最多的实体做 2 跳展开
+        hub = int(index.ids[np.diff(index.indptr).argmax()])
+        hood, out['k_hop'] = timed(lambda: index.k_hop(hub, 2), repeat)
+        out['k_hop']['nodes'] = len(hood)
+    return out
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run(args):
+    gen = ClueGenerator(seed=args.seed, people=args.people, orgs=args.orgs, org_skew=args.org_skew, days=args.days,
+                        end_date=args.end_date, date_skew=args.date_skew, entity_density=args.entity_density,
+                        dup_rate=args.dup_rate)
+    df, t_gen = timed(lambda: gen.frame(args.clues))
+    report = {
+        'meta': {'commit': _git_commit(), 'time': datetime.now().isoformat(timespec='seconds'),
+                 'python': platform.python_version(), 'platform': platform.platform(),
+                 'params': vars(args)},
+        'generate': t_gen,
+    }
+
+    workdir = tempfile.mkdtemp(prefix="deeptrace_bench_files_")
+    try:
+        with throwaway_database() as overrides:
+            # 同时写入环境变量，spawn 出的抽取子进程重新导入 db 时也连接临时库
+            from db import DB_CONFIG, get_db_conn
+            DB_CONFIG.update(overrides)
+            os.environ.update({DB_ENV[k]: v for k, v in overrides.items()})
+            from instrument import enable, snapshot
+            from migrations import migrate
+            enable(args.trace)
+            conn = get_db_conn()
+            if not conn:
+                raise RuntimeError("临时数据库连接失败")
+            try:
+                report['migrate'] = migrate(conn)
+                report['ingest'] = bench_ingest(conn, df, args.format, args.chunk_size, workdir)
+                report['pipeline'] = bench_pipeline(conn, gen, args.hanlp, args.batch_size, args.claim_size)
+                with conn.cursor() as cur:
+                    cur.execute("ANALYZE")
+                conn.commit()
+                report['queries'] = bench_queries(conn, query_cases(conn), args.repeat)
+                report['graph'] = bench_graph(conn, args.repeat)
+                if args.trace:
+                    report['spans'] = snapshot()['spans']
+            finally:
+                conn.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DeepTrace 性能基准")
+    parser.add_argument('--clues', type=int, default=10000, help="线索条数")
+    parser.add_argument('--entity-density', type=float, default=4, help="每条线索平均实体数")
+    parser.add_argument('--dup-rate', type=float, default=0.1, help="转发 / 重发副本比例")
+    parser.add_argument('--people', type=int, default=2000, help="人名词表大小")
+    parser.add_argument('--orgs', type=int, default=20, help="机构数")
+    parser.add_argument('--org-skew', type=float, default=1.0, help="机构分布的 Zipf 指数，0 为均匀")
+    parser.add_argument('--days', type=int, default=90, help="日期跨度 (天)")
+    parser.add_argument('--end-date', default="2024-06-30")
+    parser.add_argument('--date-skew', type=float, default=0.0, help="近期日期的加权，0 为均匀")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--format', choices=['xlsx', 'csv'], default='xlsx', help="入库文件格式")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--claim-size', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=5, help="查询 / 图谱计时重复次数")
+    parser.add_argument('--hanlp', action='store_true', help="使用真实 HanLP 模型代替桩 NER")
+    parser.add_argument('--trace', action='store_true', help="启用埋点，报告中附带各阶段区间耗时 (见 instrument.py)")
+    parser.add_argument('--out', help="结果另存为 JSON 文件")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+# ==========================================
+# 数据库配置 (可通过环境变量覆盖，便于指向 pgbouncer)
+# ==========================================
+DB_CONFIG = {
+    'dbname': os.getenv('DEEPTRACE_DB_NAME', 'Test'),
+    'user': os.getenv('DEEPTRACE_DB_USER', 'postgres'),
+    'password': os.getenv('DEEPTRACE_DB_PASSWORD', 'root'),
+    'host': os.getenv('DEEPTRACE_DB_HOST', 'localhost'),
+    'port': os.getenv('DEEPTRACE_DB_PORT', '5432')
+}
+
+POOL_CONFIG = {
+    'minconn': int(os.getenv('DEEPTRACE_DB_POOL_MIN', '1')),
+    'maxconn': int(os.getenv('DEEPTRACE_DB_POOL_MAX', '10')),
+    # 单条语句超时；经 pgbouncer 连接时需在其配置中加入 ignore_startup_parameters = options，或设为 0 关闭
+    'statement_timeout_ms': int(os.getenv('DEEPTRACE_DB_STATEMENT_TIMEOUT_MS', '30000')),
+    'checkout_timeout': float(os.getenv('DEEPTRACE_DB_CHECKOUT_TIMEOUT', '10')),
+    'health_check_after': float(os.getenv('DEEPTRACE_DB_HEALTH_CHECK_AFTER', '30')),
+}
+
+
+def get_db_conn():
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+        return conn
+    except Exception:
+        return None
+
+
+# ==========================================
+# 进程级连接池
+# ==========================================
+class ConnectionPool:
+    def __init__(self, minconn, maxconn, statement_timeout_ms=0, checkout_timeout=10.0,
+                 health_check_after=30.0, **config):
+        if statement_timeout_ms:
+            config['options'] = f"-c statement_timeout={statement_timeout_ms}"
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **config)
+        # ThreadedConnectionPool 池满时直接抛错，用信号量让调用方排队等待
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        # 空闲较久的连接可能已被服务端或 pgbouncer 断开，借出前探测一次
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _checkout(self):
+        for _ in range(2):
+            conn = self._pool.getconn()
+            if self._healthy(conn):
+                return conn
+            self._discard(conn)
+        return self._pool.getconn()
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    def _release(self, conn):
+        if conn.closed:
+            self._discard(conn)
+            return
+        try:
+            # 归还前清理未结束的事务，保证下一个借用者拿到干净连接
+            if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn)
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise TimeoutError("数据库连接池已满，等待超时")
+        try:
+            conn = self._checkout()
+            try:
+                yield conn
+            finally:
+                self._release(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._pool.closeall()
+
+
+def create_pool(**overrides):
+    options = {**POOL_CONFIG, **DB_CONFIG, **overrides}
+    return ConnectionPool(**options)
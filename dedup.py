@@ -0,0 +1,236 @@
+"""
+DeepTrace 近重复线索检测
+
+入库后为每条线索计算正文哈希与 MinHash 签名 (字符 shingle)，归入规范线索：
+  canonical_id = id          自身即规范线索
+  canonical_id = 其他线索 id  与该规范线索正文相同或高度相似 (估计 Jaccard >= 阈值)
+  canonical_id IS NULL       尚未建立去重索引
+canonical_time 记录规范线索的 send_time (分区键)，按规范线索读写时只访问其所在月份的分区。
+
+只有规范线索写入 LSH 分桶表 (t_clue_bands) 与签名表 (t_clue_signatures)。
+分析管道对重复线索直接复用规范线索已抽取的实体，不再运行模型。
+对历史数据补建索引：
+
+    python dedup.py
+"""
+import hashlib
+import re
+import sys
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from db import get_db_conn
+from rollups import bump_generations, partition_filter, update_duplicate_rollups
+
+# ==========================================
+# 1. 参数
+# ==========================================
+SHINGLE_SIZE = 5          # 字符 shingle 长度
+NUM_PERM = 64             # MinHash 排列数
+BANDS = 16                # LSH 分段数 (每段 NUM_PERM / BANDS 行)
+SIMILARITY = 0.8          # 估计 Jaccard 达到该值视为近重复
+SHINGLE_BLOCK = 8192      # 签名按 shingle 分块计算，内存占用 O(NUM_PERM * block)
+DEFAULT_DEDUP_BATCH = 2000
+
+_rng = np.random.default_rng(20240101)   # 固定种子：签名需跨进程、跨批次可比
+_PERM_A = _rng.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+_SHINGLE_BASE = np.uint64(1000003)
+_WS_RE = re.compile(r"\s+")
+
+
+# ==========================================
+# 2. 哈希与签名
+# ==========================================
+def normalize_text(text):
+    # 去掉首尾空白并合并连续空白，转发时的换行差异不影响判重
+    return _WS_RE.sub(" ", text or "").strip().lower()
+
+
+def content_hash(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest() if text else None
+
+
+def minhash(text):
+    # 返回 NUM_PERM 个 uint32 组成的签名；文本短于一个 shingle 时返回 None，只做精确判重
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype='<u4').astype(np.uint64)
+    n = len(codes) - SHINGLE_SIZE + 1
+    if n <= 0:
+        return None
+    shingles = np.zeros(n, dtype=np.uint64)
+    for j in range(SHINGLE_SIZE):
+        shingles = shingles * _SHINGLE_BASE + codes[j:j + n]
+    shingles = np.unique(shingles)
+    sig = np.full(NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(shingles), SHINGLE_BLOCK):
+        block = shingles[None, start:start + SHINGLE_BLOCK]
+        hashed = (_PERM_A[:, None] * block + _PERM_B[:, None]) >> np.uint64(32)
+        np.minimum(sig, hashed.min(axis=1), out=sig)
+    return sig.astype(np.uint32)
+
+
+def band_buckets(sig):
+    # 每段签名压成一个 64 位桶号，任一段相同即为候选
+    rows = sig.reshape(BANDS, -1)
+    return [int.from_bytes(hashlib.blake2b(r.tobytes(), digest_size=8).digest(), 'little', signed=True)
+            for r in rows]
+
+
+def similarity(sig_a, sig_b):
+    return float((sig_a == sig_b).mean())
+
+
+# ==========================================
+# 3. 去重索引
+# ==========================================
+def _lookup_exact(cur, hashes):
+    # 返回 {正文哈希: (规范线索 id, send_time)}，同一哈希有多条规范线索时取 id 最小的
+    if not hashes:
+        return {}
+    cur.execute("""
+        SELECT DISTINCT ON (content_hash) content_hash, id, send_time FROM t_clues
+        WHERE content_hash = ANY(%s) AND canonical_id = id ORDER BY content_hash, id
+    """, (list(hashes),))
+    return {h: (cid, send_time) for h, cid, send_time in cur.fetchall()}
+
+
+def _lookup_candidates(cur, buckets):
+    # buckets: {(band, bucket)}；返回 ({(band, bucket): [规范线索 id]}, {规范线索 id: 签名}, {规范线索 id: send_time})
+    band_index, sigs, times = {}, {}, {}
+    if not buckets:
+        return band_index, sigs, times
+    bands, keys = zip(*buckets)
+    cur.execute("""
+        SELECT b.band, b.bucket, b.clue_id, s.signature, s.send_time
+        FROM t_clue_bands b
+        JOIN unnest(%s::smallint[], %s::bigint[]) AS t(band, bucket) ON b.band = t.band AND b.bucket = t.bucket
+        JOIN t_clue_signatures s ON s.clue_id = b.clue_id
+    """, (list(bands), list(keys)))
+    for band, bucket, cid, sig, send_time in cur.fetchall():
+        band_index.setdefault((band, bucket), []).append(cid)
+        if cid not in sigs:
+            sigs[cid] = np.frombuffer(bytes(sig), dtype=np.uint32)
+            times[cid] = send_time
+    return band_index, sigs, times
+
+
+def assign_canonical(conn, limit=DEFAULT_DEDUP_BATCH, clue_ids=None, send_times=None):
+    # 领取一批未建索引的线索 (SKIP LOCKED，可与其他入库进程并行)，返回 (处理数, 判为重复数)
+    # clue_ids 为空时处理全部未建索引的线索 (历史数据补建)，否则只处理其中的线索 (入库后调用)；
+    # send_times 为这些线索的 send_time，附带后只访问相关月份的分区
+    scope, params = "", []
+    if clue_ids is not None:
+        time_filter, params = partition_filter("send_time", send_times or ())
+        scope, params = f"AND id = ANY(%s) AND {time_filter}", [list(clue_ids)] + params
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT id, content, org, send_time FROM t_clues WHERE canonical_id IS NULL {scope}
+            ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+        """, params + [limit])
+        rows = cur.fetchall()
+        if not rows:
+            conn.commit()
+            return 0, 0
+
+        texts = {cid: normalize_text(content) for cid, content, _, _ in rows}
+        times = {cid: send_time for cid, _, _, send_time in rows}
+        hashes = {cid: content_hash(t) for cid, t in texts.items()}
+        by_hash = _lookup_exact(cur, {h for h in hashes.values() if h})
+        sigs, buckets = {}, {}
+        for cid, text in texts.items():
+            if hashes[cid] and hashes[cid] not in by_hash:
+                sig = minhash(text)
+                if sig is not None:
+                    sigs[cid] = sig
+                    buckets[cid] = band_buckets(sig)
+        # 库中已有规范线索与本批新规范线索共用同一分桶索引
+        band_index, known, known_times = _lookup_candidates(
+            cur, {(b, k) for ks in buckets.values() for b, k in enumerate(ks)})
+        canon_times = {**times, **known_times, **dict(by_hash.values())}
+
+        # 按 id 顺序判定，同一批内先出现的线索成为后续副本的规范线索
+        canonical, new_bands, new_sigs = {}, [], []
+        for cid, *_ in rows:
+            h = hashes[cid]
+            if h is None:
+                canonical[cid] = cid
+                continue
+            if h in by_hash:
+                canonical[cid] = by_hash[h][0]
+                continue
+            best, best_sim = None, SIMILARITY
+            if cid in sigs:
+                cands = {c for b, k in enumerate(buckets[cid]) for c in band_index.get((b, k), ())}
+                for cand in sorted(cands):
+                    sim = similarity(sigs[cid], known[cand] if cand in known else sigs[cand])
+                    if sim >= best_sim and (best is None or sim > best_sim):
+                        best, best_sim = cand, sim
+            if best is not None:
+                canonical[cid] = best
+                continue
+            canonical[cid] = cid
+            by_hash[h] = (cid, times[cid])
+            if cid in sigs:
+                new_sigs.append((cid, sigs[cid].tobytes(), times[cid]))
+                for b, k in enumerate(buckets[cid]):
+                    band_index.setdefault((b, k), []).append(cid)
+                    new_bands.append((b, k, cid))
+
+        time_filter, time_params = partition_filter("c.send_time", times.values())
+        cur.execute(f"""
+            UPDATE t_clues c SET content_hash = t.h, canonical_id = t.canon, canonical_time = t.canon_time
+            FROM unnest(%s::int[], %s::varchar[], %s::int[], %s::timestamp[]) AS t(id, h, canon, canon_time)
+            WHERE c.id = t.id AND {time_filter}
+        """, [list(canonical), [hashes[c] for c in canonical], list(canonical.values()),
+              [canon_times[c] for c in canonical.values()]] + time_params)
+        if new_sigs:
+            execute_values(cur, """
+                INSERT INTO t_clue_signatures (clue_id, signature, send_time) VALUES %s ON CONFLICT DO NOTHING
+            """, new_sigs)
+            execute_values(cur, "INSERT INTO t_clue_bands (band, bucket, clue_id) VALUES %s ON CONFLICT DO NOTHING",
+                           new_bands)
+        # 规范线索的重复副本数变化
+        duplicates = {cid: canon for cid, canon in canonical.items() if cid != canon}
+        canons = set(duplicates.values())
+        update_duplicate_rollups(cur, duplicates, [(org or '', send_time.date()) for cid, _, org, send_time in rows
+                                                   if cid in duplicates], {canon_times[c] for c in canons})
+        bump_generations(cur, canons, {canon_times[c] for c in canons})
+    conn.commit()
+    return len(rows), len(duplicates)
+
+
+def index_pending(conn, limit=DEFAULT_DEDUP_BATCH, clue_ids=None, send_times=None):
+    # 逐批处理直到没有未建索引的线索 (或 clue_ids 全部处理完)，返回 (处理数, 判为重复数)
+    total = dups = 0
+    while True:
+        n, d = assign_canonical(conn, limit, clue_ids, send_times)
+        if not n:
+            return total, dups
+        total += n
+        dups += d
+
+
+def duplicate_stats(conn):
+    # {'duplicates': 重复线索数, 'groups': 含重复的规范线索数}，读取 t_clue_days 中的汇总，不扫描 t_clues
+    with conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(SUM(dup_count), 0), COALESCE(SUM(dup_groups), 0) FROM t_clue_days")
+        dups, groups = cur.fetchone()
+    return {'duplicates': int(dups), 'groups': int(groups)}
+
+
+def main():
+    conn = get_db_conn()
+    if not conn:
+        print("数据库连接失败", file=sys.stderr)
+        return 1
+    try:
+        total, dups = index_pending(conn)
+    finally:
+        conn.close()
+    print(f"建立去重索引 {total} 条, 其中重复 {dups} 条")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+DeepTrace 图谱构建
+
+由检索结果 (clues / relations) 以向量化的 pandas 操作生成节点与边表，
+再叠加共现扩展。输出为 DataFrame，便于缓存；转成 agraph 的 Node / Edge 由页面完成。
+"""
+import numpy as np
+import pandas as pd
+
+from instrument import traced
+
+# ==========================================
+# 1. 样式
+# ==========================================
+DEFAULT_MAX_CLUES = 30
+MAIL_COLOR = "#3B82F6"
+ENTITY_COLORS = {'人名': "#F59E0B", '地名': "#10B981"}
+DEFAULT_ENTITY_COLOR = "#8B5CF6"
+MAIL_EDGE_COLOR = "#E5E7EB"
+COOC_EDGE_COLOR = "#CBD5E1"
+PATH_EDGE_COLOR = "#EF4444"
+
+GROUP_COLOR_ALPHA = "99"   # 聚合节点在原颜色上叠加透明度
+LOD_THRESHOLD = 300        # 节点数超过该值时，把同一锚点下的叶子实体聚合为簇节点
+
+NODE_COLUMNS = ['id', 'label', 'size', 'color', 'shape', 'title', 'etype']
+EDGE_COLUMNS = ['source', 'target', 'color', 'title', 'width', 'dashes']
+
+
+def _entity_nodes(eids, names, types):
+    return pd.DataFrame({
+        'id': 'ENT_' + pd.Series(eids, dtype='int64').astype(str).to_numpy(),
+        'label': names,
+        'size': 15,
+        'color': pd.Series(types).map(ENTITY_COLORS).fillna(DEFAULT_ENTITY_COLOR).to_numpy(),
+        'shape': 'dot',
+        'title': names,
+        'etype': types,
+    }, columns=NODE_COLUMNS)
+
+
+# ==========================================
+# 2. 线索-实体图
+# ==========================================
+@traced("graph.build")
+def build_graph(df_clues, df_rels, max_clues=DEFAULT_MAX_CLUES):
+    # 返回 {'nodes', 'edges', 'entity_names'}，仅保留与前 max_clues 条线索关联的实体
+    empty = {'nodes': pd.DataFrame(columns=NODE_COLUMNS), 'edges': pd.DataFrame(columns=EDGE_COLUMNS),
+             'entity_names': {}}
+    if df_clues is None or df_clues.empty:
+        return empty
+
+    top = df_clues.head(max_clues).drop_duplicates('id')
+    subject = top['subject'].fillna('').astype(str)
+    # 节点 id 附带分区键 send_time (MAIL_<id>_<时间>)，点击节点后按 (id, send_time) 查询只访问一个分区
+    mail_ids = pd.Series(('MAIL_' + top['id'].astype(str) + '_'
+                          + top['send_time'].dt.strftime('%Y-%m-%dT%H:%M:%S.%f').fillna('')).to_numpy(),
+                         index=top['id'].to_numpy())
+    mail_nodes = pd.DataFrame({
+        'id': mail_ids.to_numpy(),
+        'label': np.where(subject.str.len() > 6, subject.str[:6] + "..", subject.where(subject != '', "无题")),
+        'size': 25,
+        'color': MAIL_COLOR,
+        'shape': 'square',
+        'title': top['subject'],
+        'etype': "邮件",
+    }, columns=NODE_COLUMNS)
+
+    if df_rels is None or df_rels.empty:
+        return {**empty, 'nodes': mail_nodes}
+
+    rels = df_rels[df_rels['clue_id'].isin(top['id'])]
+    ents = rels.drop_duplicates('eid')
+    ent_nodes = _entity_nodes(ents['eid'], ents['name'].to_numpy(), ents['type'].to_numpy())
+    edges = pd.DataFrame({
+        'source': rels['clue_id'].map(mail_ids),
+        'target': 'ENT_' + rels['eid'].astype(str),
+        'color': MAIL_EDGE_COLOR,
+    }, columns=EDGE_COLUMNS).drop_duplicates(['source', 'target'])
+
+    return {
+        'nodes': pd.concat([mail_nodes, ent_nodes], ignore_index=True),
+        'edges': edges.reset_index(drop=True),
+        'entity_names': dict(zip(ents['eid'].astype(int), ents['name'])),
+    }
+
+
+# ==========================================
+# 3. 共现扩展
+# ==========================================
+@traced("graph.cooccurrence")
+def add_cooccurrence(graph, index, expanded, path, lookup_labels, max_nodes=120):
+    # expanded: {entity_id: 跳数}；path: 最短路径实体 id 列表
+    # lookup_labels(entity_ids) -> {entity_id: (name, type)}
+    hood = set(path)
+    for eid, hop in expanded.items():
+        hood.update(index.k_hop(eid, hop, max_nodes=max_nodes))
+    if not hood:
+        return graph
+    labels = lookup_labels(tuple(sorted(hood)))
+
+    known = set(graph['nodes']['id'])
+    new_ids = [e for e in sorted(hood) if e in labels and f"ENT_{e}" not in known]
+    ent_nodes = _entity_nodes(new_ids, [labels[e][0] for e in new_ids], [labels[e][1] for e in new_ids])
+    nodes = pd.concat([graph['nodes'], ent_nodes], ignore_index=True)
+    present = set(nodes['id'])
+
+    pairs = pd.DataFrame(index.edges_within(hood), columns=['a', 'b', 'weight'])
+    pairs['source'] = 'ENT_' + pairs['a'].astype(str)
+    pairs['target'] = 'ENT_' + pairs['b'].astype(str)
+    pairs = pairs[pairs['source'].isin(present) & pairs['target'].isin(present)]
+    path_pairs = {tuple(sorted(p)) for p in zip(path, path[1:])}
+    on_path = np.array([(a, b) in path_pairs for a, b in zip(pairs['a'], pairs['b'])], dtype=bool)
+    cooc_edges = pd.DataFrame({
+        'source': pairs['source'],
+        'target': pairs['target'],
+        'color': np.where(on_path, PATH_EDGE_COLOR, COOC_EDGE_COLOR),
+        'title': "共现 " + pairs['weight'].astype(str) + " 封",
+        'width': np.where(on_path, 3, 1),
+        'dashes': ~on_path,
+    }, columns=EDGE_COLUMNS)
+
+    names = dict(graph['entity_names'])
+    names.update({e: labels[e][0] for e in new_ids})
+    return {
+        'nodes': nodes,
+        'edges': pd.concat([graph['edges'], cooc_edges], ignore_index=True),
+        'entity_names': names,
+    }
+
+
+# ==========================================
+# 4. 细节层级 (LOD)
+# ==========================================
+@traced("graph.collapse")
+def collapse_leaves(graph, min_group=2):
+    # 只连着一条边的实体按 (锚点, 类型) 聚合成一个簇节点，大结果集下节点数与边数同步下降
+    nodes, edges = graph['nodes'], graph['edges']
+    if nodes.empty or edges.empty:
+        return graph
+    degree = pd.concat([edges['source'], edges['target']]).value_counts()
+    is_ent = nodes['id'].str.startswith('ENT_')
+    leaves = nodes.loc[is_ent & nodes['id'].map(degree).fillna(0).eq(1), ['id', 'label', 'color', 'etype']]
+    if leaves.empty:
+        return graph
+
+    leaf_is_target = edges['target'].isin(leaves['id'])
+    leaf_is_source = edges['source'].isin(leaves['id'])
+    leaf_edges = edges[leaf_is_target | leaf_is_source]
+    on_target = leaf_is_target[leaf_edges.index]
+    links = pd.DataFrame({
+        'id': np.where(on_target, leaf_edges['target'], leaf_edges['source']),
+        'anchor': np.where(on_target, leaf_edges['source'], leaf_edges['target']),
+    }).merge(leaves, on='id')
+    links['size_of_group'] = links.groupby(['anchor', 'etype'])['id'].transform('size')
+    links = links[links['size_of_group'] >= min_group]
+    if links.empty:
+        return graph
+
+    groups = links.groupby(['anchor', 'etype'], sort=False).agg(
+        count=('id', 'size'), color=('color', 'first'), names=('label', lambda x: "、".join(x.astype(str).head(20))))
+    groups = groups.reset_index()
+    group_ids = 'GRP_' + groups['anchor'] + '_' + groups['etype'].astype(str)
+    group_nodes = pd.DataFrame({
+        'id': group_ids,
+        'label': groups['etype'].astype(str) + " ×" + groups['count'].astype(str),
+        'size': 12 + np.minimum(groups['count'], 20),
+        'color': groups['color'] + GROUP_COLOR_ALPHA,
+        'shape': 'diamond',
+        'title': groups['names'],
+        'etype': groups['etype'],
+    }, columns=NODE_COLUMNS)
+    group_edges = pd.DataFrame({
+        'source': groups['anchor'],
+        'target': group_ids,
+        'color': MAIL_EDGE_COLOR,
+        'title': groups['count'].astype(str) + " 个实体",
+    }, columns=EDGE_COLUMNS)
+
+    collapsed = set(links['id'])
+    return {
+        **graph,
+        'nodes': pd.concat([nodes[~nodes['id'].isin(collapsed)], group_nodes], ignore_index=True),
+        'edges': pd.concat([edges[~(edges['source'].isin(collapsed) | edges['target'].isin(collapsed))],
+                            group_edges], ignore_index=True),
+    }
+
+
+def records(df, exclude=('etype',)):
+    # DataFrame -> 逐行 dict，去掉缺失字段及非渲染列，便于直接展开为 Node(**r) / Edge(**r)
+    df = df.drop(columns=[c for c in exclude if c in df.columns])
+    return [{k: v for k, v in row.items() if not (v is None or (isinstance(v, float) and np.isnan(v)))}
+            for row in df.to_dict('records')]
@@ -0,0 +1,188 @@
+"""
+DeepTrace 实体共现索引
+
+t_cooccurrence 保存实体对 (entity_a < entity_b) 的共同线索数，由分析管道写入 t_relations 时增量维护。
+CooccurrenceIndex 将其加载为 CSR 邻接数组，在内存中回答 k 跳邻域与最短路径查询；
+t_cooccurrence_version 只在共现计数变化时递增，进程内的索引以其为键重新加载。
+"""
+import numpy as np
+
+from instrument import traced
+
+# ==========================================
+# 1. 增量维护
+# ==========================================
+# new_rel 为本次实际新增的关系 (clue_id, entity_id, send_time)。语句内 t_relations 快照不含新增行，
+# 因此 新增×已有 与 新增×新增 (a < b) 恰好覆盖每个新出现的实体对各一次。
+COOCCURRENCE_UPSERT = """
+    , pairs AS (
+        SELECT LEAST(n.entity_id, r.entity_id) AS a, GREATEST(n.entity_id, r.entity_id) AS b
+        FROM new_rel n JOIN t_relations r ON r.clue_id = n.clue_id AND r.send_time = n.send_time
+        UNION ALL
+        SELECT n1.entity_id, n2.entity_id
+        FROM new_rel n1 JOIN new_rel n2 ON n1.clue_id = n2.clue_id AND n1.entity_id < n2.entity_id
+    )
+    INSERT INTO t_cooccurrence (entity_a, entity_b, clue_count)
+    SELECT a, b, COUNT(*) FROM pairs GROUP BY a, b ORDER BY a, b
+    ON CONFLICT (entity_a, entity_b) DO UPDATE SET clue_count = t_cooccurrence.clue_count + EXCLUDED.clue_count
+"""
+
+# 重新分析时移除的关系 (old_rel CTE) 与同一线索原有其他实体构成的实体对计数减一；old_rel 内部的实体对只计一次。
+# 同一语句内 t_relations 仍是删除前的快照；计数降为 0 的行保留，索引加载时按 clue_count >= min_weight 过滤
+COOCCURRENCE_REMOVE = """
+    , removed_pairs AS (
+        SELECT LEAST(o.entity_id, r.entity_id) AS a, GREATEST(o.entity_id, r.entity_id) AS b
+        FROM old_rel o JOIN t_relations r ON r.clue_id = o.clue_id AND r.send_time = o.send_time
+        WHERE r.entity_id <> o.entity_id AND (o.entity_id < r.entity_id OR NOT EXISTS (
+            SELECT 1 FROM old_rel x WHERE x.clue_id = r.clue_id AND x.entity_id = r.entity_id))
+    )
+    INSERT INTO t_cooccurrence (entity_a, entity_b, clue_count)
+    SELECT a, b, -COUNT(*) FROM removed_pairs GROUP BY a, b ORDER BY a, b
+    ON CONFLICT (entity_a, entity_b) DO UPDATE SET clue_count = t_cooccurrence.clue_count + EXCLUDED.clue_count
+"""
+
+# 从已有关系全量回填 (迁移 003)；表中已有数据时 NOT EXISTS 作为一次性过滤条件，不会扫描 t_relations
+COOCCURRENCE_BACKFILL = """
+    INSERT INTO t_cooccurrence (entity_a, entity_b, clue_count)
+    SELECT r1.entity_id, r2.entity_id, COUNT(*)
+    FROM t_relations r1 JOIN t_relations r2 ON r1.clue_id = r2.clue_id AND r1.entity_id < r2.entity_id
+    WHERE NOT EXISTS (SELECT 1 FROM t_cooccurrence)
+    GROUP BY 1, 2
+"""
+
+# 单行版本表：与共现计数的变化在同一事务中递增；放在事务末尾，缩短该行的行锁时间
+COOCCURRENCE_VERSION_TABLE = [
+    "CREATE TABLE IF NOT EXISTS t_cooccurrence_version (generation BIGINT NOT NULL DEFAULT 0)",
+    "INSERT INTO t_cooccurrence_version (generation) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM t_cooccurrence_version)",
+]
+COOCCURRENCE_VERSION_BUMP = "UPDATE t_cooccurrence_version SET generation = generation + 1"
+
+
+def cooccurrence_version(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(MAX(generation), 0) FROM t_cooccurrence_version")
+        return int(cur.fetchone()[0])
+
+
+# ==========================================
+# 2. CSR 邻接索引
+# ==========================================
+class CooccurrenceIndex:
+    def __init__(self, entity_a, entity_b, weight):
+        a = np.asarray(entity_a, dtype=np.int64)
+        b = np.asarray(entity_b, dtype=np.int64)
+        w = np.asarray(weight, dtype=np.int64)
+        self.ids = np.unique(np.concatenate([a, b]))
+        n = len(self.ids)
+
+        # 无向图：每条边正反各存一次，按起点排序后得到 indptr / indices
+        src = np.searchsorted(self.ids, np.concatenate([a, b]))
+        dst = np.searchsorted(self.ids, np.concatenate([b, a]))
+        ww = np.concatenate([w, w])
+        order = np.argsort(src, kind='stable')
+        self.indices = dst[order]
+        self.weights = ww[order]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=self.indptr[1:])
+
+    @classmethod
+    @traced("graph.index_load")
+    def load(cls, conn, min_weight=1):
+        with conn.cursor() as cur:
+            cur.execute("SELECT entity_a, entity_b, clue_count FROM t_cooccurrence WHERE clue_count >= %s",
+                        (min_weight,))
+            rows = cur.fetchall()
+        if not rows:
+            return cls([], [], [])
+        a, b, w = zip(*rows)
+        return cls(a, b, w)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _index_of(self, entity_id):
+        i = np.searchsorted(self.ids, entity_id)
+        if i < len(self.ids) and self.ids[i] == entity_id:
+            return int(i)
+        return None
+
+    def _expand(self, frontier):
+        # 一次取出整个 frontier 的全部邻居，返回 (邻居下标, 对应父节点下标, 边权)
+        starts = self.indptr[frontier]
+        lens = self.indptr[frontier + 1] - starts
+        total = int(lens.sum())
+        if not total:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        offsets = np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(total)
+        return self.indices[offsets], np.repeat(frontier, lens), self.weights[offsets]
+
+    def neighbors(self, entity_id, limit=None):
+        i = self._index_of(entity_id)
+        if i is None:
+            return []
+        nbr, _, w = self._expand(np.array([i]))
+        order = np.argsort(-w, kind='stable')[:limit]
+        return [(int(self.ids[j]), int(k)) for j, k in zip(nbr[order], w[order])]
+
+    def k_hop(self, entity_id, k=2, max_nodes=200):
+        # BFS 逐层扩展，返回 {entity_id: 跳数}；每层优先保留边权高的邻居，总数不超过 max_nodes
+        start = self._index_of(entity_id)
+        if start is None:
+            return {}
+        depth = np.full(len(self.ids), -1, dtype=np.int64)
+        depth[start] = 0
+        frontier = np.array([start])
+        for hop in range(1, k + 1):
+            nbr, _, w = self._expand(frontier)
+            fresh = depth[nbr] < 0
+            nbr, w = nbr[fresh], w[fresh]
+            if not len(nbr):
+                break
+            nbr = nbr[np.argsort(-w, kind='stable')]
+            _, first = np.unique(nbr, return_index=True)
+            nbr = nbr[np.sort(first)]
+            budget = max_nodes - int((depth >= 0).sum())
+            if budget <= 0:
+                break
+            nbr = nbr[:budget]
+            depth[nbr] = hop
+            frontier = nbr
+        found = np.flatnonzero(depth >= 0)
+        return {int(self.ids[i]): int(depth[i]) for i in found}
+
+    def shortest_path(self, source_id, target_id, max_depth=6):
+        # 无权 BFS，返回 [source_id, ..., target_id]；不可达或超出 max_depth 时返回 None
+        s, t = self._index_of(source_id), self._index_of(target_id)
+        if s is None or t is None:
+            return None
+        if s == t:
+            return [int(source_id)]
+        parent = np.full(len(self.ids), -1, dtype=np.int64)
+        parent[s] = s
+        frontier = np.array([s])
+        for _ in range(max_depth):
+            nbr, par, _ = self._expand(frontier)
+            fresh = parent[nbr] < 0
+            nbr, par = nbr[fresh], par[fresh]
+            if not len(nbr):
+                return None
+            nbr, first = np.unique(nbr, return_index=True)
+            parent[nbr] = par[first]
+            if parent[t] >= 0:
+                path = [t]
+                while path[-1] != s:
+                    path.append(int(parent[path[-1]]))
+                return [int(self.ids[i]) for i in reversed(path)]
+            frontier = nbr
+        return None
+
+    def edges_within(self, entity_ids):
+        # 给定实体集合内部的共现边 [(a, b, weight)]，a < b
+        idx = [i for i in (self._index_of(e) for e in entity_ids) if i is not None]
+        if not idx:
+            return []
+        idx = np.array(sorted(idx))
+        nbr, par, w = self._expand(idx)
+        keep = np.isin(nbr, idx) & (par < nbr)
+        return [(int(self.ids[p]), int(self.ids[q]), int(x)) for p, q, x in zip(par[keep], nbr[keep], w[keep])]
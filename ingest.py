@@ -0,0 +1,282 @@
+"""
+DeepTrace 线索批量入库引擎
+
+可在 Streamlit 之外直接调用，用于脚本化导入夜间数据：
+
+    python ingest.py clues_0101.xlsx clues_0102.csv drop.jsonl --chunk-size 5000
+
+xlsx / csv / jsonl 均按批流式读取，峰值内存与文件大小无关；每块提交后建立近重复索引 (见 dedup.py)。
+"""
+import argparse
+import io
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+from openpyxl import load_workbook
+from psycopg2.extras import execute_values
+
+from db import get_db_conn
+from dedup import index_pending
+from partitions import ensure_partitions
+from rollups import update_ingest_rollups
+
+# ==========================================
+# 1. 字段映射
+# ==========================================
+COL_MAP = {
+    '来源邮箱': 'source_email', '发件人': 'source_email', '邮箱': 'source_email',
+    '批次': 'batch_no', '收发日期': 'send_time', '时间': 'send_time',
+    '邮件内容': 'content', '正文': 'content', '邮件名': 'subject', '标题': 'subject', '主题': 'subject',
+    '记录人': 'recorder', '备注': 'remarks', '原件名': 'original_file', '机构': 'org'
+}
+
+CLUE_COLUMNS = ['source_email', 'batch_no', 'send_time', 'content', 'subject',
+                'recorder', 'remarks', 'original_file', 'org']
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def normalize_frame(df, now=None):
+    df = df.rename(columns=COL_MAP)
+    # 多个原始表头映射到同一字段时（如 发件人/邮箱），逐行取第一个非空值
+    if df.columns.duplicated().any():
+        merged = {}
+        for col in df.columns.unique():
+            sub = df.loc[:, df.columns == col]
+            merged[col] = sub.bfill(axis=1).iloc[:, 0] if sub.shape[1] > 1 else sub.iloc[:, 0]
+        df = pd.DataFrame(merged)
+
+    out = df.reindex(columns=CLUE_COLUMNS)
+    # 缺失或无法解析的时间统一回落为入库时间
+    send_time = pd.to_datetime(out['send_time'], errors='coerce')
+    out['send_time'] = send_time.fillna(pd.Timestamp(now or datetime.now()))
+
+    # Excel 中的纯数字列（如批次号）带缺失值时会被读成 float，还原为整数避免写入 "123.0"
+    for col in CLUE_COLUMNS:
+        s = out[col]
+        if pd.api.types.is_float_dtype(s) and (s.dropna() % 1 == 0).all():
+            out[col] = s.astype('Int64')
+    return out
+
+
+# ==========================================
+# 2. 写入方式
+# ==========================================
+# 写入前先从 t_clues 的序列取好 id 并随数据写入：COPY 无法 RETURNING，入库后只为本块新线索建立去重索引
+def _reserve_ids(cur, n):
+    cur.execute("SELECT nextval(pg_get_serial_sequence('t_clues', 'id')) FROM generate_series(1, %s)", (n,))
+    return [r[0] for r in cur.fetchall()]
+
+
+def _copy_chunk(cur, chunk):
+    buf = io.StringIO()
+    chunk.to_csv(buf, header=False, index=False, date_format='%Y-%m-%d %H:%M:%S.%f')
+    buf.seek(0)
+    cur.copy_expert(
+        f"COPY t_clues ({', '.join(chunk.columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def _values_chunk(cur, chunk):
+    rows = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+    execute_values(
+        cur, f"INSERT INTO t_clues ({', '.join(chunk.columns)}) VALUES %s",
+        list(rows), page_size=1000)
+
+
+WRITERS = {'copy': _copy_chunk, 'values': _values_chunk}
+
+
+# ==========================================
+# 3. 流式读取
+# ==========================================
+SUPPORTED_TYPES = ['xlsx', 'csv', 'jsonl']
+
+
+@contextmanager
+def _open_source(source):
+    # 路径由本模块打开/关闭；上传对象等文件句柄由调用方负责
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as fh:
+            yield fh
+    else:
+        yield source
+
+
+def _source_size(fh):
+    size = getattr(fh, 'size', None)
+    if size:
+        return size
+    try:
+        pos = fh.tell()
+        size = fh.seek(0, os.SEEK_END)
+        fh.seek(pos)
+        return size or None
+    except Exception:
+        return None
+
+
+def _fraction(done, total):
+    if not total:
+        return None
+    return min(done / total, 1.0)
+
+
+def iter_xlsx_batches(source, batch_size=DEFAULT_CHUNK_SIZE):
+    # openpyxl 只读模式逐行解析，不构建整张表
+    with _open_source(source) as fh:
+        wb = load_workbook(fh, read_only=True, data_only=True)
+        try:
+            ws = wb.worksheets[0]
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            header = [str(h).strip() if h is not None else f"_col{i}" for i, h in enumerate(header)]
+            width = len(header)
+            total = ws.max_row - 1 if ws.max_row else None
+            buf, done = [], 0
+            for row in rows:
+                if all(v is None for v in row):
+                    continue
+                buf.append(tuple(row[:width]) + (None,) * (width - len(row)))
+                if len(buf) >= batch_size:
+                    done += len(buf)
+                    yield pd.DataFrame(buf, columns=header), _fraction(done, total)
+                    buf = []
+            if buf:
+                yield pd.DataFrame(buf, columns=header), 1.0
+        finally:
+            wb.close()
+
+
+def iter_csv_batches(source, batch_size=DEFAULT_CHUNK_SIZE):
+    # 全部按文本读取，类型转换统一交给 normalize_frame，避免各分块推断结果不一致
+    with _open_source(source) as fh:
+        size = _source_size(fh)
+        reader = pd.read_csv(fh, chunksize=batch_size, dtype=str, encoding='utf-8-sig')
+        for chunk in reader:
+            yield chunk, _fraction(fh.tell(), size)
+
+
+def iter_jsonl_batches(source, batch_size=DEFAULT_CHUNK_SIZE):
+    with _open_source(source) as fh:
+        size = _source_size(fh)
+        reader = pd.read_json(fh, lines=True, chunksize=batch_size, dtype=False)
+        for chunk in reader:
+            yield chunk, _fraction(fh.tell(), size)
+
+
+READERS = {'xlsx': iter_xlsx_batches, 'csv': iter_csv_batches, 'jsonl': iter_jsonl_batches}
+
+
+def iter_file_batches(source, filename=None, batch_size=DEFAULT_CHUNK_SIZE):
+    name = filename or getattr(source, 'name', None) or str(source)
+    ext = os.path.splitext(name)[1].lower().lstrip('.')
+    if ext == 'json':
+        ext = 'jsonl'
+    if ext not in READERS:
+        raise ValueError(f"不支持的文件类型: {name}")
+    return READERS[ext](source, batch_size=batch_size)
+
+
+# ==========================================
+# 4. 分块入库
+# ==========================================
+def ingest_batches(batches, conn=None, method='copy', on_progress=None):
+    # 每个分块单独提交：某块失败只回滚该块，其余分块照常入库
+    # batches 产出 (DataFrame, 进度比例或 None)，on_progress(已读行数, 进度比例)
+    result = {'inserted': 0, 'rows': 0, 'duplicates': 0, 'chunks': [], 'errors': []}
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_conn()
+    if not conn:
+        result['errors'].append("数据库连接失败")
+        return result
+
+    writer = WRITERS[method]
+    now = datetime.now()
+    batches = iter(batches)
+    no = 0
+    try:
+        while True:
+            try:
+                raw, fraction = next(batches)
+            except StopIteration:
+                break
+            except Exception as e:
+                result['errors'].append(f"文件读取失败 (已读 {result['rows']} 行): {e}")
+                break
+
+            chunk = normalize_frame(raw, now=now)
+            start = result['rows']
+            result['rows'] += len(chunk)
+            try:
+                # 月份分区在单独的短事务中建好，写入事务不持有父表上的锁
+                ensure_partitions(conn, chunk['send_time'])
+                with conn.cursor() as cur:
+                    ids = _reserve_ids(cur, len(chunk))
+                    writer(cur, chunk.assign(id=ids)[['id'] + CLUE_COLUMNS])
+                    update_ingest_rollups(cur, chunk)
+                conn.commit()
+                result['inserted'] += len(chunk)
+                result['chunks'].append({'chunk': no, 'rows': len(chunk), 'inserted': len(chunk), 'error': None})
+            except Exception as e:
+                conn.rollback()
+                result['errors'].append(f"分块 {no} (第 {start + 1}-{start + len(chunk)} 行): {str(e).strip()}")
+                result['chunks'].append({'chunk': no, 'rows': len(chunk), 'inserted': 0, 'error': str(e).strip()})
+            else:
+                # 只为本块线索建立去重索引，历史数据由 python dedup.py 补建；
+                # 去重索引失败不影响已提交的线索，未建索引的线索照常进入分析队列
+                try:
+                    result['duplicates'] += index_pending(conn, clue_ids=ids, send_times=chunk['send_time'].unique())[1]
+                except Exception as e:
+                    conn.rollback()
+                    result['errors'].append(f"分块 {no} 去重索引失败: {str(e).strip()}")
+            no += 1
+            if on_progress:
+                on_progress(result['rows'], fraction)
+    finally:
+        if own_conn:
+            conn.close()
+    return result
+
+
+def ingest_dataframe(df, conn=None, chunk_size=DEFAULT_CHUNK_SIZE, method='copy'):
+    total = len(df)
+    batches = ((df.iloc[start:start + chunk_size], _fraction(min(start + chunk_size, total), total))
+               for start in range(0, total, chunk_size))
+    return ingest_batches(batches, conn=conn, method=method)
+
+
+def ingest_file(source, filename=None, conn=None, chunk_size=DEFAULT_CHUNK_SIZE, method='copy',
+                on_progress=None):
+    try:
+        batches = iter_file_batches(source, filename=filename, batch_size=chunk_size)
+    except ValueError as e:
+        return {'inserted': 0, 'rows': 0, 'duplicates': 0, 'chunks': [], 'errors': [str(e)]}
+    return ingest_batches(batches, conn=conn, method=method, on_progress=on_progress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DeepTrace 线索批量入库")
+    parser.add_argument('files', nargs='+', help="待导入的 xlsx / csv / jsonl 文件")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--method', choices=sorted(WRITERS), default='copy')
+    args = parser.parse_args(argv)
+
+    failed = False
+    for path in args.files:
+        result = ingest_file(path, chunk_size=args.chunk_size, method=args.method)
+        print(f"{path}: 读取 {result['rows']} 行, 入库 {result['inserted']} 条 (近重复 {result['duplicates']} 条), "
+              f"分块 {len(result['chunks'])}, 失败 {len(result['errors'])}")
+        for err in result['errors']:
+            print(f"  ! {err}", file=sys.stderr)
+        failed = failed or bool(result['errors'])
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+DeepTrace 运行时埋点
+
+计时区间 (span) 与计数器在进程内聚合，可导出为 Prometheus 文本格式或 JSONL；慢查询可选记录执行计划。
+默认关闭：span() 返回共享的空上下文，count() 直接返回，关闭时的开销只有一次全局变量判断。
+
+    DEEPTRACE_INSTRUMENT=1           启用埋点 (页面 "性能剖析" 面板中也可按进程开关)
+    DEEPTRACE_EXPLAIN_SLOW_MS=500    只读查询超过该耗时时重跑 EXPLAIN (ANALYZE, BUFFERS)，0 为关闭
+
+命名约定：sql.* 数据库查询、db.* 页面数据加载、nlp.* / pipeline.* 分析阶段、graph.* 图谱构建、page.* 渲染；
+计数器 rows.* 为读取行数，calls.* 为缓存函数调用次数 (与同名 db.* 区间次数之差即缓存命中)。
+统计按进程保存：多进程抽取 (--workers > 1) 时 nlp.* 记在子进程中，需分阶段耗时请以单进程运行。
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from functools import wraps
+
+import pandas as pd
+
+ENABLED = os.getenv('DEEPTRACE_INSTRUMENT', '0').lower() not in ('', '0', 'false', 'no')
+EXPLAIN_SLOW_MS = float(os.getenv('DEEPTRACE_EXPLAIN_SLOW_MS', '0'))
+SLOW_LOG_SIZE = 20   # 保留最近的慢查询执行计划条数
+
+_NOOP = nullcontext()
+_lock = threading.Lock()
+_spans = {}                          # name -> [次数, 总秒数, 最大秒数]
+_counters = {}                       # name -> 累计值
+_slow = deque(maxlen=SLOW_LOG_SIZE)  # 慢查询及执行计划
+_started = time.time()
+
+
+# ==========================================
+# 1. 开关
+# ==========================================
+def enable(on=True, explain_slow_ms=None):
+    global ENABLED, EXPLAIN_SLOW_MS
+    ENABLED = bool(on)
+    if explain_slow_ms is not None:
+        EXPLAIN_SLOW_MS = float(explain_slow_ms)
+
+
+def reset():
+    global _started
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _slow.clear()
+        _started = time.time()
+
+
+# ==========================================
+# 2. 计时与计数
+# ==========================================
+def observe(name, seconds):
+    if not ENABLED:
+        return
+    with _lock:
+        stat = _spans.get(name)
+        if stat is None:
+            _spans[name] = [1, seconds, seconds]
+        else:
+            stat[0] += 1
+            stat[1] += seconds
+            if seconds > stat[2]:
+                stat[2] = seconds
+
+
+def count(name, n=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+class _Span:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def span(name):
+    return _Span(name) if ENABLED else _NOOP
+
+
+def traced(name):
+    # 函数级计时装饰器；每次调用时判断开关，运行中开启 / 关闭立即生效
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def counted(name):
+    # 套在 st.cache_data 外层统计调用次数；缓存未命中时函数体内的 db.<name> 区间才会计时
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if ENABLED:
+                count(f"calls.{name}")
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# ==========================================
+# 3. 查询剖析
+# ==========================================
+def read_sql(name, sql, conn, params=None):
+    # pd.read_sql 的埋点版本：计时、累计行数，超过阈值时记录执行计划；仅用于只读查询
+    if not ENABLED:
+        return pd.read_sql(sql, conn, params=params)
+    started = time.perf_counter()
+    df = pd.read_sql(sql, conn, params=params)
+    elapsed = time.perf_counter() - started
+    observe(f"sql.{name}", elapsed)
+    count(f"rows.{name}", len(df))
+    if EXPLAIN_SLOW_MS and elapsed * 1000 >= EXPLAIN_SLOW_MS:
+        capture_plan(conn, name, sql, params, elapsed)
+    return df
+
+
+def capture_plan(conn, name, sql, params, elapsed):
+    # EXPLAIN ANALYZE 会再执行一次查询，因此只在慢查询上触发
+    try:
+        with conn.cursor() as cur:
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+            plan = "\n".join(row[0] for row in cur.fetchall())
+    except Exception as e:
+        conn.rollback()
+        plan = f"执行计划获取失败: {str(e).strip()}"
+    with _lock:
+        _slow.append({'name': name, 'ms': round(elapsed * 1000, 1), 'at': time.strftime("%Y-%m-%d %H:%M:%S"),
+                      'sql': " ".join(sql.split()), 'params': repr(params)[:500], 'plan': plan})
+
+
+# ==========================================
+# 4. 导出
+# ==========================================
+def snapshot():
+    with _lock:
+        spans = [{'name': n, 'count': c, 'total': t, 'avg': t / c, 'max': m} for n, (c, t, m) in _spans.items()]
+        counters = dict(_counters)
+        slow = list(_slow)
+    spans.sort(key=lambda s: -s['total'])
+    return {'enabled': ENABLED, 'explain_slow_ms': EXPLAIN_SLOW_MS, 'since': _started, 'pid': os.getpid(),
+            'spans': spans, 'counters': counters, 'slow_queries': slow}
+
+
+def cache_stats(snap=None):
+    # 由 calls.<name> 与 db.<name> 推算缓存命中率
+    snap = snap or snapshot()
+    misses = {s['name'][3:]: s['count'] for s in snap['spans'] if s['name'].startswith('db.')}
+    rows = []
+    for key, calls in snap['counters'].items():
+        if key.startswith('calls.'):
+            name = key[6:]
+            hits = max(calls - misses.get(name, 0), 0)
+            rows.append({'name': name, 'calls': calls, 'hits': hits, 'hit_rate': hits / calls if calls else 0.0})
+    return rows
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def prometheus_text(snap=None):
+    snap = snap or snapshot()
+    lines = [
+        "# HELP deeptrace_span_seconds_total 区间累计耗时", "# TYPE deeptrace_span_seconds_total counter",
+        *(f'deeptrace_span_seconds_total{{span="{_label(s["name"])}"}} {s["total"]:.6f}' for s in snap['spans']),
+        "# HELP deeptrace_span_count_total 区间次数", "# TYPE deeptrace_span_count_total counter",
+        *(f'deeptrace_span_count_total{{span="{_label(s["name"])}"}} {s["count"]}' for s in snap['spans']),
+        "# HELP deeptrace_span_seconds_max 区间最大耗时", "# TYPE deeptrace_span_seconds_max gauge",
+        *(f'deeptrace_span_seconds_max{{span="{_label(s["name"])}"}} {s["max"]:.6f}' for s in snap['spans']),
+        "# HELP deeptrace_events_total 计数器", "# TYPE deeptrace_events_total counter",
+        *(f'deeptrace_events_total{{name="{_label(k)}"}} {v}' for k, v in sorted(snap['counters'].items())),
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def jsonl_text(snap=None):
+    # 每行一条记录 (span / counter / slow_query)，便于追加到日志后用 jq / pandas 分析
+    snap = snap or snapshot()
+    base = {'ts': time.time(), 'pid': snap['pid']}
+    records = [{**base, 'kind': 'span', **s} for s in snap['spans']]
+    records += [{**base, 'kind': 'counter', 'name': k, 'value': v} for k, v in snap['counters'].items()]
+    records += [{**base, 'kind': 'slow_query', **q} for q in snap['slow_queries']]
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+
+
+def dump(path):
+    # .jsonl 追加写入；其他扩展名按 Prometheus 文本格式整体替换 (可供 node_exporter textfile collector 读取)
+    if path.endswith('.jsonl'):
+        with open(path, 'a', encoding='utf-8') as fh:
+            fh.write(jsonl_text())
+        return
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        fh.write(prometheus_text())
+    os.replace(tmp, path)
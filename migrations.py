@@ -0,0 +1,302 @@
+"""
+DeepTrace 数据库结构迁移
+
+按版本号顺序执行，已执行的版本记录在 t_schema_migrations，每个版本只运行一次。
+应用每个进程启动时调用一次 migrate(manual=False)；数据库已是最新版本时只有一次查询。
+重写或全表扫描线索表的版本 (MANUAL_VERSIONS) 不在 Web 进程中执行，页面提示后停止，
+需在维护窗口手动执行 (新建的空库、按 schema.sql 建的库无需改动，仍自动执行)；
+无界面部署 (只运行 worker / 脚本导入) 时同样手动执行：
+
+    python migrations.py
+"""
+import sys
+import time
+
+from db import get_db_conn
+from graph_index import COOCCURRENCE_BACKFILL, COOCCURRENCE_VERSION_BUMP, COOCCURRENCE_VERSION_TABLE
+from partitions import convert_to_partitioned, is_partitioned
+from rollups import ROLLUP_BACKFILLS
+from search import SEARCH_INDEXES
+
+MIGRATION_LOCK = 20240607   # pg_advisory_lock 键，多个进程同时启动时串行执行迁移
+
+
+class MigrationPending(RuntimeError):
+    # 需要手动执行的版本尚未执行；后续版本依赖它，代码不能在旧结构上运行
+    def __init__(self, names):
+        super().__init__("数据库结构需要升级 (" + "、".join(names) + ")，请在维护窗口执行 python migrations.py")
+        self.names = names
+
+
+# ==========================================
+# 1. 迁移版本
+# ==========================================
+# 001 与此前每次启动执行的建表语句一致 (均为 IF NOT EXISTS)，已有数据库可直接升级；
+# 只含建表 / 加列 (带常量默认值的加列不重写表)，从已有数据回填汇总表见迁移 003
+BASELINE = [
+    """
+    CREATE TABLE IF NOT EXISTS t_clues (
+        id SERIAL PRIMARY KEY, source_email VARCHAR(150), batch_no VARCHAR(100),
+        send_time TIMESTAMP, content TEXT, subject VARCHAR(255), recorder VARCHAR(100),
+        remarks TEXT, original_file VARCHAR(255), process_status SMALLINT DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, org VARCHAR(200)
+    )
+    """,
+    "ALTER TABLE t_clues ADD COLUMN IF NOT EXISTS org VARCHAR(200)",
+    "ALTER TABLE t_clues ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP",
+    "ALTER TABLE t_clues ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(100)",
+    # 近重复索引：canonical_id 为 NULL 表示尚未建立，历史数据可运行 python dedup.py 补建
+    "ALTER TABLE t_clues ADD COLUMN IF NOT EXISTS content_hash VARCHAR(32)",
+    "ALTER TABLE t_clues ADD COLUMN IF NOT EXISTS canonical_id INT",
+    # canonical_time 为规范线索的 send_time (分区键)，按规范线索查询时只访问其所在月份的分区
+    "ALTER TABLE t_clues ADD COLUMN IF NOT EXISTS canonical_time TIMESTAMP",
+    # 规范线索的重复副本数，由去重索引维护
+    "ALTER TABLE t_clues ADD COLUMN IF NOT EXISTS dup_count INT NOT NULL DEFAULT 0",
+    "CREATE INDEX IF NOT EXISTS idx_clues_content_hash ON t_clues(content_hash)",
+    "CREATE INDEX IF NOT EXISTS idx_clues_canonical_id ON t_clues(canonical_id)",
+    "CREATE TABLE IF NOT EXISTS t_clue_signatures (clue_id INT PRIMARY KEY, signature BYTEA NOT NULL)",
+    "ALTER TABLE t_clue_signatures ADD COLUMN IF NOT EXISTS send_time TIMESTAMP",
+    """
+    CREATE TABLE IF NOT EXISTS t_clue_bands (
+        band SMALLINT NOT NULL, bucket BIGINT NOT NULL, clue_id INT NOT NULL,
+        PRIMARY KEY (band, bucket, clue_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_entities (
+        id SERIAL PRIMARY KEY, name VARCHAR(200) NOT NULL, type VARCHAR(50) NOT NULL,
+        UNIQUE(name, type)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_relations (
+        clue_id INT REFERENCES t_clues(id), entity_id INT REFERENCES t_entities(id),
+        PRIMARY KEY (clue_id, entity_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_clue_days (
+        org VARCHAR(200) NOT NULL DEFAULT '', day DATE NOT NULL, clue_count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (org, day)
+    )
+    """,
+    # generation 为 (机构, 日期) 数据版本，查询缓存以其为键失效；dup_count / dup_groups 为每日重复汇总
+    """
+    ALTER TABLE t_clue_days ADD COLUMN IF NOT EXISTS generation BIGINT NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS dup_count INT NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS dup_groups INT NOT NULL DEFAULT 0
+    """,
+    # 发件人 / 实体按 (机构, 日期) 的汇总表，分别由入库与分析管道增量维护
+    """
+    CREATE TABLE IF NOT EXISTS t_sender_days (
+        source_email VARCHAR(150) NOT NULL, org VARCHAR(200) NOT NULL DEFAULT '', day DATE NOT NULL,
+        clue_count INT NOT NULL DEFAULT 0, PRIMARY KEY (source_email, org, day)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_entity_days (
+        entity_id INT NOT NULL, org VARCHAR(200) NOT NULL DEFAULT '', day DATE NOT NULL,
+        clue_count INT NOT NULL DEFAULT 0, PRIMARY KEY (entity_id, org, day)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_sender_days_day ON t_sender_days(day, org)",
+    "CREATE INDEX IF NOT EXISTS idx_entity_days_day ON t_entity_days(day, org)",
+    """
+    CREATE TABLE IF NOT EXISTS t_watchlist (
+        term VARCHAR(200) NOT NULL, type VARCHAR(50) NOT NULL,
+        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (term, type)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_cooccurrence (
+        entity_a INT NOT NULL, entity_b INT NOT NULL, clue_count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (entity_a, entity_b)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_cooccurrence_entity_b ON t_cooccurrence(entity_b)",
+    *COOCCURRENCE_VERSION_TABLE,
+    """
+    CREATE TABLE IF NOT EXISTS t_pipeline_workers (
+        worker_id VARCHAR(100) PRIMARY KEY, started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        heartbeat_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, processed INT DEFAULT 0,
+        failed INT DEFAULT 0, docs_per_sec REAL DEFAULT 0
+    )
+    """,
+]
+
+# 从已有数据回填汇总表与去重索引的分区键；空表不扫描。NOT EXISTS 使重复执行时不会重复累加
+BACKFILLS = [
+    """
+    INSERT INTO t_clue_days (org, day, clue_count)
+    SELECT COALESCE(org, ''), send_time::date, COUNT(*) FROM t_clues
+    WHERE send_time IS NOT NULL AND NOT EXISTS (SELECT 1 FROM t_clue_days)
+    GROUP BY 1, 2
+    """,
+    *ROLLUP_BACKFILLS,
+    COOCCURRENCE_BACKFILL,
+    COOCCURRENCE_VERSION_BUMP,
+    # 此前用 python dedup.py 建立的去重索引：补记规范线索的 send_time 与副本数
+    """
+    UPDATE t_clues d SET canonical_time = k.send_time
+    FROM t_clues k WHERE k.id = d.canonical_id AND d.canonical_time IS NULL
+    """,
+    """
+    UPDATE t_clue_signatures s SET send_time = c.send_time
+    FROM t_clues c WHERE c.id = s.clue_id AND s.send_time IS NULL
+    """,
+    """
+    UPDATE t_clues k SET dup_count = d.n
+    FROM (SELECT canonical_id, COUNT(*) AS n FROM t_clues WHERE canonical_id <> id GROUP BY 1) d
+    WHERE k.id = d.canonical_id
+    """,
+    """
+    UPDATE t_clue_days t SET dup_count = s.dups, dup_groups = s.groups
+    FROM (
+        SELECT org, day, SUM(dups) AS dups, SUM(groups) AS groups FROM (
+            SELECT COALESCE(org, '') AS org, send_time::date AS day, COUNT(*) AS dups, 0 AS groups
+            FROM t_clues WHERE canonical_id <> id GROUP BY 1, 2
+            UNION ALL
+            SELECT COALESCE(org, ''), send_time::date, 0, COUNT(*) FROM t_clues WHERE dup_count > 0 GROUP BY 1, 2
+        ) x GROUP BY 1, 2
+    ) s
+    WHERE t.org = s.org AND t.day = s.day
+    """,
+]
+
+# (版本, 名称, 语句列表, 是否可选)；可选版本失败时只给出警告，不阻塞后续版本，下次启动重试
+# 语句也可以是以游标为参数的函数，用于需要先查询再决定执行内容的迁移
+MIGRATIONS = [
+    (1, "基础表结构", BASELINE, False),
+    # 需要 pg_trgm 扩展；无权限安装时查询仍可用 (退化为顺序扫描)
+    (2, "关键词检索索引 (pg_trgm)", ["CREATE EXTENSION IF NOT EXISTS pg_trgm", *SEARCH_INDEXES], True),
+    # 扫描 t_clues / t_relations 全表，大库请在维护窗口手动执行 python migrations.py
+    (3, "汇总表回填", BACKFILLS, False),
+    # 需要 PostgreSQL 12+；会重写 t_clues / t_relations 全表，大库请在维护窗口手动执行 python migrations.py
+    (4, "按月分区存储 (t_clues / t_relations)", [convert_to_partitioned], False),
+    # 已分析的历史线索没有版本记录，首次强制重扫时全部视为需要重新分析
+    (5, "抽取版本记录与失败重试", [
+        """
+        ALTER TABLE t_clues ADD COLUMN IF NOT EXISTS extractor_version VARCHAR(100),
+            ADD COLUMN IF NOT EXISTS rules_version VARCHAR(100),
+            ADD COLUMN IF NOT EXISTS extracted_hash VARCHAR(32),
+            ADD COLUMN IF NOT EXISTS extracted_at TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS retry_count SMALLINT NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS next_retry_at TIMESTAMP
+        """,
+        # 此前失败的线索按可立即重试处理
+        "UPDATE t_clues SET next_retry_at = now() WHERE process_status = -1",
+        """
+        CREATE TABLE IF NOT EXISTS t_pipeline_checkpoints (
+            name VARCHAR(50) PRIMARY KEY, target VARCHAR(100) NOT NULL, position INT NOT NULL DEFAULT 0,
+            marked INT NOT NULL DEFAULT 0, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ], False),
+]
+
+
+def _clues_empty(cur):
+    cur.execute("SELECT NOT EXISTS (SELECT 1 FROM t_clues)")
+    return cur.fetchone()[0]
+
+
+# 耗时与数据量成正比的版本：Web 进程 (连接带 statement_timeout) 不自动执行，除非对应的检查表明执行时无事可做
+# (空库，或按 schema.sql 建的库已是分区表)，此时仍自动执行并记录版本
+MANUAL_VERSIONS = {
+    3: _clues_empty,
+    4: lambda cur: is_partitioned(cur) or _clues_empty(cur),
+}
+
+
+# ==========================================
+# 2. 执行
+# ==========================================
+def applied_versions(cur):
+    cur.execute("SELECT to_regclass('t_schema_migrations')")
+    if cur.fetchone()[0] is None:
+        return set()
+    cur.execute("SELECT version FROM t_schema_migrations")
+    return {r[0] for r in cur.fetchall()}
+
+
+def migrate(conn, manual=True):
+    # 返回 {'applied': [已执行版本], 'warnings': [失败信息], 'pending': [待手动执行版本], 'seconds': 耗时}
+    # manual=False 时遇到 MANUAL_VERSIONS 中未执行且不能跳过的版本即停止，其后的版本也不执行
+    started = time.perf_counter()
+    result = {'applied': [], 'warnings': [], 'pending': [], 'seconds': 0.0}
+    with conn.cursor() as cur:
+        done = applied_versions(cur)
+    conn.commit()
+    if all(version in done for version, _, _, _ in MIGRATIONS):
+        result['seconds'] = time.perf_counter() - started
+        return result
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK,))
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS t_schema_migrations (
+                    version INT PRIMARY KEY, name VARCHAR(200) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.commit()
+            # 等锁期间其他进程可能已完成迁移
+            done = applied_versions(cur)
+        conn.commit()
+        for version, name, statements, optional in MIGRATIONS:
+            if version in done:
+                continue
+            if not manual and version in MANUAL_VERSIONS:
+                with conn.cursor() as cur:
+                    trivial = MANUAL_VERSIONS[version](cur)
+                conn.commit()
+                if not trivial:
+                    result['pending'].append(f"{version:03d} {name}")
+                    break
+            # 每个版本一个事务，与版本记录同时提交；连接池设置的语句超时不适用于迁移
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SET LOCAL statement_timeout = 0")
+                    for sql in statements:
+                        if callable(sql):
+                            sql(cur)
+                        else:
+                            cur.execute(sql)
+                    cur.execute("INSERT INTO t_schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                conn.commit()
+                result['applied'].append(f"{version:03d} {name}")
+            except Exception as e:
+                conn.rollback()
+                result['warnings'].append(f"迁移 {version:03d} {name} 失败: {str(e).strip()}")
+                if not optional:
+                    break
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK,))
+        conn.commit()
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def main():
+    conn = get_db_conn()
+    if not conn:
+        print("数据库连接失败", file=sys.stderr)
+        return 1
+    try:
+        result = migrate(conn)
+    finally:
+        conn.close()
+    for name in result['applied']:
+        print(f"已执行 {name}")
+    for warning in result['warnings']:
+        print(f"  ! {warning}", file=sys.stderr)
+    if not result['applied'] and not result['warnings']:
+        print("数据库结构已是最新版本")
+    return 1 if result['warnings'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+DeepTrace 实体抽取
+
+先对整条线索运行规则抽取 (见 rules.py)，再按句切分、按句长分桶后批量调用 HanLP 分词 / NER 模型，
+把各句实体按线索归并。不依赖 Streamlit，可在后台 worker 中复用。
+"""
+import multiprocessing
+import os
+import re
+
+from db import get_db_conn
+from instrument import count, span
+from rules import PATTERN_MATCHER, current_matcher
+
+# ==========================================
+# 1. 配置
+# ==========================================
+DEFAULT_BATCH_SIZE = 32   # 每次送入模型的句子数
+MAX_SENT_LEN = 126        # 超长句按此长度硬切，避免单句拉高整批 padding
+
+LABEL_MAP = {
+    'PERSON': '人名', 'PER': '人名', 'NR': '人名',
+    'ORG': '机构', 'ORGANIZATION': '机构', 'NT': '机构',
+    'LOC': '地名', 'LOCATION': '地名', 'NS': '地名',
+}
+
+SENTENCE_RE = re.compile(r'[^。！？!?；;\n]+[。！？!?；;\n]*')
+
+# 抽取器版本记录在每条线索的 extractor_version 中；更换模型或修改切句 / 标签映射时递增 EXTRACTOR_REVISION。
+# 规则与关注名单的版本单独记录在 rules_version 中 (见 rules.RuleMatcher.version)，其变化只需重跑规则抽取。
+# 强制重扫只重新分析版本不同或正文已变化的线索
+TOK_MODEL = 'COARSE_ELECTRA_SMALL_ZH'
+NER_MODEL = 'MSRA_NER_ELECTRA_SMALL_ZH'
+EXTRACTOR_REVISION = 1
+EXTRACTOR_VERSION = f"{EXTRACTOR_REVISION}:{TOK_MODEL}:{NER_MODEL}"
+RULES_VERSION = f"{EXTRACTOR_REVISION}:rules"   # 仅规则初筛
+
+# 与 clue_text 拼接方式一致的正文哈希，在库内计算，判断线索自上次抽取后是否变化
+TEXT_HASH_SQL = "md5(concat_ws(' ', COALESCE(subject, ''), COALESCE(content, ''), COALESCE(source_email, '')))"
+
+
+def load_models():
+    import hanlp
+    tok = hanlp.load(getattr(hanlp.pretrained.tok, TOK_MODEL))
+    ner = hanlp.load(getattr(hanlp.pretrained.ner, NER_MODEL))
+    return tok, ner
+
+
+# ==========================================
+# 2. 文本切分
+# ==========================================
+def clue_text(subject, content, email):
+    return f"{subject or ''} {content or ''} {email or ''}"
+
+
+def clue_keys(clues):
+    # {线索 id: send_time} -> (id 列表, send_time 列表)；按 id 查询时同时限定分区键，只访问相关月份的分区
+    return list(clues), sorted(set(clues.values()))
+
+
+def fetch_clue_texts(cur, clues):
+    # clues: {线索 id: send_time}
+    cur.execute("SELECT id, content, subject, source_email FROM t_clues WHERE id = ANY(%s) AND send_time = ANY(%s)",
+                clue_keys(clues))
+    return [(cid, clue_text(subject, content, email)) for cid, content, subject, email in cur.fetchall()]
+
+
+def split_sentences(text, max_len=MAX_SENT_LEN):
+    sentences = []
+    for m in SENTENCE_RE.finditer(text):
+        s = m.group().strip()
+        while len(s) > max_len:
+            sentences.append(s[:max_len])
+            s = s[max_len:]
+        if s:
+            sentences.append(s)
+    return sentences
+
+
+# ==========================================
+# 3. 批量抽取
+# ==========================================
+def extract_batch(tok, ner, items, batch_size=DEFAULT_BATCH_SIZE, matcher=PATTERN_MATCHER):
+    # items: [(clue_id, text)]，返回 {clue_id: {(name, type)}}；tok / ner 为 None 时只做规则抽取
+    with span("nlp.regex"):
+        results = {cid: matcher.extract(text) for cid, text in items}
+    if tok is None or ner is None:
+        return results
+    sentences = []
+    for cid, text in items:
+        sentences.extend((cid, s) for s in split_sentences(text))
+
+    # 按句长排序后切批，同一批内句长接近，padding 最少
+    sentences.sort(key=lambda x: len(x[1]))
+    count("nlp.sentences", len(sentences))
+    for start in range(0, len(sentences), batch_size):
+        batch = sentences[start:start + batch_size]
+        with span("nlp.tokenize"):
+            tokens = tok([s for _, s in batch], batch_size=batch_size)
+        with span("nlp.ner"):
+            tagged = ner(tokens, batch_size=batch_size)
+        for (cid, _), ents in zip(batch, tagged):
+            for ent in ents:
+                term, label = ent[0], ent[1]
+                std_label = LABEL_MAP.get(label)
+                if std_label and len(term) > 1:
+                    results[cid].add((term, std_label))
+    return results
+
+
+def extract_entities(tok, ner, items, batch_size=DEFAULT_BATCH_SIZE, matcher=PATTERN_MATCHER):
+    # 整批失败时逐条重试，只把真正出错的线索标记为失败
+    try:
+        return extract_batch(tok, ner, items, batch_size, matcher), []
+    except Exception:
+        pass
+    results, failed = {}, []
+    for cid, text in items:
+        try:
+            results.update(extract_batch(tok, ner, [(cid, text)], batch_size, matcher))
+        except Exception:
+            failed.append(cid)
+    return results, failed
+
+
+# ==========================================
+# 4. 多进程抽取
+# ==========================================
+_worker_models = (None, None)
+_worker_conn = None
+
+
+def _init_worker(threads):
+    # 每个进程只加载一次模型、建立一次数据库连接，并限制 torch 线程数，避免多进程之间争抢 CPU
+    global _worker_models, _worker_conn
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['MKL_NUM_THREADS'] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+    except Exception:
+        pass
+    _worker_models = load_models()
+    _worker_conn = get_db_conn()
+
+
+def _extract_unit(unit):
+    # 工作单元只携带线索 id 与 send_time，正文由 worker 自行读取，结果交回主进程统一写库
+    global _worker_conn
+    clues, batch_size = unit
+    tok, ner = _worker_models
+    # 复用进程内的连接；未连上或已断开时重连
+    if _worker_conn is None or _worker_conn.closed:
+        _worker_conn = get_db_conn()
+    if not _worker_conn:
+        return clues, {}, list(clues)
+    try:
+        with _worker_conn.cursor() as cur:
+            matcher = current_matcher(cur)
+            items = fetch_clue_texts(cur, clues)
+        # 结束只读事务，两个单元之间连接不停留在 idle in transaction
+        _worker_conn.commit()
+    except Exception:
+        # 连接状态未知，丢弃后由下一个单元重连
+        _worker_conn.close()
+        _worker_conn = None
+        raise
+    extracted, failed = extract_entities(tok, ner, items, batch_size, matcher)
+    return clues, extracted, failed
+
+
+def make_pool(workers, threads=1):
+    # spawn 启动，避免 fork 继承父进程中已初始化的 torch / Streamlit 状态
+    ctx = multiprocessing.get_context('spawn')
+    return ctx.Pool(processes=workers, initializer=_init_worker, initargs=(threads,))
+
+
+def extract_units(pool, units, batch_size=DEFAULT_BATCH_SIZE):
+    # units: [{clue_id: send_time}, ...]；逐个产出 (unit, {clue_id: entities}, failed_ids)，完成先后顺序不定
+    yield from pool.imap_unordered(_extract_unit, [(ids, batch_size) for ids in units])
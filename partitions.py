@@ -0,0 +1,326 @@
+"""
+DeepTrace 分区存储
+
+t_clues 与 t_relations 按 send_time 做月度范围分区，关系表冗余 send_time 以与线索落在同一月份的分区，
+按日期筛选的查询只扫描相关月份；旧月份可整体分离归档，查询耗时不随历史数据增长。
+分区在入库前按需创建；不设默认分区，避免其中的数据阻塞后续月份分区的创建。
+
+    python partitions.py list                    # 列出分区及行数估计
+    python partitions.py ensure 2024-01 2025-12  # 预建月份分区
+    python partitions.py archive 2023-01         # 分离 2023-01 之前的分区，改名为 *_archive_YYYYMM 保留
+    python partitions.py archive 2023-01 --drop  # 分离后直接删除
+"""
+import argparse
+import sys
+from datetime import date
+
+import pandas as pd
+
+from db import get_db_conn
+from graph_index import COOCCURRENCE_VERSION_BUMP
+from search import SEARCH_INDEXES
+
+PARTITION_LOCK = 20240608   # pg_advisory_xact_lock 键，多个入库进程同时建分区时串行
+PARTITIONED_TABLES = ('t_clues', 't_relations')
+CLUE_TABLE_COLUMNS = ['id', 'source_email', 'batch_no', 'send_time', 'content', 'subject', 'recorder', 'remarks',
+                      'original_file', 'process_status', 'created_at', 'org', 'claimed_at', 'claimed_by',
+                      'content_hash', 'canonical_id', 'canonical_time', 'dup_count']
+
+
+# ==========================================
+# 1. 表结构
+# ==========================================
+def _clues_ddl(name, id_sequence):
+    return f"""
+        CREATE TABLE {name} (
+            id INT NOT NULL DEFAULT nextval('{id_sequence}'), source_email VARCHAR(150), batch_no VARCHAR(100),
+            send_time TIMESTAMP NOT NULL, content TEXT, subject VARCHAR(255), recorder VARCHAR(100),
+            remarks TEXT, original_file VARCHAR(255), process_status SMALLINT DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, org VARCHAR(200), claimed_at TIMESTAMP,
+            claimed_by VARCHAR(100), content_hash VARCHAR(32), canonical_id INT, canonical_time TIMESTAMP,
+            dup_count INT NOT NULL DEFAULT 0
+        ) PARTITION BY RANGE (send_time)
+    """
+
+
+def _relations_ddl(name):
+    return f"""
+        CREATE TABLE {name} (
+            clue_id INT NOT NULL, entity_id INT NOT NULL, send_time TIMESTAMP NOT NULL
+        ) PARTITION BY RANGE (send_time)
+    """
+
+
+# 主键须包含分区键；send_time 由 id 唯一确定，约束效果与原先相同。索引建在父表上，随分区自动创建
+PARTITIONED_INDEXES = [
+    "ALTER TABLE t_clues ADD CONSTRAINT t_clues_pkey PRIMARY KEY (id, send_time)",
+    "ALTER TABLE t_relations ADD CONSTRAINT t_relations_pkey PRIMARY KEY (clue_id, entity_id, send_time)",
+    """
+    ALTER TABLE t_relations ADD CONSTRAINT t_relations_clue_id_fkey
+        FOREIGN KEY (clue_id, send_time) REFERENCES t_clues (id, send_time) ON DELETE CASCADE
+    """,
+    """
+    ALTER TABLE t_relations ADD CONSTRAINT t_relations_entity_id_fkey
+        FOREIGN KEY (entity_id) REFERENCES t_entities (id) ON DELETE CASCADE
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_clues_org ON t_clues(org, send_time)",
+    "CREATE INDEX IF NOT EXISTS idx_clues_send_time ON t_clues(send_time)",
+    "CREATE INDEX IF NOT EXISTS idx_clues_source_email ON t_clues(source_email)",
+    "CREATE INDEX IF NOT EXISTS idx_clues_content_hash ON t_clues(content_hash)",
+    "CREATE INDEX IF NOT EXISTS idx_clues_canonical_id ON t_clues(canonical_id)",
+    # 部分索引只含未完成的线索 (与 pipeline.UNFINISHED_STATUSES 一致)：待分析队列领取、进度统计不再扫描已完成的数据
+    "CREATE INDEX IF NOT EXISTS idx_clues_queue ON t_clues(id, process_status) WHERE process_status IN (-1, 0, 2, 3)",
+    "CREATE INDEX IF NOT EXISTS idx_relations_entity_id ON t_relations(entity_id)",
+]
+
+
+# ==========================================
+# 2. 分区维护
+# ==========================================
+def month_start(value):
+    value = pd.Timestamp(value)
+    return date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+
+def is_partitioned(cur):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('t_clues')")
+    row = cur.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def list_partitions(cur, table='t_clues'):
+    # 返回已挂载分区的月份 (按分区名解析)
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (table,))
+    prefix = f"{table}_p"
+    months = []
+    for (name,) in cur.fetchall():
+        if name.startswith(prefix) and name[len(prefix):].isdigit():
+            suffix = name[len(prefix):]
+            months.append(date(int(suffix[:4]), int(suffix[4:]), 1))
+    return sorted(months)
+
+
+def create_partitions(cur, months, parents=PARTITIONED_TABLES):
+    # parents 为 (线索表, 关系表) 父表名，迁移时指向新建的临时表名
+    existing = set(list_partitions(cur, parents[0]))
+    for month in sorted(set(months) - existing):
+        bounds = f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+        for parent, table in zip(parents, PARTITIONED_TABLES):
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {parent} {bounds}")
+
+
+def ensure_partitions(conn, send_times):
+    # 入库前调用：建好该批数据涉及的月份分区并单独提交，建分区的锁不随整块入库事务持有
+    times = pd.to_datetime(pd.Series(send_times)).dropna()
+    months = {date(y, m, 1) for y, m in set(zip(times.dt.year, times.dt.month))}
+    with conn.cursor() as cur:
+        if not months or not is_partitioned(cur) or months <= set(list_partitions(cur)):
+            conn.commit()
+            return 0
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_LOCK,))
+        missing = months - set(list_partitions(cur))
+        create_partitions(cur, missing)
+    conn.commit()
+    return len(missing)
+
+
+# ==========================================
+# 3. 迁移：普通表转为分区表
+# ==========================================
+def convert_to_partitioned(cur):
+    # 迁移 003：在同一事务内新建分区表、复制数据、替换原表；大库请在维护窗口执行 python migrations.py
+    if is_partitioned(cur):
+        return
+    cur.execute("SELECT pg_get_serial_sequence('t_clues', 'id')")
+    sequence = cur.fetchone()[0]
+    # 序列归属原表，删除原表前先解除，否则会被一并删除
+    cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+
+    # 早期数据可能没有 send_time，按入库时间归入分区，并补记到汇总表 (汇总表此前未统计这些线索)
+    cur.execute("CREATE TEMP TABLE untimed_clues ON COMMIT DROP AS SELECT id FROM t_clues WHERE send_time IS NULL")
+    cur.execute(_clues_ddl("t_clues_partitioned", sequence))
+    cur.execute(_relations_ddl("t_relations_partitioned"))
+    cur.execute("""
+        SELECT DISTINCT date_trunc('month', COALESCE(send_time, created_at, now()))::date FROM t_clues
+    """)
+    create_partitions(cur, [r[0] for r in cur.fetchall()], ("t_clues_partitioned", "t_relations_partitioned"))
+
+    cols = ", ".join(CLUE_TABLE_COLUMNS)
+    source = cols.replace("send_time", "COALESCE(send_time, created_at, now())")
+    cur.execute(f"INSERT INTO t_clues_partitioned ({cols}) SELECT {source} FROM t_clues")
+    cur.execute("""
+        INSERT INTO t_relations_partitioned (clue_id, entity_id, send_time)
+        SELECT r.clue_id, r.entity_id, c.send_time
+        FROM t_relations r JOIN t_clues_partitioned c ON c.id = r.clue_id
+    """)
+    cur.execute("DROP TABLE t_relations")
+    cur.execute("DROP TABLE t_clues")
+    cur.execute("ALTER TABLE t_clues_partitioned RENAME TO t_clues")
+    cur.execute("ALTER TABLE t_relations_partitioned RENAME TO t_relations")
+    cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY t_clues.id")
+    for sql in PARTITIONED_INDEXES:
+        cur.execute(sql)
+
+    # 关键词检索索引 (迁移 002) 随原表删除，扩展可用时重建
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+    if cur.fetchone()[0]:
+        for sql in SEARCH_INDEXES:
+            cur.execute(sql)
+
+    # 这些线索作为规范线索时，副本与签名表记录的分区键随之更新
+    cur.execute("""
+        UPDATE t_clues d SET canonical_time = k.send_time
+        FROM t_clues k WHERE k.id = d.canonical_id AND k.id IN (SELECT id FROM untimed_clues)
+    """)
+    cur.execute("""
+        UPDATE t_clue_signatures s SET send_time = c.send_time
+        FROM t_clues c WHERE c.id = s.clue_id AND c.id IN (SELECT id FROM untimed_clues)
+    """)
+    cur.execute("""
+        INSERT INTO t_clue_days (org, day, clue_count, generation)
+        SELECT COALESCE(org, ''), send_time::date, COUNT(*), 1 FROM t_clues
+        WHERE id IN (SELECT id FROM untimed_clues) GROUP BY 1, 2
+        ON CONFLICT (org, day) DO UPDATE
+        SET clue_count = t_clue_days.clue_count + EXCLUDED.clue_count, generation = t_clue_days.generation + 1
+    """)
+    cur.execute("""
+        INSERT INTO t_sender_days (source_email, org, day, clue_count)
+        SELECT source_email, COALESCE(org, ''), send_time::date, COUNT(*) FROM t_clues
+        WHERE id IN (SELECT id FROM untimed_clues) AND source_email IS NOT NULL AND source_email != ''
+        GROUP BY 1, 2, 3
+        ON CONFLICT (source_email, org, day) DO UPDATE SET clue_count = t_sender_days.clue_count + EXCLUDED.clue_count
+    """)
+    cur.execute("""
+        INSERT INTO t_entity_days (entity_id, org, day, clue_count)
+        SELECT r.entity_id, COALESCE(c.org, ''), c.send_time::date, COUNT(*)
+        FROM t_relations r JOIN t_clues c ON c.id = r.clue_id AND c.send_time = r.send_time
+        WHERE c.id IN (SELECT id FROM untimed_clues)
+        GROUP BY 1, 2, 3
+        ON CONFLICT (entity_id, org, day) DO UPDATE SET clue_count = t_entity_days.clue_count + EXCLUDED.clue_count
+    """)
+
+
+# ==========================================
+# 4. 归档
+# ==========================================
+def archive_partitions(conn, before, drop=False):
+    # 分离 before 所在月份之前的全部分区，每个月份一个事务；返回 [(月份, 线索数)]
+    # 同时扣除汇总表、共现计数与近重复索引中的相应数据，页面统计与图谱只反映在线数据
+    cutoff = month_start(before)
+    with conn.cursor() as cur:
+        months = [m for m in list_partitions(cur) if m < cutoff]
+    conn.commit()
+    archived = []
+    for month in months:
+        clues, rels = partition_name('t_clues', month), partition_name('t_relations', month)
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT COUNT(*) FROM {clues}")
+            n = cur.fetchone()[0]
+            cur.execute(f"""
+                CREATE TEMP TABLE archived_pairs ON COMMIT DROP AS
+                SELECT r1.entity_id AS a, r2.entity_id AS b, COUNT(*) AS n
+                FROM {rels} r1 JOIN {rels} r2 ON r1.clue_id = r2.clue_id AND r1.entity_id < r2.entity_id
+                GROUP BY 1, 2
+            """)
+            cur.execute("""
+                UPDATE t_cooccurrence t SET clue_count = t.clue_count - p.n
+                FROM archived_pairs p WHERE t.entity_a = p.a AND t.entity_b = p.b
+            """)
+            cur.execute("""
+                DELETE FROM t_cooccurrence t USING archived_pairs p
+                WHERE t.entity_a = p.a AND t.entity_b = p.b AND t.clue_count <= 0
+            """)
+            cur.execute(COOCCURRENCE_VERSION_BUMP)
+            cur.execute(f"DELETE FROM t_clue_bands WHERE clue_id IN (SELECT id FROM {clues})")
+            cur.execute(f"DELETE FROM t_clue_signatures WHERE clue_id IN (SELECT id FROM {clues})")
+            day_range = (month, next_month(month))
+            cur.execute("DELETE FROM t_sender_days WHERE day >= %s AND day < %s", day_range)
+            cur.execute("DELETE FROM t_entity_days WHERE day >= %s AND day < %s", day_range)
+            # 保留 t_clue_days 行并递增版本，使查询缓存失效且版本和不回退
+            cur.execute("""
+                UPDATE t_clue_days SET clue_count = 0, dup_count = 0, dup_groups = 0, generation = generation + 1
+                WHERE day >= %s AND day < %s
+            """, day_range)
+
+            # 先分离关系分区并去掉其指向线索表的外键，线索分区才能分离
+            cur.execute(f"ALTER TABLE t_relations DETACH PARTITION {rels}")
+            cur.execute("""
+                SELECT conname FROM pg_constraint
+                WHERE conrelid = to_regclass(%s) AND contype = 'f' AND confrelid = to_regclass('t_clues')
+            """, (rels,))
+            for (name,) in cur.fetchall():
+                cur.execute(f'ALTER TABLE {rels} DROP CONSTRAINT "{name}"')
+            cur.execute(f"ALTER TABLE t_clues DETACH PARTITION {clues}")
+            if drop:
+                cur.execute(f"DROP TABLE {rels}, {clues}")
+            else:
+                cur.execute(f"ALTER TABLE {rels} RENAME TO t_relations_archive_{month:%Y%m}")
+                cur.execute(f"ALTER TABLE {clues} RENAME TO t_clues_archive_{month:%Y%m}")
+        conn.commit()
+        archived.append((month, n))
+    return archived
+
+
+def partition_sizes(conn):
+    # 返回 [(月份, 线索数估计, 关系数估计)]，取自 pg_class.reltuples，不扫描数据
+    with conn.cursor() as cur:
+        months = list_partitions(cur)
+        names = [partition_name(t, m) for m in months for t in PARTITIONED_TABLES]
+        cur.execute("SELECT relname, GREATEST(reltuples, 0)::bigint FROM pg_class WHERE relname = ANY(%s)", (names,))
+        sizes = dict(cur.fetchall())
+    conn.commit()
+    return [(m, sizes.get(partition_name('t_clues', m), 0), sizes.get(partition_name('t_relations', m), 0))
+            for m in months]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DeepTrace 分区维护")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help="列出分区")
+    p_ensure = sub.add_parser('ensure', help="预建月份分区")
+    p_ensure.add_argument('start', help="起始月份 YYYY-MM")
+    p_ensure.add_argument('end', help="截止月份 YYYY-MM (含)")
+    p_archive = sub.add_parser('archive', help="分离早于指定月份的分区")
+    p_archive.add_argument('before', help="YYYY-MM，该月份及之后的分区保留")
+    p_archive.add_argument('--drop', action='store_true', help="分离后直接删除，不保留归档表")
+    args = parser.parse_args(argv)
+
+    conn = get_db_conn()
+    if not conn:
+        print("数据库连接失败", file=sys.stderr)
+        return 1
+    try:
+        with conn.cursor() as cur:
+            partitioned = is_partitioned(cur)
+        conn.commit()
+        if not partitioned:
+            print("t_clues 尚未分区，请先执行 python migrations.py", file=sys.stderr)
+            return 1
+        if args.command == 'list':
+            for month, clues, rels in partition_sizes(conn):
+                print(f"{month:%Y-%m}  线索约 {clues} 条  关系约 {rels} 条")
+        elif args.command == 'ensure':
+            months = pd.period_range(args.start, args.end, freq='M')
+            n = ensure_partitions(conn, pd.Series(months.to_timestamp()))
+            print(f"新建月份分区 {n} 个")
+        else:
+            for month, n in archive_partitions(conn, args.before, drop=args.drop):
+                print(f"{month:%Y-%m}: 线索 {n} 条已{'删除' if args.drop else f'归档至 t_clues_archive_{month:%Y%m}'}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
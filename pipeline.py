@@ -0,0 +1,573 @@
+"""
+DeepTrace 分析任务队列
+
+t_clues 本身即队列：process_status = 0 的线索待分析 (3 为仅完成规则初筛，完整分析时再次领取)。worker 通过
+SELECT ... FOR UPDATE SKIP LOCKED 小批量领取线索并标记为处理中，
+每批独立提交，可在多台机器上同时运行多个实例。
+入库时判为近重复的线索 (canonical_id <> id) 复用规范线索的实体，不再运行模型。
+每条线索记录抽取器版本、规则版本与正文哈希；重新分析时与已有关系求差，只增删变化的关系并同步汇总计数，
+只有规则 / 关注名单变化的线索只重跑规则抽取。失败的线索 (-1) 按指数退避重试。强制重扫 (mark_stale) 按 id 分段标记需要重新分析的线索，进度记在检查点表中，中断后可续扫。
+"""
+import os
+import socket
+import time
+from collections import OrderedDict
+
+from db import get_db_conn
+from graph_index import COOCCURRENCE_REMOVE, COOCCURRENCE_UPSERT, COOCCURRENCE_VERSION_BUMP
+from instrument import count, span, traced
+from nlp import (DEFAULT_BATCH_SIZE, EXTRACTOR_VERSION, RULES_VERSION, TEXT_HASH_SQL, clue_keys, extract_entities,
+                 extract_units, fetch_clue_texts, make_pool)
+from rollups import ENTITY_DAYS_REMOVE, ENTITY_DAYS_UPSERT, bump_generations, partition_filter
+from rules import PATTERN_MATCHER, current_matcher
+
+# ==========================================
+# 1. 队列状态
+# ==========================================
+STATUS_PENDING = 0
+STATUS_DONE = 1
+STATUS_FAILED = -1
+STATUS_RUNNING = 2
+STATUS_TRIAGED = 3   # 仅规则抽取完成，完整分析时会再次领取
+# 除已完成外的全部状态，t_clues 上的部分索引 idx_clues_queue 只包含这些行 (见 partitions.py)
+UNFINISHED_STATUSES = (STATUS_FAILED, STATUS_PENDING, STATUS_RUNNING, STATUS_TRIAGED)
+
+QUEUE_STATUSES = (STATUS_PENDING, STATUS_TRIAGED)   # 完整分析领取的状态
+RULES_QUEUE_STATUSES = (STATUS_PENDING,)           # 仅规则模式领取的状态
+# 不重新运行模型的线索 (正文未变、或只重跑了规则) 按已记录的抽取器版本恢复状态：
+# 完整分析过的恢复为已完成，仅规则初筛过的恢复为初筛
+RESTORED_STATUS_SQL = f"CASE WHEN extractor_version = %s THEN {STATUS_DONE} ELSE {STATUS_TRIAGED} END"
+
+DEFAULT_CLAIM_SIZE = 64        # 每次领取的线索数
+DEFAULT_LEASE_SECONDS = 900    # 处理中超过该时长视为 worker 已退出，重新入队
+WORKER_ALIVE_SECONDS = 120     # 心跳在该时长内的 worker 视为在线
+ENTITY_CACHE_SIZE = 50000      # (name, type) -> t_entities.id 缓存上限
+ENTITY_NAME_MAX = 200          # 与 t_entities.name VARCHAR(200) 一致
+RETRY_LIMIT = 5                # 失败线索的自动重试次数，用尽后需强制重扫
+RETRY_BASE_SECONDS = 60        # 第 n 次重试前等待 RETRY_BASE_SECONDS * 2^(n-1) 秒
+RESCAN_BATCH = 5000            # 强制重扫每个事务检查的 id 区间大小
+RESCAN_CHECKPOINT = 'rescan'   # t_pipeline_checkpoints 中重扫进度的名称
+RESCAN_LOCK = 20240609         # pg_advisory_xact_lock 键，多个 worker 同时重扫时逐段推进
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+@traced("pipeline.claim")
+def claim_clues(conn, limit, worker_id, statuses=(STATUS_PENDING,), retry_limit=0):
+    # retry_limit > 0 时一并领取退避时间已到、重试次数未用尽的失败线索
+    # 返回按 id 排序的 {线索 id: send_time}，之后按 id 读写时附带分区键
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE t_clues SET process_status = %s, claimed_at = now(), claimed_by = %s
+            WHERE (id, send_time) IN (
+                SELECT id, send_time FROM t_clues
+                WHERE process_status = ANY(%s)
+                   OR (process_status = %s AND retry_count < %s AND next_retry_at <= now())
+                ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, send_time
+        """, (STATUS_RUNNING, worker_id, list(statuses), STATUS_FAILED, retry_limit, limit))
+        clues = dict(sorted(cur.fetchall()))
+    conn.commit()
+    return clues
+
+
+def requeue_stale(conn, lease_seconds=DEFAULT_LEASE_SECONDS):
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE t_clues SET process_status = %s, claimed_at = NULL, claimed_by = NULL
+            WHERE process_status = %s AND claimed_at < now() - make_interval(secs => %s)
+        """, (STATUS_PENDING, STATUS_RUNNING, lease_seconds))
+        n = cur.rowcount
+    conn.commit()
+    return n
+
+
+def has_work(conn, rules_only=False, lease_seconds=DEFAULT_LEASE_SECONDS):
+    # 是否有可领取的线索 (含超时待重新入队的、到期重试的)，常驻 worker 据此决定是否加载模型
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT EXISTS (SELECT 1 FROM t_clues WHERE process_status = ANY(%s))
+                OR EXISTS (SELECT 1 FROM t_clues WHERE process_status = %s
+                           AND claimed_at < now() - make_interval(secs => %s))
+                OR EXISTS (SELECT 1 FROM t_clues WHERE process_status = %s
+                           AND retry_count < %s AND next_retry_at <= now())
+        """, (list(RULES_QUEUE_STATUSES if rules_only else QUEUE_STATUSES), STATUS_RUNNING, lease_seconds,
+              STATUS_FAILED, 0 if rules_only else RETRY_LIMIT))
+        found = cur.fetchone()[0]
+    conn.commit()
+    return found
+
+
+def status_counts(conn):
+    # 未完成的状态只扫描部分索引；已完成数 = 汇总表中的线索总数 - 未完成数，不扫描全表
+    counts = {STATUS_PENDING: 0, STATUS_DONE: 0, STATUS_FAILED: 0, STATUS_RUNNING: 0, STATUS_TRIAGED: 0}
+    with conn.cursor() as cur:
+        cur.execute("SELECT process_status, COUNT(*) FROM t_clues WHERE process_status IN %s GROUP BY process_status",
+                    (UNFINISHED_STATUSES,))
+        for status, n in cur.fetchall():
+            counts[status] = n
+        cur.execute("SELECT COALESCE(SUM(clue_count), 0) FROM t_clue_days")
+        counts[STATUS_DONE] = max(int(cur.fetchone()[0]) - sum(counts.values()), 0)
+    return counts
+
+
+def active_workers(conn, alive_seconds=WORKER_ALIVE_SECONDS):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT worker_id, started_at, heartbeat_at, processed, failed, docs_per_sec
+            FROM t_pipeline_workers
+            WHERE heartbeat_at > now() - make_interval(secs => %s)
+            ORDER BY worker_id
+        """, (alive_seconds,))
+        cols = [d[0] for d in cur.description]
+        return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+
+def _heartbeat(cur, worker_id, stats):
+    cur.execute("""
+        INSERT INTO t_pipeline_workers (worker_id, processed, failed, docs_per_sec)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = now(), processed = EXCLUDED.processed,
+            failed = EXCLUDED.failed, docs_per_sec = EXCLUDED.docs_per_sec
+    """, (worker_id, stats['processed'], stats['failed'], stats['docs_per_sec']))
+
+
+# ==========================================
+# 2. 结果写库
+# ==========================================
+class EntityIdCache:
+    # 有界 LRU：热门人名、手机号反复出现，命中后无需再访问 t_entities
+    def __init__(self, maxsize=ENTITY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        eid = self._data.get(key)
+        if eid is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return eid
+
+    def update(self, mapping):
+        # 仅在事务提交后调用，避免缓存回滚掉的 id
+        for key, eid in mapping.items():
+            self._data[key] = eid
+            self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+_entity_cache = EntityIdCache()
+
+
+def resolve_entity_ids(cur, keys, cache):
+    ids, misses = {}, []
+    for key in keys:
+        eid = cache.get(key)
+        if eid is None:
+            misses.append(key)
+        else:
+            ids[key] = eid
+    if not misses:
+        return ids
+
+    # 一条语句完成未命中实体的 upsert：新行由 INSERT ... RETURNING 返回，已有行由 JOIN 取回；
+    # DO NOTHING 不更新已有行，热门实体不再产生死元组。
+    # 按 (name, type) 排序后插入：集合的遍历顺序随进程的字符串哈希种子变化，并发 worker 以不同顺序
+    # 插入重叠的实体会在唯一索引上互相等待而死锁
+    misses.sort()
+    names = [k[0] for k in misses]
+    types = [k[1] for k in misses]
+    cur.execute("""
+        WITH input AS (
+            SELECT * FROM unnest(%s::varchar[], %s::varchar[]) WITH ORDINALITY AS t(name, type, ord)
+        ), ins AS (
+            INSERT INTO t_entities (name, type) SELECT name, type FROM input ORDER BY ord
+            ON CONFLICT (name, type) DO NOTHING
+            RETURNING id, name, type
+        )
+        SELECT id, name, type FROM ins
+        UNION ALL
+        SELECT e.id, e.name, e.type FROM t_entities e JOIN input i ON e.name = i.name AND e.type = i.type
+    """, (names, types))
+    for eid, name, etype in cur.fetchall():
+        ids[(name, etype)] = eid
+
+    # 与其他 worker 并发插入同名实体时，上一语句的快照看不到对方刚提交的行，补查一次
+    missing = [k for k in misses if k not in ids]
+    if missing:
+        cur.execute("""
+            SELECT e.id, e.name, e.type FROM t_entities e
+            JOIN unnest(%s::varchar[], %s::varchar[]) AS t(name, type) ON e.name = t.name AND e.type = t.type
+        """, ([k[0] for k in missing], [k[1] for k in missing]))
+        for eid, name, etype in cur.fetchall():
+            ids[(name, etype)] = eid
+    return ids
+
+
+def _write_clues(cur, clues, extracted, cache, status=STATUS_DONE, version=EXTRACTOR_VERSION,
+                 rules_version=PATTERN_MATCHER.version, merge=False):
+    # clues: {线索 id: send_time}，覆盖 extracted 中的全部线索
+    # merge: 只重跑了规则抽取，结果并入已有关系 (模型抽取的实体不在 extracted 中，不能求差删除)
+    # 返回 (解析出的实体 id, 共现计数是否变化)
+    keys = {(name, etype) for entities in extracted.values() for name, etype in entities
+            if len(name) <= ENTITY_NAME_MAX}
+    ids = resolve_entity_ids(cur, keys, cache)
+    written = {cid: clues[cid] for cid in extracted}
+    rel_clues, rel_ents, rel_times = [], [], []
+    for cid, entities in extracted.items():
+        for key in entities:
+            if key in ids:
+                rel_clues.append(cid)
+                rel_ents.append(ids[key])
+                rel_times.append(clues[cid])
+    # 与已有关系求差：先删除本次未再抽取到的关系并扣减汇总，再插入新增的关系；未变化的关系不动。
+    # 语句的影响行数即写入 t_cooccurrence 的实体对数
+    changed = False
+    if not merge:
+        cur.execute("""
+            WITH keep AS (
+                SELECT * FROM unnest(%s::int[], %s::int[]) AS k(clue_id, entity_id)
+            ), old_rel AS (
+                DELETE FROM t_relations r
+                WHERE r.clue_id = ANY(%s) AND r.send_time = ANY(%s)
+                  AND NOT EXISTS (SELECT 1 FROM keep k WHERE k.clue_id = r.clue_id AND k.entity_id = r.entity_id)
+                RETURNING r.clue_id, r.entity_id, r.send_time
+            )
+        """ + ENTITY_DAYS_REMOVE + COOCCURRENCE_REMOVE, (rel_clues, rel_ents, *clue_keys(written)))
+        changed = cur.rowcount > 0
+    if rel_clues:
+        # 写关系的同时，按实际新增的关系增量累加实体共现计数与 (实体, 机构, 日期) 汇总
+        cur.execute("""
+            WITH new_rel AS (
+                INSERT INTO t_relations (clue_id, entity_id, send_time)
+                SELECT * FROM unnest(%s::int[], %s::int[], %s::timestamp[])
+                ON CONFLICT DO NOTHING
+                RETURNING clue_id, entity_id, send_time
+            )
+        """ + ENTITY_DAYS_UPSERT + COOCCURRENCE_UPSERT, (rel_clues, rel_ents, rel_times))
+        changed = changed or cur.rowcount > 0
+    if merge:
+        _mark_rules_refreshed(cur, written, rules_version)
+    else:
+        _mark_extracted(cur, written, status, version, rules_version)
+    return ids, changed
+
+
+def _mark_extracted(cur, clues, status, version, rules_version):
+    cur.execute(f"""
+        UPDATE t_clues SET process_status = %s, claimed_at = NULL, extractor_version = %s, rules_version = %s,
+            extracted_hash = {TEXT_HASH_SQL}, extracted_at = now(), retry_count = 0, next_retry_at = NULL
+        WHERE id = ANY(%s) AND send_time = ANY(%s)
+    """, (status, version, rules_version, *clue_keys(clues)))
+
+
+def _mark_rules_refreshed(cur, clues, rules_version):
+    # 抽取器版本与正文哈希不变，只更新规则版本
+    cur.execute(f"""
+        UPDATE t_clues SET process_status = {RESTORED_STATUS_SQL}, claimed_at = NULL, rules_version = %s,
+            retry_count = 0, next_retry_at = NULL
+        WHERE id = ANY(%s) AND send_time = ANY(%s)
+    """, (EXTRACTOR_VERSION, rules_version, *clue_keys(clues)))
+
+
+def _mark_failed(cur, clues):
+    # 失败线索保留原有关系，退避后由 claim_clues 重新领取
+    cur.execute("""
+        UPDATE t_clues SET process_status = %s, claimed_at = NULL, retry_count = retry_count + 1,
+            next_retry_at = now() + make_interval(secs => %s * power(2, retry_count))
+        WHERE id = ANY(%s) AND send_time = ANY(%s)
+    """, (STATUS_FAILED, RETRY_BASE_SECONDS, *clue_keys(clues)))
+
+
+@traced("pipeline.upsert")
+def write_results(cur, clues, extracted, failed, cache=None, status=STATUS_DONE, version=EXTRACTOR_VERSION,
+                  rules_version=PATTERN_MATCHER.version, merge=False):
+    # clues: 本批 {线索 id: send_time}；整批一次写入，整批失败时逐条重试，隔离出真正出错的线索
+    # 返回 (失败线索, 本批解析出的实体 id)，后者应在提交后写入缓存；merge 见 _write_clues
+    cache = cache or _entity_cache
+    args = (status, version, rules_version, merge)
+    failed = list(failed)
+    resolved, changed = {}, False
+    if extracted:
+        cur.execute("SAVEPOINT batch_write")
+        try:
+            resolved, changed = _write_clues(cur, clues, extracted, cache, *args)
+        except Exception:
+            cur.execute("ROLLBACK TO SAVEPOINT batch_write")
+            for cid, entities in extracted.items():
+                cur.execute("SAVEPOINT clue_write")
+                try:
+                    ids, clue_changed = _write_clues(cur, clues, {cid: entities}, cache, *args)
+                    resolved.update(ids)
+                    changed = changed or clue_changed
+                except Exception:
+                    cur.execute("ROLLBACK TO SAVEPOINT clue_write")
+                    failed.append(cid)
+    if failed:
+        _mark_failed(cur, {cid: clues[cid] for cid in failed})
+    # 只让涉及机构 / 日期的查询缓存失效
+    done = set(extracted) - set(failed)
+    bump_generations(cur, done, {clues[cid] for cid in done})
+    # 共现计数有变化时才递增共现版本，应用进程内的共现索引不随其他数据变化重新加载
+    if changed:
+        cur.execute(COOCCURRENCE_VERSION_BUMP)
+    return failed, resolved
+
+
+# ==========================================
+# 3. 重复线索复用
+# ==========================================
+@traced("pipeline.dedup")
+def split_duplicates(cur, clues, version=EXTRACTOR_VERSION):
+    # 规范线索已用当前抽取器分析完成或在本轮一并领取时，重复线索复用其实体；
+    # 返回 {重复线索: (规范线索, 规范线索 send_time)}，之后按规范线索读取时附带其分区键
+    cur.execute("""
+        SELECT id, canonical_id, canonical_time FROM t_clues
+        WHERE id = ANY(%s) AND send_time = ANY(%s) AND canonical_id <> id
+    """, clue_keys(clues))
+    candidates = {cid: (canon, canon_time) for cid, canon, canon_time in cur.fetchall()}
+    if not candidates:
+        return {}
+    time_filter, time_params = partition_filter("send_time", {t for _, t in candidates.values()})
+    cur.execute(f"""
+        SELECT id FROM t_clues WHERE id = ANY(%s) AND {time_filter} AND process_status = %s AND extractor_version = %s
+    """, [list({canon for canon, _ in candidates.values()})] + time_params + [STATUS_DONE, version])
+    ready = {r[0] for r in cur.fetchall()} | set(clues)
+    return {cid: key for cid, key in candidates.items() if key[0] in ready}
+
+
+@traced("pipeline.reuse")
+def reuse_entities(cur, dups, clues, matcher=PATTERN_MATCHER):
+    # 从规范线索已写入的关系复制实体，返回 (extracted, failed)；规范线索未成功完成的副本记为失败
+    # dups: split_duplicates 的结果，clues: 副本的 {线索 id: send_time}
+    # 近重复只按正文判定，副本的标题、发件人可能不同：规范线索的实体只保留在副本自身文本中出现的，
+    # 再并入对副本文本的规则抽取结果 (发件人邮箱、标题中的号码等)；副本标题中的人名 / 机构不补跑模型
+    canon_times = {t for _, t in dups.values()}
+    clue_filter, clue_params = partition_filter("k.send_time", canon_times)
+    rel_filter, rel_params = partition_filter("r.send_time", canon_times)
+    cur.execute(f"""
+        SELECT k.id, e.name, e.type FROM t_clues k
+        LEFT JOIN t_relations r ON r.clue_id = k.id AND r.send_time = k.send_time AND {rel_filter}
+        LEFT JOIN t_entities e ON e.id = r.entity_id
+        WHERE k.id = ANY(%s) AND {clue_filter} AND k.process_status = %s
+    """, rel_params + [list({canon for canon, _ in dups.values()})] + clue_params + [STATUS_DONE])
+    entities = {}
+    for canon, name, etype in cur.fetchall():
+        found = entities.setdefault(canon, set())
+        if name is not None:
+            found.add((name, etype))
+    texts = dict(fetch_clue_texts(cur, {cid: clues[cid] for cid, (canon, _) in dups.items() if canon in entities}))
+    extracted = {}
+    for cid, (canon, _) in dups.items():
+        if canon in entities and cid in texts:
+            lowered = texts[cid].lower()
+            found = {(name, etype) for name, etype in entities[canon] if name.lower() in lowered}
+            extracted[cid] = found | matcher.extract(texts[cid])
+    return extracted, [cid for cid in dups if cid not in extracted]
+
+
+@traced("pipeline.unchanged")
+def finish_unchanged(cur, clues, versions, rules_version):
+    # 抽取器版本属于 versions 且正文未变的线索 (如被手工重新入队、关注名单更新后重扫) 不再运行模型：
+    # 规则版本也相同的直接恢复状态；只有规则版本不同的交给调用方重跑规则抽取。
+    # 返回 (已恢复的线索, {需重跑规则的线索: send_time})
+    cur.execute(f"""
+        SELECT id, send_time, rules_version IS NOT DISTINCT FROM %s FROM t_clues
+        WHERE id = ANY(%s) AND send_time = ANY(%s) AND extractor_version = ANY(%s)
+          AND extracted_hash = {TEXT_HASH_SQL}
+    """, (rules_version, *clue_keys(clues), list(versions)))
+    rows = cur.fetchall()
+    finished = {cid: t for cid, t, current in rows if current}
+    if finished:
+        cur.execute(f"""
+            UPDATE t_clues SET process_status = {RESTORED_STATUS_SQL}, claimed_at = NULL, retry_count = 0,
+                next_retry_at = NULL
+            WHERE id = ANY(%s) AND send_time = ANY(%s)
+        """, (EXTRACTOR_VERSION, *clue_keys(finished)))
+    return set(finished), {cid: t for cid, t, current in rows if not current}
+
+
+def stage_claimed(cur, claimed, matcher, rules_only=False):
+    # 领取的线索先分流，不必运行模型的不送入模型：版本与正文均未变的直接恢复状态；只有规则版本变化的只重跑规则；
+    # 近重复线索待本轮规范线索写入后复制其实体 (仅规则模式不做复用，规则抽取足够快)。
+    # 返回 (已恢复的线索, {需重跑规则的线索: send_time}, split_duplicates 的结果)
+    versions = (RULES_VERSION, EXTRACTOR_VERSION) if rules_only else (EXTRACTOR_VERSION,)
+    unchanged, refresh = finish_unchanged(cur, claimed, versions, matcher.version)
+    dups = {}
+    if not rules_only:
+        rest = {cid: t for cid, t in claimed.items() if cid not in unchanged and cid not in refresh}
+        dups = split_duplicates(cur, rest, version=EXTRACTOR_VERSION)
+    return unchanged, refresh, dups
+
+
+# ==========================================
+# 4. 强制重扫
+# ==========================================
+def rescan_pending(conn):
+    # 是否有未完成的重扫 (上次中断)，worker 启动时据此续扫
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM t_pipeline_checkpoints WHERE name = %s", (RESCAN_CHECKPOINT,))
+        found = cur.fetchone() is not None
+    conn.commit()
+    return found
+
+
+def mark_stale(conn, version=EXTRACTOR_VERSION, rules_version=None, batch_size=RESCAN_BATCH, on_progress=None):
+    # 把抽取器版本、规则版本不同或正文自上次抽取后变化的已分析线索重新入队，旧关系保留到重新分析时求差更新
+    # (只有规则版本不同的线索领取后只重跑规则抽取)；用尽重试次数的失败线索重新计数。
+    # 每段 id 区间与检查点在同一事务中提交，中断后从检查点继续；目标版本变化时从头开始，
+    # rules_version 缺省为当前关注名单对应的版本。返回本次调用标记的线索数
+    marked = 0
+    with conn.cursor() as cur:
+        rules_version = rules_version or current_matcher(cur).version
+        cur.execute("""
+            UPDATE t_clues SET retry_count = 0, next_retry_at = now()
+            WHERE process_status = %s AND retry_count >= %s
+        """, (STATUS_FAILED, RETRY_LIMIT))
+    conn.commit()
+    target = f"{version}|{rules_version}"
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (RESCAN_LOCK,))
+            cur.execute("SELECT target, position, marked FROM t_pipeline_checkpoints WHERE name = %s",
+                        (RESCAN_CHECKPOINT,))
+            row = cur.fetchone()
+            position, total = (row[1], row[2]) if row and row[0] == target else (0, 0)
+            cur.execute("SELECT MAX(id) FROM (SELECT id FROM t_clues WHERE id > %s ORDER BY id LIMIT %s) s",
+                        (position, batch_size))
+            upper = cur.fetchone()[0]
+            if upper is None:
+                cur.execute("DELETE FROM t_pipeline_checkpoints WHERE name = %s", (RESCAN_CHECKPOINT,))
+                conn.commit()
+                break
+            cur.execute(f"""
+                UPDATE t_clues SET process_status = %s, claimed_at = NULL
+                WHERE id > %s AND id <= %s AND process_status = %s
+                  AND (extractor_version IS DISTINCT FROM %s OR rules_version IS DISTINCT FROM %s
+                       OR extracted_hash IS DISTINCT FROM {TEXT_HASH_SQL})
+            """, (STATUS_PENDING, position, upper, STATUS_DONE, version, rules_version))
+            marked += cur.rowcount
+            total += cur.rowcount
+            cur.execute("""
+                INSERT INTO t_pipeline_checkpoints (name, target, position, marked) VALUES (%s, %s, %s, %s)
+                ON CONFLICT (name) DO UPDATE SET target = EXCLUDED.target, position = EXCLUDED.position,
+                    marked = EXCLUDED.marked, updated_at = now()
+            """, (RESCAN_CHECKPOINT, target, upper, total))
+        conn.commit()
+        if on_progress:
+            on_progress(upper, total)
+    return marked
+
+
+# ==========================================
+# 5. 分析循环
+# ==========================================
+def _claim_units(conn, workers, claim_size, worker_id, statuses, retry_limit):
+    units = []
+    for _ in range(workers):
+        clues = claim_clues(conn, claim_size, worker_id, statuses, retry_limit)
+        if not clues:
+            break
+        units.append(clues)
+    return units
+
+
+def run_analysis_pipeline(tok=None, ner=None, batch_size=DEFAULT_BATCH_SIZE, workers=1, threads=1,
+                          claim_size=DEFAULT_CLAIM_SIZE, worker_id=None, conn=None, pool=None, on_progress=None,
+                          rules_only=False):
+    # 持续领取直到队列为空；workers > 1 时抽取交给进程池，写库始终由当前进程完成
+    # 常驻 worker 可传入自建的 pool，跨多轮复用已加载模型的子进程
+    # rules_only: 只运行规则抽取 (不需要模型)，线索标记为 STATUS_TRIAGED，之后的完整分析会再次领取
+    stats = {'processed': 0, 'failed': 0, 'reused': 0, 'unchanged': 0, 'refreshed': 0, 'seconds': 0.0,
+             'docs_per_sec': 0.0}
+    if not rules_only and pool is None and workers <= 1 and (not tok or not ner):
+        return stats
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_conn()
+    if not conn:
+        return stats
+
+    worker_id = worker_id or default_worker_id()
+    if rules_only:
+        tok = ner = pool = None
+        workers = 1
+    own_pool = pool is None and workers > 1
+    statuses = RULES_QUEUE_STATUSES if rules_only else QUEUE_STATUSES
+    done_status = STATUS_TRIAGED if rules_only else STATUS_DONE
+    version = RULES_VERSION if rules_only else EXTRACTOR_VERSION
+    retry_limit = 0 if rules_only else RETRY_LIMIT   # 失败线索的重试需要模型，仅规则模式不领取
+    if own_pool:
+        pool = make_pool(workers, threads)
+    started = time.perf_counter()
+
+    def commit(ids, extracted, failed, merge=False):
+        # ids: {线索 id: send_time}
+        with conn.cursor() as cur:
+            failed, resolved = write_results(cur, ids, extracted, failed, status=done_status, version=version,
+                                             rules_version=matcher.version, merge=merge)
+            stats['processed'] += len(ids)
+            stats['failed'] += len(failed)
+            stats['seconds'] = time.perf_counter() - started
+            stats['docs_per_sec'] = stats['processed'] / stats['seconds'] if stats['seconds'] else 0.0
+            _heartbeat(cur, worker_id, stats)
+        with span("pipeline.commit"):
+            conn.commit()
+        count("pipeline.processed", len(ids))
+        count("pipeline.failed", len(failed))
+        _entity_cache.update(resolved)
+        if on_progress:
+            on_progress(stats)
+
+    try:
+        requeue_stale(conn)
+        while True:
+            units = _claim_units(conn, workers if pool else 1, claim_size, worker_id, statuses, retry_limit)
+            if not units:
+                break
+            with conn.cursor() as cur:
+                # 每轮按当前关注名单确定规则版本，名单在运行中更新后新领取的线索记录新版本
+                matcher = current_matcher(cur)
+                claimed = {cid: t for ids in units for cid, t in ids.items()}
+                unchanged, refresh, dups = stage_claimed(cur, claimed, matcher, rules_only)
+            conn.commit()
+            stats['processed'] += len(unchanged)
+            stats['unchanged'] += len(unchanged)
+            staged = unchanged | set(refresh) | set(dups)
+            units = [ids for ids in ({cid: t for cid, t in ids.items() if cid not in staged} for ids in units) if ids]
+
+            results = []
+            if pool and units:
+                results = extract_units(pool, units, batch_size)
+            elif units:
+                with conn.cursor() as cur:
+                    items = fetch_clue_texts(cur, units[0])
+                results = [(units[0], *extract_entities(tok, ner, items, batch_size, matcher))]
+            for ids, extracted, failed in results:
+                commit(ids, extracted, failed)
+
+            if refresh:
+                with conn.cursor() as cur:
+                    extracted = {cid: matcher.extract(text) for cid, text in fetch_clue_texts(cur, refresh)}
+                stats['refreshed'] += len(extracted)
+                commit(refresh, extracted, [cid for cid in refresh if cid not in extracted], merge=True)
+
+            if dups:
+                with conn.cursor() as cur:
+                    extracted, failed = reuse_entities(cur, dups, claimed, matcher)
+                stats['reused'] += len(extracted)
+                commit({cid: claimed[cid] for cid in dups}, extracted, failed)
+    finally:
+        if own_pool:
+            pool.terminate()
+        if own_conn:
+            conn.close()
+    return stats
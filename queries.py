@@ -0,0 +1,91 @@
+"""
+DeepTrace 检索查询
+
+线索列表的键集分页查询，不依赖 Streamlit：页面在外层加缓存，基准测试与脚本可直接调用。
+"""
+import pandas as pd
+
+from instrument import read_sql
+from search import keyword_hits_sql, send_time_range
+
+PAGE_SIZE = 300  # 每页线索数
+
+
+def clue_filters(org, date_from, date_to, alias="c."):
+    # 机构 / 日期筛选条件；日期条件作用于分区键，可裁剪到相关月份的分区
+    conditions, params = ["1=1"], []
+    if org != "全部机构":
+        conditions.append(f"{alias}org = %s")
+        params.append(org)
+    time_conditions, time_params = send_time_range(f"{alias}send_time", date_from, date_to)
+    return conditions + time_conditions, params + time_params
+
+
+def page_query(keyword, org, date_from, date_to, ranked=False, cursor=None, page_size=PAGE_SIZE):
+    # 返回 (列表 SQL, 参数)；cursor 为上一页最后一行的排序键 (见 page_cursor)，多取一行判断是否还有下一页
+    conditions, params = clue_filters(org, date_from, date_to)
+    ctes, cte_params = [], []
+    join_hits, score_col = "", "NULL AS score"
+    order_cols = ["c.send_time", "c.id"]
+
+    # 关键词：标题 / 正文 / 实体名三路各自走 trigram 索引，归并后再与线索表连接
+    if keyword:
+        hits_sql, hits_params = keyword_hits_sql(keyword, date_from, date_to)
+        ctes.append(hits_sql)
+        cte_params.extend(hits_params)
+        join_hits, score_col = "JOIN kw_hits h ON h.clue_id = c.id", "h.score"
+        if ranked:
+            order_cols = ["h.score"] + order_cols
+
+    if cursor:
+        marks = ["%s::timestamp" if col == "c.send_time" else "%s" for col in order_cols]
+        conditions.append(f"({', '.join(order_cols)}) < ({', '.join(marks)})")
+        params.extend(cursor)
+    order_by = ", ".join(f"{col} DESC" for col in order_cols)
+
+    where_clause = " AND ".join(conditions)
+    with_clause = "WITH " + ", ".join(ctes) if ctes else ""
+    sql = f"""
+        {with_clause}
+        SELECT c.id, c.subject, c.send_time, c.org, c.source_email, {score_col}, c.dup_count
+        FROM t_clues c
+        {join_hits}
+        WHERE {where_clause}
+        ORDER BY {order_by} LIMIT %s
+    """
+    return sql, cte_params + params + [page_size + 1]
+
+
+def page_cursor(last, ranked=False):
+    # 本页最后一行 -> 下一页的 cursor，与 page_query 的排序列一一对应 (按相关度排序时以命中分数为首列)
+    keys = [last['send_time'].isoformat(), int(last['id'])]
+    if ranked:
+        keys.insert(0, int(last['score']))
+    return tuple(keys)
+
+
+def fetch_page(conn, keyword, org, date_from, date_to, ranked=False, cursor=None, page_size=PAGE_SIZE):
+    # 返回 {'clues', 'relations', 'next_cursor'}；cursor 为上一页最后一行的排序键
+    ranked = bool(keyword) and ranked
+    sql, params = page_query(keyword, org, date_from, date_to, ranked, cursor, page_size)
+    clues = read_sql("fetch_page.clues", sql, conn, params=params)
+    data = {'next_cursor': None}
+    if len(clues) > page_size:
+        clues = clues.head(page_size)
+        data['next_cursor'] = page_cursor(clues.iloc[-1], ranked)
+    data['clues'] = clues
+
+    # 实体分布等统计见 rollups.fetch_dashboard，这里只取当前页图谱所需的关系；
+    # 附带本页的时间范围，关系表只扫描这几个月份的分区
+    if not clues.empty:
+        sql_rel = """
+            SELECT r.clue_id, e.id as eid, e.name, e.type
+            FROM t_relations r JOIN t_entities e ON r.entity_id = e.id
+            WHERE r.clue_id = ANY(%s) AND r.send_time BETWEEN %s AND %s
+        """
+        params_rel = (clues['id'].tolist(), clues['send_time'].min().to_pydatetime(),
+                      clues['send_time'].max().to_pydatetime())
+        data['relations'] = read_sql("fetch_page.relations", sql_rel, conn, params=params_rel)
+    else:
+        data['relations'] = pd.DataFrame()
+    return data
@@ -0,0 +1,223 @@
+"""
+DeepTrace 统计汇总表
+
+入库与分析时增量维护的汇总表，看板 / 时序图直接读取，统计口径覆盖全部筛选结果而非当前页样本：
+  t_clue_days   (org, day)               每日线索数        —— 入库维护
+  t_sender_days (source_email, org, day) 每日发件人线索数  —— 入库维护
+  t_entity_days (entity_id, org, day)    每日实体关联线索数 —— 分析管道维护
+
+t_clue_days 另记每日重复线索数 (dup_count) 与含重复副本的规范线索数 (dup_groups)，由去重索引维护。
+t_clue_days.generation 同时作为 (机构, 日期) 的数据版本：入库、分析写入、去重归组时递增。
+查询缓存以筛选范围内的版本和为键，只有受影响机构 / 日期的缓存失效，多个进程看到同一版本。
+"""
+from collections import Counter
+
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from instrument import read_sql
+from queries import clue_filters
+from search import keyword_hits_sql
+
+# ==========================================
+# 1. 增量维护
+# ==========================================
+def update_ingest_rollups(cur, chunk):
+    # 与线索同一事务累加，chunk 为 normalize_frame 之后的分块
+    keys = pd.DataFrame({
+        'org': chunk['org'].astype('string').fillna(''),
+        'day': chunk['send_time'].dt.date,
+        'email': chunk['source_email'].astype('string').fillna(''),
+    })
+    # groupby 结果有序，并发入库时按相同顺序加行锁，避免死锁
+    days = keys.groupby(['org', 'day']).size()
+    execute_values(cur, """
+        INSERT INTO t_clue_days (org, day, clue_count, generation) VALUES %s
+        ON CONFLICT (org, day) DO UPDATE
+        SET clue_count = t_clue_days.clue_count + EXCLUDED.clue_count, generation = t_clue_days.generation + 1
+    """, [(org, day, int(n), 1) for (org, day), n in days.items()])
+    senders = keys[keys['email'] != ''].groupby(['email', 'org', 'day']).size()
+    if len(senders):
+        execute_values(cur, """
+            INSERT INTO t_sender_days (source_email, org, day, clue_count) VALUES %s
+            ON CONFLICT (source_email, org, day) DO UPDATE SET clue_count = t_sender_days.clue_count + EXCLUDED.clue_count
+        """, [(email, org, day, int(n)) for (email, org, day), n in senders.items()])
+
+
+# 接在 "WITH new_rel AS (INSERT INTO t_relations ... RETURNING clue_id, entity_id, send_time)" 之后使用
+ENTITY_DAYS_UPSERT = """
+    , entity_days AS (
+        INSERT INTO t_entity_days (entity_id, org, day, clue_count)
+        SELECT n.entity_id, COALESCE(c.org, ''), c.send_time::date, COUNT(*)
+        FROM new_rel n JOIN t_clues c ON c.id = n.clue_id AND c.send_time = n.send_time
+        GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+        ON CONFLICT (entity_id, org, day) DO UPDATE SET clue_count = t_entity_days.clue_count + EXCLUDED.clue_count
+    )
+"""
+
+# 重新分析时被移除的关系 (old_rel CTE) 按负数计入，与新增时相同的排序取行锁，避免并发 worker 互相死锁
+ENTITY_DAYS_REMOVE = """
+    , entity_days_removed AS (
+        INSERT INTO t_entity_days (entity_id, org, day, clue_count)
+        SELECT o.entity_id, COALESCE(c.org, ''), c.send_time::date, -COUNT(*)
+        FROM old_rel o JOIN t_clues c ON c.id = o.clue_id AND c.send_time = o.send_time
+        GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+        ON CONFLICT (entity_id, org, day) DO UPDATE SET clue_count = t_entity_days.clue_count + EXCLUDED.clue_count
+    )
+"""
+
+
+def partition_filter(column, send_times):
+    # 按分区键 send_time 筛选的条件与参数，只访问相关月份的分区；
+    # 转换为分区表之前的旧数据可能没有 send_time，含 NULL 时不筛选
+    times = set(send_times)
+    if not times or None in times:
+        return "TRUE", []
+    return f"{column} = ANY(%s)", [sorted(times)]
+
+
+def update_duplicate_rollups(cur, duplicates, dup_days, canon_times):
+    # duplicates: {重复线索 id: 规范线索 id}，dup_days: 各重复线索的 (机构, 日期)，canon_times: 规范线索的 send_time
+    # 累加规范线索的副本数 (t_clues.dup_count)；规范线索首次出现副本时计入其所在日期的 dup_groups
+    if not duplicates:
+        return
+    per_canon = Counter(duplicates.values())
+    canon_ids = sorted(per_canon)
+    time_filter, time_params = partition_filter("k.send_time", canon_times)
+    cur.execute(f"""
+        UPDATE t_clues k SET dup_count = k.dup_count + d.n
+        FROM unnest(%s::int[], %s::int[]) AS d(id, n)
+        WHERE k.id = d.id AND {time_filter}
+        RETURNING COALESCE(k.org, ''), k.send_time::date, k.dup_count = d.n
+    """, [canon_ids, [per_canon[c] for c in canon_ids]] + time_params)
+    groups = Counter((org, day) for org, day, first in cur.fetchall() if first)
+    dups = Counter(dup_days)
+    execute_values(cur, """
+        INSERT INTO t_clue_days (org, day, dup_count, dup_groups) VALUES %s
+        ON CONFLICT (org, day) DO UPDATE SET dup_count = t_clue_days.dup_count + EXCLUDED.dup_count,
+            dup_groups = t_clue_days.dup_groups + EXCLUDED.dup_groups
+    """, [(org, day, dups[(org, day)], groups[(org, day)]) for org, day in sorted(set(dups) | set(groups))])
+
+
+def bump_generations(cur, clue_ids, send_times=None):
+    # 线索关联数据 (实体、状态、重复归组) 变化后，递增其 (机构, 日期) 版本；应放在事务末尾以缩短行锁时间
+    # 调用方已知这些线索的 send_time 时一并传入，只访问相关月份的分区
+    if not clue_ids:
+        return
+    time_filter, params = partition_filter("send_time", send_times or ())
+    cur.execute(f"""
+        INSERT INTO t_clue_days (org, day, clue_count, generation)
+        SELECT DISTINCT COALESCE(org, ''), send_time::date, 0, 1 FROM t_clues
+        WHERE id = ANY(%s) AND send_time IS NOT NULL AND {time_filter}
+        ORDER BY 1, 2
+        ON CONFLICT (org, day) DO UPDATE SET generation = t_clue_days.generation + 1
+    """, [list(clue_ids)] + params)
+
+
+# 从已有数据回填 (迁移 003)；表中已有数据时 NOT EXISTS 作为一次性过滤条件，不会扫描明细表
+ROLLUP_BACKFILLS = [
+    """
+    INSERT INTO t_sender_days (source_email, org, day, clue_count)
+    SELECT source_email, COALESCE(org, ''), send_time::date, COUNT(*) FROM t_clues
+    WHERE send_time IS NOT NULL AND source_email IS NOT NULL AND source_email != ''
+      AND NOT EXISTS (SELECT 1 FROM t_sender_days)
+    GROUP BY 1, 2, 3
+    """,
+    """
+    INSERT INTO t_entity_days (entity_id, org, day, clue_count)
+    SELECT r.entity_id, COALESCE(c.org, ''), c.send_time::date, COUNT(*)
+    FROM t_relations r JOIN t_clues c ON c.id = r.clue_id
+    WHERE c.send_time IS NOT NULL AND NOT EXISTS (SELECT 1 FROM t_entity_days)
+    GROUP BY 1, 2, 3
+    """,
+]
+
+
+# ==========================================
+# 2. 看板查询
+# ==========================================
+def _rollup_filters(org, date_from, date_to, alias=""):
+    conditions, params = ["1=1"], []
+    if org != "全部机构":
+        conditions.append(f"{alias}org = %s")
+        params.append(org)
+    if date_from != "全部时间":
+        conditions.append(f"{alias}day >= %s::date")
+        params.append(date_from)
+    if date_to != "全部时间":
+        conditions.append(f"{alias}day <= %s::date")
+        params.append(date_to)
+    return " AND ".join(conditions), params
+
+
+def data_version(conn, org="全部机构", date_from="全部时间", date_to="全部时间"):
+    # 筛选范围内 (机构, 日期) 版本之和；各版本只增不减，范围内任一变化都会改变该值
+    where, params = _rollup_filters(org, date_from, date_to)
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT COALESCE(SUM(generation), 0) FROM t_clue_days WHERE {where}", params)
+        return int(cur.fetchone()[0])
+
+
+def fetch_dashboard(conn, keyword, org, date_from, date_to, top_senders=10, top_entities=100):
+    # 无关键词时读汇总表，耗时与线索总量无关；有关键词时对全部命中线索做聚合
+    if not keyword:
+        where, params = _rollup_filters(org, date_from, date_to)
+        timeline = read_sql("dashboard.timeline", f"""
+            SELECT day, org, clue_count AS count FROM t_clue_days
+            WHERE {where} AND clue_count > 0 ORDER BY day
+        """, conn, params=params)
+        senders = read_sql("dashboard.senders", f"""
+            SELECT source_email AS email, SUM(clue_count) AS count FROM t_sender_days
+            WHERE {where} GROUP BY source_email ORDER BY count DESC LIMIT %s
+        """, conn, params=params + [top_senders])
+        ent_where, _ = _rollup_filters(org, date_from, date_to, alias="d.")
+        entities = read_sql("dashboard.entities", f"""
+            SELECT e.name, e.type, SUM(d.clue_count) AS weight
+            FROM t_entity_days d JOIN t_entities e ON e.id = d.entity_id
+            WHERE {ent_where}
+            GROUP BY e.id, e.name, e.type HAVING SUM(d.clue_count) > 0 ORDER BY weight DESC LIMIT %s
+        """, conn, params=params + [top_entities])
+        entity_total = read_sql("dashboard.entity_total", f"""
+            SELECT COUNT(DISTINCT entity_id) AS n FROM t_entity_days WHERE {where} AND clue_count > 0
+        """, conn, params=params)['n'].iloc[0]
+    else:
+        hits_sql, hits_params = keyword_hits_sql(keyword, date_from, date_to)
+        conditions, params = clue_filters(org, date_from, date_to)
+        where = " AND ".join(conditions)
+        matched = f"""
+            WITH {hits_sql}, matched AS (
+                SELECT c.id, c.org, c.send_time, c.source_email
+                FROM t_clues c JOIN kw_hits h ON h.clue_id = c.id
+                WHERE {where}
+            )
+        """
+        base = hits_params + params
+        timeline = read_sql("dashboard.kw_timeline", matched + """
+            SELECT send_time::date AS day, COALESCE(org, '') AS org, COUNT(*) AS count
+            FROM matched WHERE send_time IS NOT NULL GROUP BY 1, 2 ORDER BY 1
+        """, conn, params=base)
+        senders = read_sql("dashboard.kw_senders", matched + """
+            SELECT source_email AS email, COUNT(*) AS count FROM matched
+            WHERE source_email IS NOT NULL AND source_email != ''
+            GROUP BY 1 ORDER BY count DESC LIMIT %s
+        """, conn, params=base + [top_senders])
+        entities = read_sql("dashboard.kw_entities", matched + """
+            SELECT e.name, e.type, COUNT(*) AS weight
+            FROM matched m JOIN t_relations r ON r.clue_id = m.id AND r.send_time = m.send_time
+            JOIN t_entities e ON e.id = r.entity_id
+            GROUP BY e.id, e.name, e.type ORDER BY weight DESC LIMIT %s
+        """, conn, params=base + [top_entities])
+        entity_total = read_sql("dashboard.kw_entity_total", matched + """
+            SELECT COUNT(DISTINCT r.entity_id) AS n
+            FROM matched m JOIN t_relations r ON r.clue_id = m.id AND r.send_time = m.send_time
+        """, conn, params=base)['n'].iloc[0]
+
+    return {
+        'total': int(timeline['count'].sum()) if not timeline.empty else 0,
+        'entity_total': int(entity_total or 0),
+        'first_day': timeline['day'].min() if not timeline.empty else None,
+        'last_day': timeline['day'].max() if not timeline.empty else None,
+        'timeline': timeline,
+        'senders': senders,
+        'entities': entities,
+    }
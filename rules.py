@@ -0,0 +1,211 @@
+"""
+DeepTrace 规则抽取
+
+预编译正则 (手机号 / 邮箱 / 身份证 / 银行卡 / 网址) 加 Aho-Corasick 关注名单匹配，
+在 HanLP 之前对每条线索运行；也可单独运行 (仅规则模式)，用于大量积压数据的快速初筛。
+关注名单保存在 t_watchlist，按类型导入：
+
+    python rules.py 人名 names.txt
+    python rules.py 机构 orgs.txt more_orgs.txt
+"""
+import hashlib
+import re
+import sys
+from collections import deque
+
+from psycopg2.extras import execute_values
+
+from db import get_db_conn
+
+# ==========================================
+# 1. 预编译正则
+# ==========================================
+PHONE_RE = re.compile(r'(?<!\d)1[3-9]\d{9}(?!\d)')
+EMAIL_RE = re.compile(r'(?<![A-Za-z0-9._%+-])[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}')
+ID_CARD_RE = re.compile(
+    r'(?<![0-9A-Za-z])[1-9]\d{5}(?:18|19|20)\d{2}(?:0[1-9]|1[0-2])(?:0[1-9]|[12]\d|3[01])\d{3}[\dXx](?![0-9A-Za-z])')
+BANK_CARD_RE = re.compile(r'(?<!\d)[1-9]\d{15,18}(?!\d)')
+URL_RE = re.compile(r'https?://[^\s<>"\'，。；！？、（）()]+', re.IGNORECASE)
+
+ID_WEIGHTS = [7, 9, 10, 5, 8, 4, 2, 1, 6, 3, 7, 9, 10, 5, 8, 4, 2]
+ID_CHECK = "10X98765432"
+TERM_MIN, TERM_MAX = 2, 200   # 关注名单词条长度，上限与 t_entities.name 一致
+RULES_REVISION = 1            # 修改正则或词条匹配规则时递增，强制重扫时只重跑规则抽取
+
+
+def valid_id_card(num):
+    total = sum(int(d) * w for d, w in zip(num[:17], ID_WEIGHTS))
+    return ID_CHECK[total % 11] == num[17].upper()
+
+
+def valid_bank_card(num):
+    # Luhn 校验
+    total = 0
+    for i, d in enumerate(reversed(num)):
+        d = int(d)
+        if i % 2:
+            d = d * 2 - 9 if d > 4 else d * 2
+        total += d
+    return total % 10 == 0
+
+
+def extract_patterns(text):
+    found = {(m, '手机号') for m in PHONE_RE.findall(text)}
+    found.update((m, '邮箱') for m in EMAIL_RE.findall(text))
+    found.update((m.rstrip('.,;:!?'), '网址') for m in URL_RE.findall(text))
+    ids = {m.upper() for m in ID_CARD_RE.findall(text) if valid_id_card(m)}
+    found.update((m, '身份证') for m in ids)
+    # 18 位身份证号也可能恰好通过 Luhn 校验，已识别为身份证的号码不再计为银行卡
+    found.update((m, '银行卡') for m in BANK_CARD_RE.findall(text) if m not in ids and valid_bank_card(m))
+    return found
+
+
+# ==========================================
+# 2. Aho-Corasick 自动机
+# ==========================================
+class AhoCorasick:
+    def __init__(self, patterns):
+        # patterns: [(匹配键, 载荷)]，一次扫描找出文本中出现的全部匹配键
+        self.goto, self.fail, self.out = [{}], [0], [[]]
+        for key, payload in patterns:
+            node = 0
+            for ch in key:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append((len(key), payload))
+
+        # BFS 计算失败指针，并把后缀节点的输出并入当前节点
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                if self.out[self.fail[nxt]]:
+                    self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def __len__(self):
+        return len(self.goto) - 1
+
+    def iter(self, text):
+        # 产出 (起始位置, 结束位置, 载荷)
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length, payload in out[node]:
+                yield i - length + 1, i + 1, payload
+
+
+def _is_word_char(ch):
+    return ch.isascii() and (ch.isalnum() or ch in '_@.-')
+
+
+def _joins_word(text, i, step):
+    # text[i] 是否与相邻词条属于同一英文 / 数字串；. @ - 只在其外侧 (step 方向) 仍是字母数字时
+    # 才算串内连接符 ("li.wei@x.com")，句末的 "Li." 、"Li-" 视为边界
+    ch = text[i]
+    if not _is_word_char(ch):
+        return False
+    if ch.isalnum() or ch == '_':
+        return True
+    j = i + step
+    return 0 <= j < len(text) and text[j].isascii() and text[j].isalnum()
+
+
+# ==========================================
+# 3. 规则抽取器
+# ==========================================
+class RuleMatcher:
+    def __init__(self, watchlist=()):
+        # watchlist: [(词条, 类型)]；匹配时忽略大小写
+        entries = {(term.strip(), etype) for term, etype in watchlist if TERM_MIN <= len(term.strip()) <= TERM_MAX}
+        self.size = len(entries)
+        # 规则版本 = 规则修订号 + 名单内容摘要，记录在线索的 rules_version 中；
+        # 名单变化后强制重扫只对已完成的线索重跑规则抽取，不重新运行模型
+        self.digest = hashlib.md5("\n".join(f"{t}\t{e}" for t, e in sorted(entries)).encode('utf-8')).hexdigest()[:8]
+        self.version = f"{RULES_REVISION}:{self.digest}"
+        self.automaton = AhoCorasick((term.lower(), (term, etype)) for term, etype in entries) if entries else None
+
+    def extract(self, text):
+        # 返回 {(name, type)}
+        found = extract_patterns(text)
+        if self.automaton is None:
+            return found
+        lowered = text.lower()
+        for start, end, (term, etype) in self.automaton.iter(lowered):
+            # 英文 / 数字词条要求两侧不是同类字符，避免 "li" 命中 "client"
+            if _is_word_char(term[0]) and start > 0 and _joins_word(lowered, start - 1, -1):
+                continue
+            if _is_word_char(term[-1]) and end < len(lowered) and _joins_word(lowered, end, 1):
+                continue
+            found.add((term, etype))
+        return found
+
+
+PATTERN_MATCHER = RuleMatcher()
+_matcher_cache = (None, PATTERN_MATCHER)
+
+
+def current_matcher(cur):
+    # 关注名单按 (词条数, 最近导入时间) 判断是否变化，未变化时复用已构建的自动机
+    global _matcher_cache
+    try:
+        cur.execute("SELECT COUNT(*), MAX(added_at) FROM t_watchlist")
+        version = cur.fetchone()
+        if version != _matcher_cache[0]:
+            cur.execute("SELECT term, type FROM t_watchlist")
+            _matcher_cache = (version, RuleMatcher(cur.fetchall()))
+    except Exception:
+        # 关注名单表尚未创建时只使用正则
+        cur.connection.rollback()
+        return PATTERN_MATCHER
+    return _matcher_cache[1]
+
+
+# ==========================================
+# 4. 关注名单导入
+# ==========================================
+def load_watchlist(conn, etype, terms):
+    rows = {(t.strip(), etype) for t in terms if TERM_MIN <= len(t.strip()) <= TERM_MAX}
+    with conn.cursor() as cur:
+        added = len(execute_values(
+            cur, "INSERT INTO t_watchlist (term, type) VALUES %s ON CONFLICT DO NOTHING RETURNING 1",
+            list(rows), page_size=5000, fetch=True))
+    conn.commit()
+    return added
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2:
+        print("用法: python rules.py <实体类型> <词条文件> [...]，每行一个词条", file=sys.stderr)
+        return 2
+    etype, paths = argv[0], argv[1:]
+    conn = get_db_conn()
+    if not conn:
+        print("数据库连接失败", file=sys.stderr)
+        return 1
+    try:
+        for path in paths:
+            with open(path, encoding='utf-8') as fh:
+                added = load_watchlist(conn, etype, fh)
+            print(f"{path}: 新增 {etype} 词条 {added} 条")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,32 +1,66 @@
 -- DeepTrace Database Schema
 -- Database: PostgreSQL
 
+-- 0. 扩展：pg_trgm 用于关键词模糊检索 (LIKE '%kw%') 的 GIN 索引
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- 1. 清理旧表 (如果存在，注意顺序，先删关联表)
+DROP TABLE IF EXISTS t_schema_migrations;
+DROP TABLE IF EXISTS t_cooccurrence_version;
+DROP TABLE IF EXISTS t_pipeline_workers;
+DROP TABLE IF EXISTS t_pipeline_checkpoints;
+DROP TABLE IF EXISTS t_clue_days;
+DROP TABLE IF EXISTS t_watchlist;
+DROP TABLE IF EXISTS t_clue_bands;
+DROP TABLE IF EXISTS t_clue_signatures;
+DROP TABLE IF EXISTS t_sender_days;
+DROP TABLE IF EXISTS t_entity_days;
+DROP TABLE IF EXISTS t_cooccurrence;
 DROP TABLE IF EXISTS t_relations;
 DROP TABLE IF EXISTS t_entities;
 DROP TABLE IF EXISTS t_clues;
 
 -- 2. 创建线索主表 (t_clues)
--- 用于存储原始邮件/线索数据
+-- 用于存储原始邮件/线索数据；按 send_time 月度范围分区，分区 (t_clues_pYYYYMM) 由入库程序按需创建，
+-- 也可用 python partitions.py ensure 2024-01 2025-12 预建，旧月份用 python partitions.py archive 分离归档
 CREATE TABLE t_clues (
-    id SERIAL PRIMARY KEY,                          -- 自增主键
+    id SERIAL,                                      -- 自增 id (由序列保证唯一)
     source_email VARCHAR(150),                      -- 来源邮箱/发件人
     batch_no VARCHAR(100),                          -- 批次号
-    send_time TIMESTAMP,                            -- 收发时间
+    send_time TIMESTAMP NOT NULL,                   -- 收发时间 (分区键，缺失时入库程序以入库时间填充)
     content TEXT,                                   -- 邮件正文/线索内容
     subject VARCHAR(255),                           -- 邮件标题/主题
     recorder VARCHAR(100),                          -- 记录人
     remarks TEXT,                                   -- 备注信息
     original_file VARCHAR(255),                     -- 原始文件名
-    process_status SMALLINT DEFAULT 0,              -- 处理状态: 0-待处理, 1-已分析, -1-失败
+    process_status SMALLINT DEFAULT 0,              -- 处理状态: 0-待处理, 1-已分析, -1-失败, 2-处理中, 3-仅规则初筛
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- 入库时间
-    org VARCHAR(200)                                -- 归属机构
-);
+    org VARCHAR(200),                               -- 归属机构
+    claimed_at TIMESTAMP,                           -- worker 领取时间 (处理中超时后重新入队)
+    claimed_by VARCHAR(100),                        -- 领取该线索的 worker (主机名:进程号)
+    content_hash VARCHAR(32),                       -- 规整后正文的 MD5 (精确判重)
+    canonical_id INT,                               -- 规范线索 id: 等于自身为规范线索, NULL 为尚未建立去重索引
+    canonical_time TIMESTAMP,                       -- 规范线索的 send_time (按规范线索查询时限定分区)
+    dup_count INT NOT NULL DEFAULT 0,               -- 规范线索的重复副本数 (去重索引维护)
+    extractor_version VARCHAR(100),                 -- 最近一次成功抽取所用的抽取器版本 (nlp.EXTRACTOR_VERSION)
+    rules_version VARCHAR(100),                     -- 最近一次规则抽取所用的规则与关注名单版本 (rules.RuleMatcher.version)
+    extracted_hash VARCHAR(32),                     -- 最近一次抽取时 标题+正文+发件人 的 MD5，判断正文是否变化
+    extracted_at TIMESTAMP,                         -- 最近一次成功抽取时间
+    retry_count SMALLINT NOT NULL DEFAULT 0,        -- 连续失败次数 (失败线索按指数退避自动重试)
+    next_retry_at TIMESTAMP,                        -- 失败线索的下次重试时间
+    CONSTRAINT t_clues_pkey PRIMARY KEY (id, send_time) -- 分区表主键须包含分区键
+) PARTITION BY RANGE (send_time);
 
--- 创建 t_clues 的索引以加速查询
-CREATE INDEX idx_clues_org ON t_clues(org);
+-- 创建 t_clues 的索引以加速查询 (建在父表上，各分区自动创建)
+CREATE INDEX idx_clues_org ON t_clues(org, send_time);
 CREATE INDEX idx_clues_send_time ON t_clues(send_time);
 CREATE INDEX idx_clues_source_email ON t_clues(source_email);
+CREATE INDEX idx_clues_content_trgm ON t_clues USING gin (content gin_trgm_ops);
+CREATE INDEX idx_clues_subject_trgm ON t_clues USING gin (subject gin_trgm_ops);
+CREATE INDEX idx_clues_content_hash ON t_clues(content_hash);
+CREATE INDEX idx_clues_canonical_id ON t_clues(canonical_id);
+-- 部分索引：只包含未完成的线索，队列领取与进度统计不扫描已分析的数据
+CREATE INDEX idx_clues_queue ON t_clues(id, process_status) WHERE process_status IN (-1, 0, 2, 3);
 
 
 -- 3. 创建实体表 (t_entities)
@@ -41,23 +75,142 @@ CREATE TABLE t_entities (
 -- 创建 t_entities 的索引
 CREATE INDEX idx_entities_name ON t_entities(name);
 CREATE INDEX idx_entities_type ON t_entities(type);
+CREATE INDEX idx_entities_name_trgm ON t_entities USING gin (name gin_trgm_ops);
 
 
 -- 4. 创建关系表 (t_relations)
--- 关联表：连接线索与实体，形成知识图谱边
+-- 关联表：连接线索与实体，形成知识图谱边；冗余线索的 send_time，与 t_clues 按相同月份分区 (t_relations_pYYYYMM)
 CREATE TABLE t_relations (
     clue_id INTEGER NOT NULL,
     entity_id INTEGER NOT NULL,
-    PRIMARY KEY (clue_id, entity_id), -- 联合主键
-    CONSTRAINT t_relations_clue_id_fkey FOREIGN KEY (clue_id) REFERENCES t_clues(id) ON DELETE CASCADE,
+    send_time TIMESTAMP NOT NULL,      -- 线索收发时间 (分区键)
+    PRIMARY KEY (clue_id, entity_id, send_time), -- 联合主键
+    CONSTRAINT t_relations_clue_id_fkey FOREIGN KEY (clue_id, send_time) REFERENCES t_clues(id, send_time) ON DELETE CASCADE,
     CONSTRAINT t_relations_entity_id_fkey FOREIGN KEY (entity_id) REFERENCES t_entities(id) ON DELETE CASCADE
-);
+) PARTITION BY RANGE (send_time);
 
--- 创建 t_relations 的索引
-CREATE INDEX idx_relations_clue_id ON t_relations(clue_id);
+-- 创建 t_relations 的索引 (主键已覆盖 clue_id 前缀查询)
 CREATE INDEX idx_relations_entity_id ON t_relations(entity_id);
 
+-- 5. 创建日期索引表 (t_clue_days)
+-- 入库时按 (机构, 日期) 累加线索数，为时间下拉提供数据，无需扫描 t_clues
+CREATE TABLE t_clue_days (
+    org VARCHAR(200) NOT NULL DEFAULT '',   -- 归属机构 (空机构记为 '')
+    day DATE NOT NULL,                      -- 收发日期
+    clue_count INT NOT NULL DEFAULT 0,      -- 当日线索数
+    generation BIGINT NOT NULL DEFAULT 0,   -- 数据版本: 入库 / 分析 / 去重涉及该日时递增，查询缓存以此失效
+    dup_count INT NOT NULL DEFAULT 0,       -- 当日重复线索数
+    dup_groups INT NOT NULL DEFAULT 0,      -- 当日含重复副本的规范线索数
+    PRIMARY KEY (org, day)
+);
+
+-- 5.1 发件人 / 实体汇总表 (t_sender_days / t_entity_days)
+-- 分别由入库与分析管道按 (机构, 日期) 增量累加，统计看板与时序图直接读取
+CREATE TABLE t_sender_days (
+    source_email VARCHAR(150) NOT NULL,     -- 发件人
+    org VARCHAR(200) NOT NULL DEFAULT '',   -- 归属机构 (空机构记为 '')
+    day DATE NOT NULL,                      -- 收发日期
+    clue_count INT NOT NULL DEFAULT 0,      -- 当日该发件人线索数
+    PRIMARY KEY (source_email, org, day)
+);
+CREATE INDEX idx_sender_days_day ON t_sender_days(day, org);
+
+CREATE TABLE t_entity_days (
+    entity_id INT NOT NULL,                 -- 实体 id
+    org VARCHAR(200) NOT NULL DEFAULT '',   -- 归属机构 (空机构记为 '')
+    day DATE NOT NULL,                      -- 收发日期
+    clue_count INT NOT NULL DEFAULT 0,      -- 当日提及该实体的线索数
+    PRIMARY KEY (entity_id, org, day)
+);
+CREATE INDEX idx_entity_days_day ON t_entity_days(day, org);
+
+-- 5.2 近重复索引表 (t_clue_signatures / t_clue_bands)
+-- 仅规范线索写入：MinHash 签名用于估计相似度，LSH 分桶用于查找候选
+CREATE TABLE t_clue_signatures (
+    clue_id INT PRIMARY KEY,                -- 规范线索 id
+    signature BYTEA NOT NULL,               -- MinHash 签名 (64 个 uint32)
+    send_time TIMESTAMP                     -- 规范线索的 send_time
+);
+
+CREATE TABLE t_clue_bands (
+    band SMALLINT NOT NULL,                 -- 签名分段序号
+    bucket BIGINT NOT NULL,                 -- 分段哈希桶号
+    clue_id INT NOT NULL,                   -- 规范线索 id
+    PRIMARY KEY (band, bucket, clue_id)
+);
+
+-- 5.3 关注名单表 (t_watchlist)
+-- 规则抽取阶段用 Aho-Corasick 自动机匹配，可通过 python rules.py <类型> <文件> 导入
+CREATE TABLE t_watchlist (
+    term VARCHAR(200) NOT NULL,                     -- 词条 (人名 / 机构 / 邮箱 / 证件号等)
+    type VARCHAR(50) NOT NULL,                      -- 实体类型，命中后按该类型写入 t_entities
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,   -- 导入时间
+    PRIMARY KEY (term, type)
+);
+
+-- 6. 创建实体共现表 (t_cooccurrence)
+-- 实体对 (entity_a < entity_b) 的共同线索数，分析管道写入 t_relations 时增量维护
+CREATE TABLE t_cooccurrence (
+    entity_a INT NOT NULL,                  -- 较小的实体 id
+    entity_b INT NOT NULL,                  -- 较大的实体 id
+    clue_count INT NOT NULL DEFAULT 0,      -- 共同出现的线索数
+    PRIMARY KEY (entity_a, entity_b)
+);
+CREATE INDEX idx_cooccurrence_entity_b ON t_cooccurrence(entity_b);
+
+-- 共现版本表 (单行)：共现计数变化时递增，应用进程内的共现索引据此重新加载
+CREATE TABLE t_cooccurrence_version (
+    generation BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO t_cooccurrence_version (generation) VALUES (0);
+
+-- 7. 创建分析 worker 心跳表 (t_pipeline_workers)
+-- 后台 worker 每提交一批写入一次，页面据此展示在线 worker 及处理速度
+CREATE TABLE t_pipeline_workers (
+    worker_id VARCHAR(100) PRIMARY KEY,                 -- 主机名:进程号
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,     -- 首次心跳时间
+    heartbeat_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,   -- 最近心跳时间
+    processed INT DEFAULT 0,                            -- 本轮已分析线索数
+    failed INT DEFAULT 0,                               -- 本轮失败线索数
+    docs_per_sec REAL DEFAULT 0                         -- 本轮处理速度 (篇/秒)
+);
+
+-- 8. 创建分析检查点表 (t_pipeline_checkpoints)
+-- 强制重扫按 id 分段推进，每段与检查点同事务提交，中断后从检查点继续
+CREATE TABLE t_pipeline_checkpoints (
+    name VARCHAR(50) PRIMARY KEY,                       -- 任务名 (rescan)
+    target VARCHAR(100) NOT NULL,                       -- 目标抽取器版本，变化时从头开始
+    position INT NOT NULL DEFAULT 0,                    -- 已检查到的最大线索 id
+    marked INT NOT NULL DEFAULT 0,                      -- 已标记重新分析的线索数
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP      -- 最近推进时间
+);
+
+-- 9. 结构迁移记录 (t_schema_migrations)
+-- 本文件已是 migrations.py 各版本执行后的结构，直接记为已执行，应用启动时不再迁移
+CREATE TABLE t_schema_migrations (
+    version INT PRIMARY KEY,
+    name VARCHAR(200) NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO t_schema_migrations (version, name) VALUES
+    (1, '基础表结构'),
+    (2, '关键词检索索引 (pg_trgm)'),
+    (3, '汇总表回填'),
+    (4, '按月分区存储 (t_clues / t_relations)'),
+    (5, '抽取版本记录与失败重试');
+
 -- 注释
 COMMENT ON TABLE t_clues IS '线索原始数据表';
 COMMENT ON TABLE t_entities IS 'NLP提取实体表';
 COMMENT ON TABLE t_relations IS '线索与实体关联关系表';
+COMMENT ON TABLE t_clue_days IS '机构每日线索数索引表';
+COMMENT ON TABLE t_sender_days IS '发件人每日线索数汇总表';
+COMMENT ON TABLE t_entity_days IS '实体每日线索数汇总表';
+COMMENT ON TABLE t_cooccurrence IS '实体共现统计表';
+COMMENT ON TABLE t_watchlist IS '规则抽取关注名单';
+COMMENT ON TABLE t_clue_signatures IS '规范线索 MinHash 签名表';
+COMMENT ON TABLE t_clue_bands IS '规范线索 LSH 分桶表';
+COMMENT ON TABLE t_pipeline_workers IS '后台分析 worker 心跳表';
+COMMENT ON TABLE t_pipeline_checkpoints IS '分析任务检查点表';
+COMMENT ON TABLE t_cooccurrence_version IS '实体共现数据版本表';
+COMMENT ON TABLE t_schema_migrations IS '结构迁移记录表';
@@ -0,0 +1,80 @@
+"""
+DeepTrace 关键词检索
+
+t_clues.content / subject 与 t_entities.name 上建 pg_trgm GIN 索引，
+关键词查询拆成三路各自走索引的命中，再按线索归并，替代三表 LEFT JOIN + DISTINCT 的全表扫描。
+短于 3 个字符的关键词 (如两字人名) 提取不出 trigram，LIKE 会扫描整个索引，改为按实体名精确匹配。
+"""
+
+# ==========================================
+# 1. 索引 (迁移 002)
+# ==========================================
+SEARCH_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_clues_content_trgm ON t_clues USING gin (content gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_clues_subject_trgm ON t_clues USING gin (subject gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_entities_name_trgm ON t_entities USING gin (name gin_trgm_ops)",
+]
+
+# 命中权重：标题 > 正文 > 关联实体
+HIT_WEIGHTS = {'subject': 3, 'content': 2, 'entity': 1}
+MIN_TRGM_LEN = 3   # pg_trgm 从 LIKE 模式中提取 trigram 所需的最少字符数
+
+
+# ==========================================
+# 2. 查询构造
+# ==========================================
+def escape_like(keyword):
+    return keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def short_keyword(keyword):
+    # 关键词过短时只能走实体名精确匹配，页面据此提示检索范围
+    return bool(keyword) and len(keyword) < MIN_TRGM_LEN
+
+
+def send_time_range(column, date_from, date_to):
+    # 日期筛选为半开区间 [起始日, 截止日 + 1)，条件直接作用于分区键 send_time，只扫描相关月份的分区
+    conditions, params = [], []
+    if date_from != "全部时间":
+        conditions.append(f"{column} >= %s::date")
+        params.append(date_from)
+    if date_to != "全部时间":
+        conditions.append(f"{column} < %s::date + 1")
+        params.append(date_to)
+    return conditions, params
+
+
+def keyword_hits_sql(keyword, date_from="全部时间", date_to="全部时间"):
+    # 返回 (CTE SQL, 参数)，CTE 名为 kw_hits(clue_id, score)，score 为各路命中权重之和
+    # 日期范围下推到每一路，线索表与关系表都只扫描范围内的分区
+    pattern = f"%{escape_like(keyword)}%"
+    clue_range, range_params = send_time_range("send_time", date_from, date_to)
+    rel_range, _ = send_time_range("r.send_time", date_from, date_to)
+    clue_where = "".join(f" AND {c}" for c in clue_range)
+    rel_where = "".join(f" AND {c}" for c in rel_range)
+    if short_keyword(keyword):
+        # 实体名走 B-tree 索引精确匹配，标题 / 正文不检索
+        sql = f"""
+            kw_hits AS (
+                SELECT r.clue_id, SUM({HIT_WEIGHTS['entity']}) AS score FROM t_relations r
+                JOIN t_entities e ON e.id = r.entity_id
+                WHERE e.name = %s{rel_where}
+                GROUP BY r.clue_id
+            )
+        """
+        return sql, [keyword, *range_params]
+    sql = f"""
+        kw_hits AS (
+            SELECT clue_id, SUM(w) AS score FROM (
+                SELECT id AS clue_id, {HIT_WEIGHTS['subject']} AS w FROM t_clues WHERE subject LIKE %s{clue_where}
+                UNION ALL
+                SELECT id, {HIT_WEIGHTS['content']} FROM t_clues WHERE content LIKE %s{clue_where}
+                UNION ALL
+                SELECT r.clue_id, {HIT_WEIGHTS['entity']} FROM t_relations r
+                JOIN t_entities e ON e.id = r.entity_id
+                WHERE e.name LIKE %s{rel_where}
+            ) hits
+            GROUP BY clue_id
+        )
+    """
+    return sql, [pattern, *range_params] * 3
@@ -0,0 +1,30 @@
+import numpy as np
+
+from dedup import BANDS, NUM_PERM, band_buckets, content_hash, minhash, normalize_text, similarity
+
+BASE = "本周例会纪要：请各部门于周五前提交季度预算，逾期将影响下季度的经费审批流程。" * 3
+
+
+def test_normalize_text_merges_whitespace():
+    assert normalize_text("  Hello\r\n  World ") == "hello world"
+    assert content_hash(normalize_text("a  b")) == content_hash(normalize_text("a\nb"))
+
+
+def test_minhash_is_deterministic_and_short_text_skipped():
+    sig = minhash(BASE)
+    assert sig.dtype == np.uint32 and len(sig) == NUM_PERM
+    assert np.array_equal(sig, minhash(BASE))
+    assert minhash("短文本") is None
+
+
+def test_similarity_separates_near_and_different_texts():
+    near = minhash(BASE.replace("周五", "周四", 1))
+    other = minhash("完全无关的另一封邮件，讨论的是服务器迁移计划与停机窗口安排。" * 3)
+    assert similarity(minhash(BASE), near) >= 0.8
+    assert similarity(minhash(BASE), other) < 0.3
+
+
+def test_band_buckets_share_a_bucket_for_near_duplicates():
+    a, b = band_buckets(minhash(BASE)), band_buckets(minhash(BASE.replace("周五", "周四", 1)))
+    assert len(a) == BANDS
+    assert any(x == y for x, y in zip(a, b))
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from graph import build_graph, collapse_leaves
+
+
+def _graph():
+    clues = pd.DataFrame({'id': [1, 2], 'subject': ["季度预算通知", None],
+                          'send_time': pd.to_datetime(["2024-01-05 09:00:00", "2024-02-01 10:30:00"])})
+    rels = pd.DataFrame({'clue_id': [1, 1, 1, 2, 2], 'eid': [10, 11, 12, 12, 13],
+                         'name': ["张三", "李四", "王五", "王五", "北京"],
+                         'type': ["人名", "人名", "人名", "人名", "地名"]})
+    return build_graph(clues, rels)
+
+
+def test_build_graph_mail_ids_carry_send_time():
+    g = _graph()
+    mail = g['nodes'][g['nodes']['id'].str.startswith('MAIL_')]
+    assert mail['id'].tolist() == ["MAIL_1_2024-01-05T09:00:00.000000", "MAIL_2_2024-02-01T10:30:00.000000"]
+    assert set(g['edges']['source']) == set(mail['id'])
+    assert g['entity_names'] == {10: "张三", 11: "李四", 12: "王五", 13: "北京"}
+
+
+def test_collapse_leaves_groups_by_anchor_and_type():
+    g = collapse_leaves(_graph(), min_group=2)
+    ids = set(g['nodes']['id'])
+    # 张三、李四只连着线索 1，聚为一个人名簇；王五连着两条线索，北京单独一个，均保留
+    assert "ENT_10" not in ids and "ENT_11" not in ids
+    assert {"ENT_12", "ENT_13"} <= ids
+    group = g['nodes'][g['nodes']['id'].str.startswith('GRP_')]
+    assert group['label'].tolist() == ["人名 ×2"]
+    assert not (g['edges']['target'].isin(["ENT_10", "ENT_11"])).any()
+
+
+def test_collapse_leaves_noop_below_min_group():
+    g = _graph()
+    assert collapse_leaves(g, min_group=3) is g
@@ -0,0 +1,26 @@
+from graph_index import CooccurrenceIndex
+
+# 1-2-3-4 链，另有 1-5 高权边；6-7 为独立分量
+INDEX = CooccurrenceIndex([1, 2, 3, 1, 6], [2, 3, 4, 5, 7], [1, 1, 1, 9, 1])
+
+
+def test_neighbors_sorted_by_weight():
+    assert INDEX.neighbors(1) == [(5, 9), (2, 1)]
+    assert INDEX.neighbors(99) == []
+
+
+def test_k_hop_depths_and_budget():
+    assert INDEX.k_hop(1, k=2) == {1: 0, 2: 1, 5: 1, 3: 2}
+    # 预算不足时同层优先保留边权高的邻居
+    assert INDEX.k_hop(1, k=2, max_nodes=2) == {1: 0, 5: 1}
+
+
+def test_shortest_path():
+    assert INDEX.shortest_path(1, 4) == [1, 2, 3, 4]
+    assert INDEX.shortest_path(4, 4) == [4]
+    assert INDEX.shortest_path(1, 7) is None
+    assert INDEX.shortest_path(1, 4, max_depth=2) is None
+
+
+def test_edges_within():
+    assert sorted(INDEX.edges_within([1, 2, 5, 4])) == [(1, 2, 1), (1, 5, 9)]
@@ -0,0 +1,23 @@
+from datetime import datetime
+
+import pandas as pd
+
+from ingest import CLUE_COLUMNS, normalize_frame
+
+
+def test_normalize_frame_maps_headers_and_merges_duplicates():
+    raw = pd.DataFrame([["a@x.com", None, "正文", "2024-01-02 03:04:05"],
+                        [None, "b@x.com", "正文2", None]],
+                       columns=["发件人", "邮箱", "正文", "时间"])
+    now = datetime(2024, 5, 1, 12, 0)
+    out = normalize_frame(raw, now=now)
+    assert list(out.columns) == CLUE_COLUMNS
+    assert out['source_email'].tolist() == ["a@x.com", "b@x.com"]
+    assert out['send_time'].tolist() == [pd.Timestamp("2024-01-02 03:04:05"), pd.Timestamp(now)]
+
+
+def test_normalize_frame_restores_integer_columns():
+    raw = pd.DataFrame({"批次": [1.0, None, 3.0], "正文": ["a", "b", "c"]})
+    out = normalize_frame(raw, now=datetime(2024, 1, 1))
+    assert str(out['batch_no'].dtype) == "Int64"
+    assert out['batch_no'].tolist()[0] == 1 and out['batch_no'].isna().tolist() == [False, True, False]
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from layout import PIXELS_PER_NODE, apply_layout
+
+
+def _graph(n_nodes, edges):
+    nodes = pd.DataFrame({'id': [f"N{i}" for i in range(n_nodes)]})
+    edges = pd.DataFrame(edges, columns=['source', 'target'])
+    return {'nodes': nodes, 'edges': edges}
+
+
+def test_apply_layout_centres_and_scales_coordinates():
+    edges = [(f"N{i}", f"N{i + 1}") for i in range(9)] + [("N0", "MISSING")]
+    g = apply_layout(_graph(10, edges))
+    pos = g['nodes'][['x', 'y']].to_numpy()
+    assert np.isfinite(pos).all()
+    assert np.abs(pos.mean(axis=0)).max() < 1.0
+    # 最远的节点落在画布半边长上
+    assert abs(np.abs(pos).max() - np.sqrt(10) * PIXELS_PER_NODE / 2) <= 0.05
+    # 相邻节点比首尾节点更近
+    near = np.linalg.norm(pos[0] - pos[1])
+    far = np.linalg.norm(pos[0] - pos[9])
+    assert near < far
+
+
+def test_apply_layout_is_deterministic():
+    edges = [("N0", "N1"), ("N1", "N2"), ("N2", "N0"), ("N3", "N4")]
+    a = apply_layout(_graph(5, edges))['nodes']
+    b = apply_layout(_graph(5, edges))['nodes']
+    assert a.equals(b)
+
+
+def test_apply_layout_small_and_empty_graphs():
+    assert apply_layout(_graph(0, []))['nodes'].empty
+    # 两个节点不做谱布局初始化，直接力导向
+    g = apply_layout(_graph(2, [("N0", "N1")]))
+    assert not g['nodes'][['x', 'y']].isna().any().any()
+    assert g['nodes'].loc[0, 'x'] == -g['nodes'].loc[1, 'x']
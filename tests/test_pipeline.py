@@ -0,0 +1,57 @@
+from datetime import datetime
+
+from nlp import EXTRACTOR_VERSION, RULES_VERSION
+from pipeline import stage_claimed
+from rules import RuleMatcher
+
+T1 = datetime(2024, 1, 5, 9, 30)
+T2 = datetime(2024, 2, 1, 8, 0)
+
+
+class RecordingCursor:
+    # 记录执行的语句与参数，fetchall 依次返回预置的结果
+    def __init__(self, results):
+        self.results = list(results)
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((" ".join(sql.split()), params))
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+
+def test_stage_claimed_with_watchlist_keeps_model_version_for_reuse():
+    matcher = RuleMatcher([('张三', '人名')])
+    cur = RecordingCursor([
+        [(1, T1, True), (2, T1, False)],   # finish_unchanged: 1 全部未变，2 只有规则版本不同
+        [(3, 9, T2)],                      # split_duplicates: 3 是 9 的副本
+        [(9,)],                            # 规范线索 9 已完成分析
+    ])
+    unchanged, refresh, dups = stage_claimed(cur, {1: T1, 2: T1, 3: T1, 4: T1}, matcher)
+    assert unchanged == {1}
+    assert refresh == {2: T1}
+    assert dups == {3: (9, T2)}
+
+    select_unchanged, restore, candidates, ready = cur.executed
+    assert select_unchanged[1][0] == matcher.version
+    assert select_unchanged[1][-1] == [EXTRACTOR_VERSION]
+    assert restore[1][1] == [1]
+    # 未变化 / 只重跑规则的线索不再查找规范线索
+    assert candidates[1][0] == [3, 4]
+    # 规范线索按模型版本判断是否可复用，与关注名单无关，并按其 send_time 限定分区
+    assert ready[1] == [[9], [T2], 1, EXTRACTOR_VERSION]
+    assert matcher.digest not in EXTRACTOR_VERSION
+
+
+def test_stage_claimed_rules_only_accepts_both_versions_and_skips_reuse():
+    cur = RecordingCursor([[]])
+    unchanged, refresh, dups = stage_claimed(cur, {1: T1}, RuleMatcher(), rules_only=True)
+    assert (unchanged, refresh, dups) == (set(), {}, {})
+    assert len(cur.executed) == 1
+    assert cur.executed[0][1][-1] == [RULES_VERSION, EXTRACTOR_VERSION]
+
+
+def test_matcher_version_tracks_watchlist():
+    assert RuleMatcher([('张三', '人名')]).version != RuleMatcher().version
+    assert RuleMatcher([('张三', '人名')]).version == RuleMatcher([(' 张三 ', '人名')]).version
@@ -0,0 +1,31 @@
+import pandas as pd
+
+from queries import page_cursor, page_query
+
+
+def test_ranked_page_orders_and_seeks_by_score_first():
+    last = pd.Series({'score': 5, 'send_time': pd.Timestamp("2024-03-01 08:00:00.250000"), 'id': 42})
+    cursor = page_cursor(last, ranked=True)
+    assert cursor == (5, "2024-03-01T08:00:00.250000", 42)
+
+    sql, params = page_query("季度预算", "全部机构", "全部时间", "全部时间", ranked=True, cursor=cursor, page_size=10)
+    assert "ORDER BY h.score DESC, c.send_time DESC, c.id DESC" in sql
+    assert "(h.score, c.send_time, c.id) < (%s, %s::timestamp, %s)" in sql
+    # 参数顺序：关键词命中 CTE、游标、LIMIT (多取一行)
+    assert params[-4:] == [5, "2024-03-01T08:00:00.250000", 42, 11]
+    assert sql.count("%s") == len(params)
+
+
+def test_unranked_cursor_ignores_score():
+    last = pd.Series({'score': None, 'send_time': pd.Timestamp("2024-03-01"), 'id': 7})
+    cursor = page_cursor(last)
+    assert cursor == ("2024-03-01T00:00:00", 7)
+    sql, params = page_query("", "机构A", "全部时间", "全部时间", cursor=cursor, page_size=10)
+    assert "kw_hits" not in sql and "ORDER BY c.send_time DESC, c.id DESC" in sql
+    assert "(c.send_time, c.id) < (%s::timestamp, %s)" in sql
+    assert params == ["机构A", "2024-03-01T00:00:00", 7, 11]
+
+
+def test_ranked_without_keyword_falls_back_to_time_order():
+    sql, _ = page_query("", "全部机构", "全部时间", "全部时间", ranked=True)
+    assert "h.score" not in sql
@@ -0,0 +1,34 @@
+from rules import AhoCorasick, RuleMatcher
+
+
+def test_aho_corasick_finds_overlapping_keys():
+    ac = AhoCorasick([('he', 1), ('she', 2), ('hers', 3)])
+    assert sorted(ac.iter('ushers')) == [(1, 4, 2), (2, 4, 1), (2, 6, 3)]
+
+
+def test_matcher_ignores_case_and_keeps_watchlist_spelling():
+    m = RuleMatcher([('Li', '人名'), ('张三', '人名')])
+    assert ('Li', '人名') in m.extract("met LI today")
+    assert ('张三', '人名') in m.extract("张三来了")
+
+
+def test_matcher_word_boundaries():
+    m = RuleMatcher([('Li', '人名')])
+    for text in ["client", "li.wei@x.com", "li@x.com", "li_wei"]:
+        assert ('Li', '人名') not in m.extract(text), text
+    for text in ["Met Li.", "by Li, ok", "Li-", ".Li said"]:
+        assert ('Li', '人名') in m.extract(text), text
+
+
+def test_matcher_extracts_patterns_without_watchlist():
+    found = RuleMatcher().extract("电话 13812345678 邮箱 a.b@example.com")
+    assert ('13812345678', '手机号') in found
+    assert ('a.b@example.com', '邮箱') in found
+
+
+def test_digest_tracks_watchlist_content():
+    a = RuleMatcher([('Li', '人名'), ('张三', '人名')])
+    b = RuleMatcher([('张三', '人名'), ('Li', '人名')])
+    c = RuleMatcher([('Li', '人名')])
+    assert a.digest == b.digest
+    assert a.digest != c.digest
@@ -0,0 +1,32 @@
+from search import HIT_WEIGHTS, MIN_TRGM_LEN, escape_like, keyword_hits_sql, short_keyword
+
+
+def test_escape_like_escapes_wildcards():
+    assert escape_like("50%_a\\b") == "50\\%\\_a\\\\b"
+
+
+def test_short_keyword_matches_entity_names_exactly():
+    keyword = "张三"
+    assert len(keyword) < MIN_TRGM_LEN and short_keyword(keyword)
+    sql, params = keyword_hits_sql(keyword, "2024-01-01", "2024-01-31")
+    assert "e.name = %s" in sql and "LIKE" not in sql
+    assert "t_clues" not in sql   # 标题 / 正文不检索
+    assert params == ["张三", "2024-01-01", "2024-01-31"]
+    assert sql.count("%s") == len(params)
+
+
+def test_trigram_keyword_searches_three_branches_with_date_range():
+    sql, params = keyword_hits_sql("预算_50%", "2024-01-01", "全部时间")
+    assert not short_keyword("预算_50%")
+    assert sql.count("LIKE %s") == 3
+    assert f"{HIT_WEIGHTS['subject']} AS w" in sql
+    # 每一路都带日期下限，线索表与关系表都只扫描范围内的分区
+    assert sql.count("send_time >= %s::date") == 3
+    assert params == ["%预算\\_50\\%%", "2024-01-01"] * 3
+    assert sql.count("%s") == len(params)
+
+
+def test_no_date_range_adds_no_conditions():
+    sql, params = keyword_hits_sql("季度预算")
+    assert "send_time" not in sql
+    assert params == ["%季度预算%"] * 3
@@ -0,0 +1,103 @@
+"""
+DeepTrace 后台分析 worker
+
+    python worker.py                 # 常驻运行，队列为空时轮询等待
+    python worker.py --drain         # 处理完当前积压后退出
+    python worker.py --workers 8 --threads 4
+    python worker.py --drain --rules-only   # 只做规则抽取，快速初筛大量积压
+    python worker.py --metrics /var/lib/node_exporter/deeptrace.prom   # 每轮导出分阶段耗时
+    python worker.py --drain --rescan       # 强制重扫：重新分析抽取器版本或正文变化的线索
+
+可在多台机器上同时启动多个实例，线索通过 SKIP LOCKED 领取，互不重复。
+上次重扫中断时，完整分析模式的 worker 启动后会先从检查点续扫。
+"""
+import argparse
+import sys
+import time
+import traceback
+
+from db import get_db_conn
+from instrument import dump, enable
+from nlp import DEFAULT_BATCH_SIZE, load_models, make_pool
+from pipeline import DEFAULT_CLAIM_SIZE, default_worker_id, has_work, mark_stale, rescan_pending, run_analysis_pipeline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DeepTrace 后台分析 worker")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="每次送入模型的句子数")
+    parser.add_argument('--claim-size', type=int, default=DEFAULT_CLAIM_SIZE, help="每次领取的线索数")
+    parser.add_argument('--workers', type=int, default=1, help="抽取进程数")
+    parser.add_argument('--threads', type=int, default=1, help="每个抽取进程的 torch 线程数")
+    parser.add_argument('--poll', type=float, default=10.0, help="队列为空时的轮询间隔 (秒)")
+    parser.add_argument('--drain', action='store_true', help="处理完当前积压后退出")
+    parser.add_argument('--rules-only', action='store_true', help="只运行规则抽取 (正则 + 关注名单)，不加载模型")
+    parser.add_argument('--metrics', help="启用埋点，每轮结束后导出到该文件 (.jsonl 追加，其余为 Prometheus 文本)")
+    parser.add_argument('--rescan', action='store_true',
+                        help="先标记抽取器版本不同或正文已变化的线索并重试用尽次数的失败线索，再开始分析")
+    args = parser.parse_args(argv)
+    if args.rescan and args.rules_only:
+        parser.error("--rescan 需要完整分析，不能与 --rules-only 同时使用")
+    if args.metrics:
+        enable()
+
+    # 模型在队列中确有待分析线索时才加载，空闲的常驻 worker 启动快且不占内存
+    tok = ner = pool = None
+    models_ready = args.rules_only
+    worker_id = default_worker_id()
+    rescan = args.rescan
+    print(f"[{worker_id}] 已启动{' (仅规则抽取，不加载模型)' if args.rules_only else ''}", flush=True)
+
+    while True:
+        conn = get_db_conn()
+        if not conn:
+            print(f"[{worker_id}] 数据库连接失败，{args.poll:.0f} 秒后重试", file=sys.stderr, flush=True)
+            time.sleep(args.poll)
+            continue
+        stats = {'processed': 0}
+        try:
+            # 重扫在加载模型前完成，需要重新分析的线索入队后才能判断是否有待分析线索
+            if rescan or (not args.rules_only and rescan_pending(conn)):
+                marked = mark_stale(conn)
+                rescan = False
+                print(f"[{worker_id}] 重扫完成，{marked} 条线索需要重新分析", flush=True)
+            if not models_ready and has_work(conn):
+                started = time.perf_counter()
+                if args.workers > 1:
+                    pool = make_pool(args.workers, args.threads)
+                    print(f"[{worker_id}] 已启动 {args.workers} 个抽取进程，各自加载模型", flush=True)
+                else:
+                    tok, ner = load_models()
+                    print(f"[{worker_id}] 模型加载完成，用时 {time.perf_counter() - started:.1f} 秒", flush=True)
+                models_ready = True
+            if models_ready:
+                stats = run_analysis_pipeline(
+                    tok, ner, batch_size=args.batch_size, workers=args.workers, threads=args.threads,
+                    claim_size=args.claim_size, worker_id=worker_id, conn=conn, pool=pool,
+                    rules_only=args.rules_only)
+        except Exception:
+            # 断线、死锁、语句超时等只影响本轮：已领取未提交的线索在租约到期后重新入队，常驻 worker 稍后重试
+            print(f"[{worker_id}] 本轮分析出错:\n{traceback.format_exc()}", file=sys.stderr, flush=True)
+            if args.drain:
+                if pool:
+                    pool.terminate()
+                return 1
+            time.sleep(args.poll)
+            continue
+        finally:
+            conn.close()
+        if args.metrics and stats['processed']:
+            dump(args.metrics)
+        if stats['processed']:
+            print(f"[{worker_id}] 分析 {stats['processed']} 条 (复用重复 {stats['reused']} 条, "
+                  f"未变化跳过 {stats['unchanged']} 条, 只重跑规则 {stats['refreshed']} 条), "
+                  f"失败 {stats['failed']} 条, {stats['docs_per_sec']:.1f} 篇/秒", flush=True)
+        if args.drain:
+            break
+        time.sleep(args.poll)
+    if pool:
+        pool.terminate()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())